@@ -0,0 +1,459 @@
+"""
+Benchmarks of the physics kernels.
+
+Every benchmark prepares a workload of N particles and times one step worth of
+a kernel: the historical per-particle functions (``force_gravitationnelle``,
+the pairwise collision pass, ``resolve_colision_fragment``,
+``Particle.update_position``, per-particle drawing) next to the array versions
+that replaced them.
+Each (benchmark, N) gets the best and median time per step and the peak memory
+allocated during a step (tracemalloc, which also sees the numpy buffers).
+
+Results are written as JSON and can be compared with a saved baseline; the
+comparison exits with status 1 when a kernel got slower than the tolerance.
+
+Example::
+
+    python -m simulation.benchmark --sizes 100 1000 10000 100000 --output baseline.json
+    python -m simulation.benchmark --compare baseline.json --tolerance 0.2
+"""
+import argparse
+import csv
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+from simulation.engine import Simulation
+from simulation.physics.particle import ParticleSystem
+from simulation.physics.forces import (
+    distance_euclidienne,
+    force_gravitationnelle,
+    is_collision,
+    collision,
+    resolve_colision_fragment,
+    resolve_fragmentations,
+    gravity_accelerations,
+)
+from simulation.physics.barnes_hut import barnes_hut_accelerations
+from simulation.utils.constants import SCREEN_WIDTH, SCREEN_HEIGHT, FragParams
+
+DEFAULT_SIZES = (100, 1_000, 10_000, 100_000)
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # setup(n, rng) -> function running one step of the kernel on fresh data
+    setup: Callable[[int, np.random.Generator], Callable[[], None]]
+    max_n: int  # Larger sizes are skipped, they would take minutes per step
+    description: str
+
+
+def random_system(n: int, rng: np.random.Generator) -> ParticleSystem:
+    """
+    N bodies spread over the screen, with radii shrinking with N so that the
+    density of contacts stays comparable between sizes.
+
+    :param n: Number of bodies.
+    :param rng: Random generator.
+    """
+    radius = float(np.clip(0.25 * np.sqrt(SCREEN_WIDTH * SCREEN_HEIGHT / n), 1.5, 10))
+    particles = ParticleSystem(capacity=n)
+    particles.add_batch(
+        mass=rng.uniform(50, 400, n),
+        x=rng.uniform(0, SCREEN_WIDTH, n),
+        y=rng.uniform(0, SCREEN_HEIGHT, n),
+        vx=rng.uniform(-6, 6, n),
+        vy=rng.uniform(-6, 6, n),
+        radius=radius,
+    )
+    return particles
+
+
+def explosive_pairs(n: int, rng: np.random.Generator) -> tuple[ParticleSystem, np.ndarray, np.ndarray]:
+    """
+    N/2 pairs of touching bodies colliding fast enough to fragment.
+
+    :param n: Number of bodies.
+    :param rng: Random generator.
+    :return: The system and the slots of the two members of each pair.
+    """
+    pairs = n // 2
+    x = rng.uniform(10, SCREEN_WIDTH - 10, pairs)
+    y = rng.uniform(10, SCREEN_HEIGHT - 10, pairs)
+    particles = ParticleSystem(capacity=2 * pairs)
+    particles.add_batch(  # Victims
+        mass=np.full(pairs, 100.0), x=x, y=y, vx=np.full(pairs, 10.0), vy=np.zeros(pairs), radius=3,
+    )
+    particles.add_batch(  # Impactors
+        mass=np.full(pairs, 400.0), x=x + 4, y=y, vx=np.full(pairs, -10.0), vy=np.zeros(pairs), radius=3,
+    )
+    return particles, np.arange(pairs), np.arange(pairs, 2 * pairs)
+
+
+def _gravity_scalar(n, rng):
+    particles = list(random_system(n, rng))
+
+    def run():
+        for p1 in particles:
+            for p2 in particles:
+                if p1 is not p2:
+                    distance_euclidienne(p1, p2)
+                    force_gravitationnelle(p1, p2)
+    return run
+
+
+def _gravity_direct(n, rng):
+    p = random_system(n, rng)
+    return lambda: gravity_accelerations(p.x, p.y, p.mass, p.radius)
+
+
+def _gravity_barnes_hut(n, rng):
+    p = random_system(n, rng)
+    return lambda: barnes_hut_accelerations(p.x, p.y, p.mass, p.radius)
+
+
+def _collisions_scalar(n, rng):
+    particles = list(random_system(n, rng))
+
+    def run():
+        for k, p1 in enumerate(particles):
+            for p2 in particles[k + 1:]:
+                if is_collision(p1, p2):
+                    collision(p1, p2)
+    return run
+
+
+def _collisions(n, rng):
+    simulation = Simulation(random_system(n, rng), seed=0)
+    return simulation.resolve_collisions
+
+
+def _fragmentation_scalar(n, rng):
+    particles, i, j = explosive_pairs(n, rng)
+    pairs = [(particles[a], particles[b]) for a, b in zip(i.tolist(), j.tolist())]
+    params = FragParams()
+
+    def run():
+        for p1, p2 in pairs:
+            resolve_colision_fragment(p1, p2, params, rng)
+    return run
+
+
+def _fragmentation(n, rng):
+    particles, i, j = explosive_pairs(n, rng)
+    return lambda: resolve_fragmentations(particles, i, j, FragParams(), rng)
+
+
+def _update_position_scalar(n, rng):
+    particles = list(random_system(n, rng))
+
+    def run():
+        for particle in particles:
+            particle.update_position(1)
+    return run
+
+
+def _update_positions(n, rng):
+    particles = random_system(n, rng)
+    return lambda: particles.update_positions(1)
+
+
+_numba = []
+
+
+def _numba_backend():
+    if not _numba:
+        from simulation.physics.backends import NumbaBackend, validate_backend
+        backend = NumbaBackend()  # ImportError without numba, the benchmark is then skipped
+        validate_backend(backend, n=50)  # Compiles the kernels outside of the timings
+        _numba.append(backend)
+    return _numba[0]
+
+
+def _gravity_numba(n, rng):
+    p = random_system(n, rng)
+    gravity = _numba_backend().gravity(gravity_accelerations)
+    return lambda: gravity(p.x, p.y, p.mass, p.radius)
+
+
+def _collisions_numba(n, rng):
+    simulation = Simulation(random_system(n, rng), seed=0, backend=_numba_backend())
+    return simulation.resolve_collisions
+
+
+def _update_positions_numba(n, rng):
+    particles = random_system(n, rng)
+    backend = _numba_backend()
+
+    def run():
+        particles.tick_lifetimes()
+        backend.drift(particles, 1)
+    return run
+
+
+def _render_scalar(n, rng):
+    import pygame
+    from simulation.physics.particle import MaxSizeList
+    from simulation.rendering.rendering2D import draw_particle
+
+    surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    particles = random_system(n, rng)
+    views = list(particles)
+    trails = [MaxSizeList(20) for _ in views]
+
+    def run():
+        surface.fill((0, 0, 0))
+        for particle, trail in zip(views, trails):
+            position = particle.position
+            draw_particle(surface, particle.color, position.x, position.y, particle.radius, trail)
+            trail.append(pygame.Vector2(position.x, position.y))
+    for _ in range(20):  # Fill the trails
+        run()
+        particles.drift(1)
+    return run
+
+
+def _render(n, rng):
+    import pygame
+    from simulation.rendering.rendering2D import ParticleRenderer
+
+    surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    particles = random_system(n, rng)
+    particles.trail_limit[:] = 20
+    renderer = ParticleRenderer("lines")
+    for _ in range(20):
+        renderer.draw(surface, particles)
+        particles.drift(1)
+    return lambda: renderer.draw(surface, particles)
+
+
+BENCHMARKS = {b.name: b for b in (
+    Benchmark("gravity_scalar", _gravity_scalar, 1_000, "distance_euclidienne + force_gravitationnelle over all pairs"),
+    Benchmark("gravity_direct", _gravity_direct, 30_000, "gravity_accelerations, blocked all-pairs"),
+    Benchmark("gravity_numba", _gravity_numba, 30_000, "numba backend, parallel all-pairs"),
+    Benchmark("gravity_barnes_hut", _gravity_barnes_hut, 100_000, "barnes_hut_accelerations"),
+    Benchmark("collisions_scalar", _collisions_scalar, 1_000, "is_collision + collision over all pairs"),
+    Benchmark("collisions", _collisions, 100_000, "Simulation.resolve_collisions (grid broad phase, batched response)"),
+    Benchmark("collisions_numba", _collisions_numba, 100_000, "Simulation.resolve_collisions with the numba grid contacts"),
+    Benchmark("fragmentation_scalar", _fragmentation_scalar, 10_000, "resolve_colision_fragment / generate_fragment per pair"),
+    Benchmark("fragmentation", _fragmentation, 100_000, "resolve_fragmentations over all pairs"),
+    Benchmark("update_position_scalar", _update_position_scalar, 100_000, "Particle.update_position per particle"),
+    Benchmark("update_positions", _update_positions, 100_000, "ParticleSystem.update_positions"),
+    Benchmark("update_positions_numba", _update_positions_numba, 100_000, "tick_lifetimes + numba backend drift"),
+    Benchmark("render_scalar", _render_scalar, 100_000, "draw_particle per particle with MaxSizeList trails"),
+    Benchmark("render", _render, 100_000, "ParticleRenderer from the arrays, ring-buffer trails"),
+)}
+
+
+def measure(benchmark: Benchmark, n: int, min_time: float = 0.5, max_repeats: int = 10, memory: bool = True, seed: int = 0) -> dict:
+    """
+    Time one step of a benchmark, on fresh data for every repeat.
+
+    :param benchmark: Benchmark to run.
+    :param n: Number of particles.
+    :param min_time: Repeat until the timed steps add up to this many seconds...
+    :param max_repeats: ...or until this many repeats.
+    :param memory: Also run one step under tracemalloc to get its peak allocation.
+    :param seed: Seed of the workloads.
+    :return: Dictionary with the best and median time per step and the peak memory in bytes.
+    """
+    rng = np.random.default_rng(seed)
+    times = []
+    while len(times) < max_repeats and (not times or sum(times) < min_time):
+        run = benchmark.setup(n, rng)
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        run = benchmark.setup(n, rng)
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "benchmark": benchmark.name,
+        "n": n,
+        "time": min(times),
+        "time_median": statistics.median(times),
+        "repeats": len(times),
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(names: Optional[list[str]] = None, sizes=DEFAULT_SIZES, force: bool = False, **options) -> list[dict]:
+    """
+    Run benchmarks over several sizes.
+
+    :param names: Benchmarks to run, all of BENCHMARKS by default.
+    :param sizes: Numbers of particles.
+    :param force: Also run the sizes above the ``max_n`` of a benchmark.
+    :param options: Keyword arguments of ``measure``.
+    :return: One result dictionary per (benchmark, size).
+    """
+    results = []
+    for name in names or BENCHMARKS:
+        try:
+            benchmark = BENCHMARKS[name]
+        except KeyError:
+            raise ValueError(f"Unknown benchmark {name!r}, expected one of {sorted(BENCHMARKS)}") from None
+        for n in sizes:
+            if n > benchmark.max_n and not force:
+                continue
+            try:
+                result = measure(benchmark, n, **options)
+            except ImportError as error:
+                print(f"{name:<26} skipped: {error}", file=sys.stderr, flush=True)
+                break
+            results.append(result)
+            print(_format_result(result), file=sys.stderr, flush=True)
+    return results
+
+
+def metadata() -> dict:
+    """Description of the machine and versions, stored with the results."""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float = 0.2) -> list[dict]:
+    """
+    Compare results with a baseline.
+
+    :param results: New results.
+    :param baseline: Results of the reference run.
+    :param tolerance: Relative slowdown above which a kernel is reported as a regression.
+    :return: One dictionary per (benchmark, size) present in both, with the time
+             and memory ratios (new / baseline) and a ``regression`` flag.
+    """
+    reference = {(r["benchmark"], r["n"]): r for r in baseline}
+    rows = []
+    for result in results:
+        base = reference.get((result["benchmark"], result["n"]))
+        if base is None:
+            continue
+        ratio = result["time"] / base["time"] if base["time"] else float("inf")
+        memory_ratio = None
+        if result["peak_bytes"] is not None and base.get("peak_bytes"):
+            memory_ratio = result["peak_bytes"] / base["peak_bytes"]
+        rows.append({
+            "benchmark": result["benchmark"],
+            "n": result["n"],
+            "time": result["time"],
+            "baseline_time": base["time"],
+            "ratio": ratio,
+            "memory_ratio": memory_ratio,
+            "regression": ratio > 1 + tolerance,
+        })
+    return rows
+
+
+def save_results(path: str, results: list[dict]) -> None:
+    """Write results with the metadata of the machine, as JSON."""
+    with open(path, "w") as file:
+        json.dump({"metadata": metadata(), "results": results}, file, indent=1)
+
+
+def load_results(path: str) -> list[dict]:
+    with open(path) as file:
+        return json.load(file)["results"]
+
+
+def save_csv(path: str, results: list[dict]) -> None:
+    """Write the curves as CSV, one row per (benchmark, size)."""
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["benchmark", "n", "time", "time_median", "repeats", "peak_bytes"])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def plot_results(path: str, results: list[dict]) -> None:
+    """
+    Plot time per step and peak memory against N, on log-log axes.
+
+    Needs matplotlib, which is only imported here.
+    """
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise ImportError("Plotting the benchmarks needs matplotlib: pip install matplotlib") from None
+
+    figure, (ax_time, ax_memory) = plt.subplots(1, 2, figsize=(12, 5))
+    for name in dict.fromkeys(r["benchmark"] for r in results):
+        rows = [r for r in results if r["benchmark"] == name]
+        n = [r["n"] for r in rows]
+        ax_time.plot(n, [r["time"] for r in rows], marker="o", label=name)
+        if all(r["peak_bytes"] is not None for r in rows):
+            ax_memory.plot(n, [r["peak_bytes"] / 1024**2 for r in rows], marker="o", label=name)
+    for ax, label in ((ax_time, "time per step (s)"), (ax_memory, "peak memory per step (MiB)")):
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("N")
+        ax.set_ylabel(label)
+        ax.grid(True, which="both", alpha=0.3)
+    ax_time.legend(fontsize="small")
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def _format_result(result: dict) -> str:
+    memory = "" if result["peak_bytes"] is None else f"{result['peak_bytes'] / 1024**2:10.2f} MiB"
+    return f"{result['benchmark']:<24}{result['n']:>8}{result['time'] * 1000:12.3f} ms{memory}"
+
+
+def _format_comparison(row: dict) -> str:
+    flag = "REGRESSION" if row["regression"] else ""
+    memory = "" if row["memory_ratio"] is None else f"  memory x{row['memory_ratio']:.2f}"
+    return f"{row['benchmark']:<24}{row['n']:>8}  time x{row['ratio']:.2f}{memory}  {flag}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the physics kernels.")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=None, help="Benchmarks to run, all by default.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Numbers of particles.")
+    parser.add_argument("--force", action="store_true", help="Also run the sizes above the limit of each benchmark.")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds of timed steps per measurement.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run.")
+    parser.add_argument("--output", default=None, help="Write the results (JSON), e.g. to save a baseline.")
+    parser.add_argument("--csv", default=None, help="Write the curves as CSV.")
+    parser.add_argument("--plot", default=None, help="Plot the curves to an image (needs matplotlib).")
+    parser.add_argument("--compare", default=None, metavar="BASELINE", help="Compare with the results of a previous run.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown reported as a regression.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.only, args.sizes, args.force, min_time=args.min_time, memory=not args.no_memory)
+    if args.output:
+        save_results(args.output, results)
+    if args.csv:
+        save_csv(args.csv, results)
+    if args.plot:
+        plot_results(args.plot, results)
+
+    if args.compare:
+        rows = compare(results, load_results(args.compare), args.tolerance)
+        for row in rows:
+            print(_format_comparison(row))
+        return 1 if any(row["regression"] for row in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Conservation diagnostics.
+
+A ConservationMonitor is an observer sampling, every ``every`` steps, the
+quantities an isolated system conserves: total mass, momentum, angular
+momentum (about the origin of the domain) and energy, kinetic plus potential.
+The potential energy uses the approximation of the active gravity solver: the
+Barnes–Hut tree when the simulation uses it, or when there are more than
+DIAGNOSTICS_DIRECT_MAX particles, and the exact pairwise sum otherwise.
+
+The stages of a step that legitimately change these totals are measured on
+the particles they touch only, and recorded by a ConservationLedger that the
+monitor attaches to the simulation:
+
+- "collisions": the collision response, which dissipates or injects kinetic
+  energy when collisions fragment the particles, and changes the potential
+  energy of the victims and of the fragments spawned next to them,
+- "culling": the particles removed when their lifetime runs out,
+- "walls": the bounces on the walls, which keep the kinetic energy but not the
+  momentum,
+- "merging": the tiny fragments merged by the level of detail, which keeps
+  the mass and momentum but not the kinetic energy.
+
+The potential energy of the collisions and of the culling is the pairwise
+potential of the particles they touch, measured directly while it costs less
+than a direct potential measurement of the whole system per sampling interval.
+
+Every sample gives the drift since the first sample, the changes caused by
+each stage since the previous sample, and the residual: the change that none
+of them explains (integration error, approximate gravity or test particles,
+potential energy of the merged particles, and of the collisions and culling
+above that budget). Steps where a stage changes the energy by more than
+``tolerance`` times the energy scale of the system are flagged, and so are the
+intervals whose residual does.
+"""
+import json
+import logging
+import os
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from simulation.engine import Simulation
+from simulation.physics.particle import ParticleSystem, CONSERVED
+from simulation.physics.forces import potential_energy, gravitational_potentials
+from simulation.physics.barnes_hut import barnes_hut_accelerations, barnes_hut_potential_energy
+from simulation.utils.constants import (
+    DIAGNOSTICS_EVERY, DIAGNOSTICS_TOLERANCE, DIAGNOSTICS_PATH, DIAGNOSTICS_HISTORY, DIAGNOSTICS_DIRECT_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("collisions", "culling", "walls", "merging")
+QUANTITIES = CONSERVED + ("potential",)  # Changes recorded by the ledger
+_KINETIC = QUANTITIES.index("kinetic")
+_POTENTIAL = QUANTITIES.index("potential")
+
+
+def _options(simulation: Simulation, names: tuple) -> dict:
+    """Gravity options of the simulation among ``names``."""
+    return {name: simulation.gravity_options[name] for name in names if name in simulation.gravity_options}
+
+
+class ConservationLedger:
+    """
+    Changes of the conserved quantities caused by each stage of the steps.
+
+    The engine reports the stages while it runs them (``add``, ``remove``) and
+    closes every step with ``end_step``; ``take`` returns what accumulated
+    since its previous call. Changes are arrays ordered like QUANTITIES.
+    """
+    def __init__(self, threshold: float = np.inf, gravity_options: Optional[dict] = None, direct_pairs: int = DIAGNOSTICS_DIRECT_MAX**2):
+        """
+        :param threshold: Change of energy of a stage in one step above which the step is flagged.
+        :param gravity_options: ``softening`` and ``g`` of the potential energy of the stages.
+        :param direct_pairs: Largest number of pairs summed for a potential energy of a stage.
+        """
+        self.threshold = threshold
+        self.gravity_options = dict(gravity_options or {})
+        self.direct_pairs = direct_pairs
+        self._step = {stage: np.zeros(len(QUANTITIES)) for stage in STAGES}
+        self._reset()
+
+    def _reset(self) -> None:
+        self.changes = {stage: np.zeros(len(QUANTITIES)) for stage in STAGES}
+        self.wall_bounces = 0
+        self.flagged = []  # (step, stage, energy change) of the flagged steps
+
+    def add(self, stage: str, change: np.ndarray, potential: Optional[float] = None) -> None:
+        """
+        Record a change of the current step.
+
+        :param stage: One of STAGES.
+        :param change: Change of each quantity of CONSERVED.
+        :param potential: Change of the potential energy, if it was measured.
+        """
+        self._step[stage][:len(CONSERVED)] += change
+        if potential is not None:
+            self._step[stage][_POTENTIAL] += potential
+
+    def potential(self, particles: ParticleSystem, slots: np.ndarray) -> Optional[float]:
+        """
+        Potential energy of the pairs involving some particles, those the
+        other particles do not change.
+
+        :param particles: Particle system.
+        :param slots: Distinct slots of the particles.
+        :return: The potential energy, None when it would sum more than ``direct_pairs`` pairs.
+        """
+        if len(slots) * len(particles) > self.direct_pairs:
+            return None
+        p = particles
+        phi = gravitational_potentials(p.x, p.y, p.mass, p.radius, slots, **self.gravity_options)
+        # The pairs of two particles of slots are in two potentials but only count once
+        internal = potential_energy(p.x[slots], p.y[slots], p.mass[slots], p.radius[slots], **self.gravity_options)
+        return float(np.dot(p.mass[slots], phi) - internal)
+
+    def remove(self, particles: ParticleSystem, slots: np.ndarray) -> None:
+        """
+        Record the removal of particles by the lifetime culling.
+
+        :param particles: Particle system, before the removal.
+        :param slots: Slots of the removed particles.
+        """
+        if len(slots) == 0:
+            return
+        potential = self.potential(particles, slots)
+        self.add("culling", -particles.conserved(slots), None if potential is None else -potential)
+
+    def end_step(self, step: int, particles: ParticleSystem) -> None:
+        """
+        Close a step: collect the wall bounces counted by the particle system
+        and flag the stages that changed the energy too much.
+
+        :param step: Number of the step that just ended.
+        :param particles: Particle system of the simulation.
+        """
+        if particles.wall_bounces:
+            self.wall_bounces += particles.wall_bounces
+            self._step["walls"][1:4] += particles.wall_impulse
+            particles.wall_bounces = 0
+            particles.wall_impulse[:] = 0
+        for stage, change in self._step.items():
+            energy = change[_KINETIC] + change[_POTENTIAL]
+            if abs(energy) > self.threshold:
+                self.flagged.append((step, stage, float(energy)))
+            self.changes[stage] += change
+            change[:] = 0
+
+    def take(self) -> tuple[dict, int, list]:
+        """
+        Collect and reset what accumulated since the previous call.
+
+        :return: Stage -> change, number of wall bounces, flagged steps.
+        """
+        taken = self.changes, self.wall_bounces, self.flagged
+        self._reset()
+        return taken
+
+
+def system_potential_energy(simulation: Simulation, direct_max: int = DIAGNOSTICS_DIRECT_MAX) -> float:
+    """
+    Potential energy of the particles, with the approximation of the active gravity solver.
+
+    :param simulation: Simulation to measure.
+    :param direct_max: Largest number of particles for which the exact pairwise sum is used.
+    :return: Potential energy.
+    """
+    particles = simulation.particles
+    solver = simulation.gravity_solver
+    kwargs = _options(simulation, ("softening", "g"))
+    if solver is barnes_hut_accelerations or len(particles) > direct_max:
+        if solver is barnes_hut_accelerations:
+            kwargs.update(_options(simulation, ("theta", "leaf_size")))
+        return barnes_hut_potential_energy(particles.x, particles.y, particles.mass, particles.radius, **kwargs)
+    return potential_energy(particles.x, particles.y, particles.mass, particles.radius, **kwargs)
+
+
+def measure(simulation: Simulation, direct_max: int = DIAGNOSTICS_DIRECT_MAX) -> dict:
+    """
+    Conserved quantities of the current state.
+
+    :param simulation: Simulation to measure.
+    :param direct_max: Largest number of particles for which the potential energy is exact.
+    :return: Dictionary with the step, time, number of particles, the totals of
+             CONSERVED and the potential and total energies.
+    """
+    particles = simulation.particles
+    sample = {"step": simulation.step_count, "time": simulation.time, "particles": len(particles)}
+    sample.update(zip(CONSERVED, particles.conserved().tolist()))
+    sample["potential"] = system_potential_energy(simulation, direct_max)
+    sample["energy"] = sample["kinetic"] + sample["potential"]
+    return sample
+
+
+class ConservationMonitor:
+    """
+    Observer sampling the conserved quantities every ``every`` steps.
+
+    The first call takes the reference sample and attaches a ConservationLedger
+    to the simulation. Samples are kept in ``samples`` (the last ``history``
+    ones) and appended to ``path`` as JSON Lines when it is given. Besides the
+    totals of ``measure``, a sample holds:
+
+    - ``drift``: change since the reference sample, relative for the mass and
+      the energy (to the energy scale, kinetic plus absolute potential energy),
+    - ``stages``: change caused by each stage since the previous sample, and
+      ``wall_bounces``,
+    - ``residual``: change since the previous sample not caused by the stages,
+      with the energy relative to the energy scale,
+    - ``flags``: the steps and intervals whose energy change exceeds ``tolerance``.
+    """
+    def __init__(
+        self,
+        every: int = DIAGNOSTICS_EVERY,
+        tolerance: float = DIAGNOSTICS_TOLERANCE,
+        path: Optional[str] = DIAGNOSTICS_PATH,
+        history: int = DIAGNOSTICS_HISTORY,
+        direct_max: int = DIAGNOSTICS_DIRECT_MAX,
+    ):
+        """
+        :param every: Number of steps between two samples.
+        :param tolerance: Relative energy change that gets flagged.
+        :param path: JSON Lines file receiving the samples, None to keep them in memory only.
+        :param history: Number of samples kept in memory.
+        :param direct_max: Largest number of particles for which the potential energy is exact.
+        """
+        if every <= 0:
+            raise ValueError("every must be positive")
+        self.every = every
+        self.tolerance = tolerance
+        self.path = path
+        self.direct_max = direct_max
+        self.samples = deque(maxlen=history)
+        self.reference = None
+        self.previous = None
+        self.ledger = None
+        self.scale = None
+        self._file = None
+
+    def _start(self, simulation: Simulation) -> None:
+        """Take the reference sample and start recording the stages."""
+        self.reference = self.previous = measure(simulation, self.direct_max)
+        self.scale = self.reference["kinetic"] + abs(self.reference["potential"]) or 1.0
+        self.ledger = simulation.ledger = ConservationLedger(
+            # Culling pairs per step: one direct potential measurement spread over the interval
+            self.tolerance * self.scale, _options(simulation, ("softening", "g")), self.direct_max**2 // self.every,
+        )
+        simulation.particles.wall_bounces = 0
+        simulation.particles.wall_impulse[:] = 0
+
+    def __call__(self, simulation: Simulation) -> None:
+        if self.ledger is None or simulation.ledger is not self.ledger:
+            self._start(simulation)
+            return
+        if simulation.step_count % self.every:
+            return
+        with simulation.profiler.phase("diagnostics"):
+            sample = self.sample(simulation)
+        self.samples.append(sample)
+        if self.path is not None:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a")
+            self._file.write(json.dumps(sample) + "\n")
+            self._file.flush()
+
+    def sample(self, simulation: Simulation) -> dict:
+        """
+        Measure the simulation and account for the changes since the previous sample.
+
+        :param simulation: Simulation the monitor observes.
+        :return: The sample, see the class documentation.
+        """
+        sample = measure(simulation, self.direct_max)
+        reference, previous = self.reference, self.previous
+        changes, bounces, flagged = self.ledger.take()
+
+        drift = {name: sample[name] - reference[name] for name in CONSERVED + ("energy",)}
+        drift["mass"] /= reference["mass"] or 1.0
+        drift["energy"] /= self.scale
+        del drift["kinetic"]
+
+        explained = sum(changes.values())
+        residual = {name: sample[name] - previous[name] - explained[k] for k, name in enumerate(CONSERVED)}
+        explained_energy = explained[_KINETIC] + explained[_POTENTIAL]
+        residual["energy"] = (sample["energy"] - previous["energy"] - explained_energy) / self.scale
+        del residual["kinetic"]
+
+        flags = [{"step": step, "stage": stage, "energy": energy} for step, stage, energy in flagged]
+        if abs(residual["energy"]) > self.tolerance:
+            flags.append({"step": sample["step"], "stage": "residual", "energy": float(residual["energy"] * self.scale)})
+            logger.warning(
+                "Steps %d-%d: energy changed by %.3g of its scale without a collision, culling or wall to account for it",
+                previous["step"], sample["step"], residual["energy"],
+            )
+        if flagged and logger.isEnabledFor(logging.INFO):
+            logger.info("Steps %d-%d: energy changed by %s", previous["step"], sample["step"], ", ".join(
+                f"{energy:+.3g} ({stage}, step {step})" for step, stage, energy in flagged
+            ))
+
+        sample.update(
+            drift=drift,
+            stages={stage: dict(zip(QUANTITIES, change.tolist())) for stage, change in changes.items()},
+            wall_bounces=bounces,
+            residual=residual,
+            flags=flags,
+        )
+        self.previous = sample
+        return sample
+
+    def close(self) -> None:
+        """Close the samples file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,210 @@
+import logging
+from typing import Callable, Optional
+
+import numpy as np
+
+from simulation.physics.particle import Particle, ParticleSystem
+from simulation.physics.broadphase import SpatialHash
+from simulation.physics.integrators import Integrator, get_integrator
+from simulation.physics.backends import NumpyBackend, get_backend
+from simulation.physics.lod import LevelOfDetail
+from simulation.physics.forces import (
+    get_gravity_solver,
+    resolve_elastic_collisions,
+    resolve_fragmentations,
+)
+from simulation.utils.log import EventCounter
+from simulation.utils.profiling import StepProfiler
+from simulation.utils.constants import (
+    GRAVITY_SOLVER, INTEGRATOR, CONTACT_POLICY, SEED, PROFILER_ENABLED, PROFILER_WINDOW, BACKEND, FragParams,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Simulation:
+    """
+    Headless simulation engine.
+
+    Owns the particle system and advances it one step at a time without any
+    dependency on pygame. Observers are called after every step with the
+    simulation as only argument, which is how rendering, recording or
+    diagnostics are attached.
+    """
+    def __init__(
+        self,
+        particles: Optional[ParticleSystem] = None,
+        dt: float = 1,
+        gravity_solver=GRAVITY_SOLVER,
+        integrator=INTEGRATOR,
+        fragmentation: bool = False,
+        contact_policy: str = CONTACT_POLICY,
+        params: FragParams = FragParams(),
+        seed: Optional[int] = SEED,
+        profiler: Optional[StepProfiler] = None,
+        backend=BACKEND,
+        gravity_options: Optional[dict] = None,
+        lod: Optional[LevelOfDetail] = None,
+    ):
+        """
+        Initialize the simulation.
+
+        :param particles: Initial particles, an empty system by default.
+        :param dt: Default time step.
+        :param gravity_solver: Name of a solver in GRAVITY_SOLVERS or a function with the same signature.
+        :param integrator: Name of an integrator in INTEGRATORS or an Integrator instance.
+        :param fragmentation: Resolve collisions with ``resolve_fragmentations`` instead of ``resolve_collision``.
+        :param contact_policy: How the velocity changes of a particle in several contacts combine, see CONTACT_POLICIES.
+        :param params: Fragmentation parameters.
+        :param seed: Seed of the random generator. When None a fresh seed is
+                     drawn, and recorded in ``self.seed`` either way.
+        :param profiler: Per-phase timers of the steps, a new StepProfiler by default.
+        :param backend: Name of a backend in BACKENDS ("numpy" or "numba") or a backend instance.
+        :param gravity_options: Keyword arguments of the gravity solver, e.g. ``g``, ``softening`` or ``theta``.
+        :param lod: Level of detail of the fragments (test particles, particle budget), from the constants by default.
+        """
+        self.particles = particles if particles is not None else ParticleSystem()
+        self.dt = dt
+        self.gravity_solver = get_gravity_solver(gravity_solver) if isinstance(gravity_solver, str) else gravity_solver
+        self.gravity_options = dict(gravity_options or {})
+        self.lod = lod if lod is not None else LevelOfDetail()
+        self.integrator: Integrator = get_integrator(integrator) if isinstance(integrator, str) else integrator
+        self.backend: NumpyBackend = get_backend(backend) if isinstance(backend, str) else backend
+        self.integrator.backend = self.backend
+        self.fragmentation = fragmentation
+        self.contact_policy = contact_policy
+        self.params = params
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.rng = np.random.default_rng(self.seed)
+        self.grid = SpatialHash()
+        self.events = EventCounter()
+        self.profiler = profiler if profiler is not None else StepProfiler(PROFILER_ENABLED, PROFILER_WINDOW)
+        self.step_count = 0
+        self.time = 0.0
+        self.ledger = None  # ConservationLedger attached by a ConservationMonitor, see simulation/diagnostics.py
+        self.observers: list[Callable[['Simulation'], None]] = []
+
+    def add_observer(self, observer: Callable[['Simulation'], None]) -> None:
+        """
+        Register a function called after every step.
+
+        :param observer: Callable taking the simulation.
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer: Callable[['Simulation'], None]) -> None:
+        self.observers.remove(observer)
+
+    def add_particle(self, particle: Particle) -> None:
+        """
+        Add a particle to the simulation.
+
+        :param particle: Particle to add.
+        """
+        self.particles.append(particle)
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, targets: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Gravitational acceleration of every particle if they were at (x, y).
+
+        :param x: X positions, aligned with the particle arrays.
+        :param y: Y positions, aligned with the particle arrays.
+        :param targets: Slots of the particles to compute, all of them by default.
+        :return: Tuple of arrays (ax, ay), aligned with ``targets`` when given.
+        """
+        particles = self.particles
+        self.profiler.count("gravity_evaluations")
+        with self.profiler.phase("gravity"):
+            solver = self.backend.gravity(self.gravity_solver)
+            options = dict(self.gravity_options)
+            sources = self.lod.sources(particles)
+            if sources is not None:
+                options["sources"] = sources
+            if targets is not None:
+                options["targets"] = targets
+            return solver(x, y, particles.mass, particles.radius, **options)
+
+    def resolve_collisions(self) -> None:
+        """Find the contacts with the broad phase and resolve them all at once."""
+        particles = self.particles
+        profiler = self.profiler
+
+        with profiler.phase("broad_phase"):
+            self.grid.update(particles)
+        i, j, candidates = self.backend.contacts(particles, self.grid, profiler)
+        profiler.count("candidate_pairs", candidates)
+        profiler.count("contacts", len(i))
+        self.events.add("contacts", len(i))
+
+        ledger = self.ledger
+        if ledger is not None and len(i):
+            # Only the particles in contact change, plus the fragments appended after them
+            touched = np.unique(np.concatenate((i, j)))
+            n_before = len(particles)
+            before = particles.conserved(touched)
+            potential_before = ledger.potential(particles, touched)
+
+        if self.fragmentation:
+            with profiler.phase("fragmentation"):
+                resolve_fragmentations(particles, i, j, self.params, self.rng, self.contact_policy, self.events)
+        else:
+            with profiler.phase("collision_response"):
+                resolve_elastic_collisions(particles, i, j, self.contact_policy)
+
+        if ledger is not None and len(i):
+            changed = np.concatenate((touched, np.arange(n_before, len(particles))))
+            potential = None
+            if potential_before is not None:
+                potential_after = ledger.potential(particles, changed)
+                if potential_after is not None:
+                    potential = potential_after - potential_before
+            ledger.add("collisions", particles.conserved(changed) - before, potential)
+
+    def step(self, dt: Optional[float] = None) -> None:
+        """
+        Advance the simulation by one time step.
+
+        :param dt: Time step, ``self.dt`` by default.
+        """
+        dt = self.dt if dt is None else dt
+        particles = self.particles
+        profiler = self.profiler
+        profiler.start_step(self.step_count + 1)
+
+        with profiler.phase("lifetime_culling"):
+            if self.ledger is not None:
+                self.ledger.remove(particles, np.flatnonzero(particles.lifetime <= 0))
+            self.events.add("culled", particles.cull_expired())
+
+        # Gravity and collisions are timed in their own phases, nested in this one
+        with profiler.phase("integration"):
+            self.integrator.step(particles, dt, self.accelerations, self.resolve_collisions)
+        with profiler.phase("lifetime_culling"):
+            particles.tick_lifetimes()
+        with profiler.phase("merging"):
+            merged, change = self.lod.merge(particles, self.params)
+        if merged:
+            self.events.add("merged", merged)
+            if self.ledger is not None:
+                self.ledger.add("merging", change)
+        profiler.count("particles", len(particles))
+
+        self.step_count += 1
+        self.time += dt
+        if self.ledger is not None:
+            self.ledger.end_step(self.step_count, particles)
+        events = self.events.end_step()
+        if events and logger.isEnabledFor(logging.INFO):
+            logger.info("Step %d: %s", self.step_count, ", ".join(f"{count} {name}" for name, count in events.items()))
+        for observer in self.observers:
+            observer(self)
+
+    def run(self, n_steps: int, dt: Optional[float] = None) -> None:
+        """
+        Advance the simulation by several steps as fast as possible.
+
+        :param n_steps: Number of steps.
+        :param dt: Time step, ``self.dt`` by default.
+        """
+        for _ in range(n_steps):
+            self.step(dt)
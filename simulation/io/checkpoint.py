@@ -0,0 +1,236 @@
+"""
+Binary checkpoints of a whole Simulation.
+
+Layout of a checkpoint file (little-endian)::
+
+    magic     8 bytes   b"PSIMCKPT"
+    version   uint32
+    length    uint32    size of the header in bytes
+    header    JSON      metadata and the table of the arrays
+    arrays    raw       each array starts on a 64-byte boundary, the particle
+                        fields, the TrailStore of the trails and the color index
+
+The header holds everything that is not a per-particle number: step count,
+time, random generator state, FragParams, solver, integrator, backend and
+level of detail settings, the domain, the palette of colors, and for each array its dtype,
+shape and offset. The arrays are stored raw so that ``load_checkpoint`` can map them with ``np.memmap``
+(copy-on-write) instead of reading them: restarting a large run only costs
+reading the header, pages are loaded when the physics first touches them.
+"""
+import dataclasses
+import json
+import logging
+import os
+import struct
+from typing import Optional
+
+import numpy as np
+
+from simulation.engine import Simulation
+from simulation.physics.particle import ParticleSystem
+from simulation.physics.trails import TrailStore
+from simulation.physics.forces import GRAVITY_SOLVERS
+from simulation.physics.integrators import get_integrator
+from simulation.physics.lod import LevelOfDetail
+from simulation.utils.constants import FragParams
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PSIMCKPT"
+VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _solver_name(solver) -> Optional[str]:
+    """Name of a registered gravity solver, None for a custom function."""
+    for name, function in GRAVITY_SOLVERS.items():
+        if function is solver:
+            return name
+    return None
+
+
+def _color_arrays(colors: list) -> tuple[list, np.ndarray]:
+    """Palette of the distinct colors and the palette index of each particle."""
+    palette = {}
+    index = np.fromiter((palette.setdefault(color, len(palette)) for color in colors), dtype=np.uint32, count=len(colors))
+    return list(palette), index
+
+
+def save_checkpoint(simulation: Simulation, path: str) -> None:
+    """
+    Write the full state of a simulation to ``path``.
+
+    The file is written next to its destination, synced, then renamed over
+    it, so a crash during the write leaves the previous checkpoint intact.
+
+    :param simulation: Simulation to save.
+    :param path: Destination file.
+    """
+    particles = simulation.particles
+    arrays = {name: getattr(particles, name) for name, _ in ParticleSystem._FIELDS}
+    trails = particles.trails
+    arrays.update(trail_points=trails.points, trail_head=trails.head, trail_count=trails.count, trail_row_limit=trails.limit)
+    palette, arrays["color_index"] = _color_arrays(particles.colors)
+
+    solver = _solver_name(simulation.gravity_solver)
+    if solver is None:
+        logger.warning("Custom gravity solver %r is not saved in the checkpoint.", simulation.gravity_solver)
+    header = {
+        "step_count": simulation.step_count,
+        "time": simulation.time,
+        "dt": simulation.dt,
+        "seed": simulation.seed,
+        "rng_state": simulation.rng.bit_generator.state,
+        "params": dataclasses.asdict(simulation.params),
+        "gravity_solver": solver,
+        "gravity_options": simulation.gravity_options,
+        "lod": simulation.lod.options(),
+        "integrator": simulation.integrator.name,
+        "integrator_options": simulation.integrator.options(),
+        "backend": simulation.backend.name,
+        "fragmentation": simulation.fragmentation,
+        "contact_policy": simulation.contact_policy,
+        "events": dict(simulation.events.total),
+        "next_id": particles.next_id,
+        "domain": [particles.width, particles.height],
+        "palette": palette,
+        "arrays": {},
+    }
+
+    # The offsets depend on the header length, which depends on the offsets:
+    # reserve room for them by laying out the arrays after a first estimate
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, array in arrays.items():
+            offset = _aligned(offset)
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += array.nbytes
+        encoded = json.dumps(header).encode()
+        needed = _aligned(_PREAMBLE.size + len(encoded))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(_PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+        file.write(encoded)
+        for name, array in arrays.items():
+            file.seek(header["arrays"][name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def read_header(path: str) -> dict:
+    """
+    Read the metadata of a checkpoint without touching its arrays.
+
+    :param path: Checkpoint file.
+    :return: Header dictionary.
+    """
+    with open(path, "rb") as file:
+        preamble = file.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise ValueError(f"{path} is too short to be a checkpoint")
+        magic, version, length = _PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a checkpoint file")
+        if version != VERSION:
+            raise ValueError(f"{path} has checkpoint version {version}, this version reads version {VERSION}")
+        return json.loads(file.read(length))
+
+
+def load_arrays(path: str, header: dict, mmap: bool = True) -> dict:
+    """
+    Map (or read) the arrays of a checkpoint.
+
+    :param path: Checkpoint file.
+    :param header: Header of the file, from ``read_header``.
+    :param mmap: Copy-on-write memory-maps instead of reading the arrays into memory.
+    :return: Array name -> array.
+    """
+    arrays = {}
+    with open(path, "rb") as file:
+        for name, entry in header["arrays"].items():
+            dtype, shape, offset = np.dtype(entry["dtype"]), tuple(entry["shape"]), entry["offset"]
+            count = int(np.prod(shape))
+            if count == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=shape)
+            else:
+                file.seek(offset)
+                arrays[name] = np.fromfile(file, dtype=dtype, count=count).reshape(shape)
+    return arrays
+
+
+def load_checkpoint(path: str, mmap: bool = True) -> Simulation:
+    """
+    Recreate the simulation saved in a checkpoint, ready to continue where it stopped.
+
+    :param path: Checkpoint file.
+    :param mmap: Map the particle arrays from the file instead of reading them.
+    :return: The restored simulation.
+    """
+    header = read_header(path)
+    arrays = load_arrays(path, header, mmap)
+    palette = [tuple(color) if isinstance(color, list) else color for color in header["palette"]]
+    colors = [palette[k] for k in arrays.pop("color_index").tolist()]
+    trails = TrailStore.from_arrays(
+        arrays.pop("trail_points"), arrays.pop("trail_head"), arrays.pop("trail_count"), arrays.pop("trail_row_limit"),
+    )
+    particles = ParticleSystem.from_arrays(arrays, colors, header["next_id"], trails, *header["domain"])
+
+    options = {}
+    if header["gravity_solver"] is not None:
+        options["gravity_solver"] = header["gravity_solver"]
+    simulation = Simulation(
+        particles,
+        dt=header["dt"],
+        integrator=get_integrator(header["integrator"], **header["integrator_options"]),
+        fragmentation=header["fragmentation"],
+        contact_policy=header["contact_policy"],
+        params=FragParams(**header["params"]),
+        seed=header["seed"],
+        backend=header["backend"],
+        gravity_options=header["gravity_options"],
+        lod=LevelOfDetail(**header["lod"]),
+        **options,
+    )
+    simulation.rng.bit_generator.state = header["rng_state"]
+    simulation.step_count = header["step_count"]
+    simulation.time = header["time"]
+    simulation.events.total.update(header["events"])
+    return simulation
+
+
+class AutoCheckpoint:
+    """
+    Observer saving a checkpoint every ``every`` steps.
+
+    ``path`` may contain ``{step}`` to keep one file per checkpoint; with a fixed
+    path each checkpoint atomically replaces the previous one.
+    """
+    def __init__(self, path: str, every: int):
+        """
+        :param path: Destination file, optionally with a ``{step}`` field.
+        :param every: Number of steps between two checkpoints.
+        """
+        if every <= 0:
+            raise ValueError("every must be positive")
+        self.path = path
+        self.every = every
+
+    def __call__(self, simulation: Simulation) -> None:
+        if simulation.step_count % self.every == 0:
+            path = self.path.format(step=simulation.step_count)
+            save_checkpoint(simulation, path)
+            logger.info("Checkpoint of step %d written to %s", simulation.step_count, path)
@@ -0,0 +1,418 @@
+"""
+Streaming trajectory recording.
+
+``TrajectoryWriter`` is a simulation observer copying the particle arrays every
+``every`` steps into an in-memory chunk. Full chunks are handed to a background
+thread that compresses them to ``chunk_XXXXXX.npz`` files, so the step loop
+only pays for the copies. A directory then looks like::
+
+    index.json          metadata, list of the chunks and color palette
+    chunk_000000.npz    frames of the first chunk
+    chunk_000001.npz    ...
+
+The number of particles changes between frames (fragments are born, expired
+particles die), so the frames of a chunk are concatenated: frame ``k`` holds
+the entries ``offsets[k]:offsets[k + 1]`` of ``ids`` and of every field. Ids
+are the stable ids of the ParticleSystem; births and deaths are stored per
+chunk as (id, step) pairs, at the resolution of the recorded frames.
+
+A writer opened on a directory that already holds a recording continues it, as
+a run resumed from a checkpoint does: the frames from the first step it records
+on are dropped, the earlier ones are kept and the new chunks follow them.
+
+``TrajectoryReader`` loads the chunks lazily, one at a time, while iterating
+over a range of steps.
+"""
+import bisect
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Iterator, NamedTuple, Optional
+
+import numpy as np
+
+from simulation.utils.constants import SCREEN_WIDTH, SCREEN_HEIGHT
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+FORMAT_VERSION = 1
+DEFAULT_FIELDS = ("x", "y", "vx", "vy", "mass", "radius", "flags")
+
+
+class Frame(NamedTuple):
+    step: int
+    time: float
+    ids: np.ndarray
+    data: dict  # Field name -> array aligned with ids
+
+
+def _write_atomic(path: str, write) -> None:
+    """Call ``write(file)`` on a temporary file, then rename it to ``path``."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        write(file)
+    os.replace(temporary, path)
+
+
+class TrajectoryWriter:
+    """
+    Observer streaming the trajectories of a simulation to a directory.
+
+    Use it as a context manager, or call ``close`` at the end of the run so
+    that the last partial chunk is written.
+    """
+    def __init__(
+        self,
+        directory: str,
+        every: int = 1,
+        chunk_steps: int = 256,
+        fields: tuple = DEFAULT_FIELDS,
+        dtype=np.float64,
+        compress: bool = True,
+        max_pending: int = 4,
+    ):
+        """
+        :param directory: Output directory, created if needed. A recording already in it is continued.
+        :param every: Record one step out of ``every``.
+        :param chunk_steps: Number of frames per chunk file.
+        :param fields: Particle arrays to record, among the fields of ParticleSystem.
+        :param dtype: Storage type of the floating point fields, e.g. np.float32 to halve the size.
+        :param compress: Compress the chunks (np.savez_compressed).
+        :param max_pending: Chunks waiting for the writer thread before the simulation blocks.
+        """
+        if every <= 0 or chunk_steps <= 0:
+            raise ValueError("every and chunk_steps must be positive")
+        self.directory = directory
+        self.every = every
+        self.chunk_steps = chunk_steps
+        self.fields = tuple(fields)
+        self.dtype = np.dtype(dtype)
+        self.compress = compress
+        os.makedirs(directory, exist_ok=True)
+
+        self.chunks = []
+        self.palette = {}
+        self.metadata = {"version": FORMAT_VERSION, "every": every, "fields": list(self.fields)}
+        self._frames = []
+        self._previous_ids = np.empty(0, dtype=np.int64)
+        self._known_ids = 0  # Ids below have their color recorded
+        self._births = []
+        self._deaths = []
+        self._colors = []
+        self._error = None
+        self._closed = False
+        self._stored = None
+        if os.path.exists(os.path.join(directory, INDEX_FILE)):
+            self._stored = TrajectoryReader(directory)
+            if self._stored.fields != self.fields:
+                raise ValueError(f"{directory} records the fields {self._stored.fields}, not {self.fields}")
+        self._queue = queue.Queue(max_pending)
+        # Daemon so that a forgotten close() cannot hang the interpreter at exit
+        self._thread = threading.Thread(target=self._work, name="trajectory-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __call__(self, simulation) -> None:
+        """Record the current step of ``simulation`` if it falls on the recording period."""
+        if self._error is not None:
+            raise RuntimeError("trajectory writer thread failed") from self._error
+        if simulation.step_count % self.every:
+            return
+        if "seed" not in self.metadata:
+            self.metadata.update(dt=simulation.dt, seed=simulation.seed)
+        self.record(simulation.particles, simulation.step_count, simulation.time)
+
+    def record(self, particles, step: int, time: float = 0.0) -> None:
+        """
+        Add a frame of ``particles`` to the current chunk.
+
+        :param particles: ParticleSystem to record.
+        :param step: Step number of the frame.
+        :param time: Simulated time of the frame.
+        """
+        if "domain" not in self.metadata:
+            self.metadata["domain"] = [particles.width, particles.height]
+        if self._stored is not None:
+            self._continue(self._stored, step)
+            self._stored = None
+        ids = particles.ids.copy()
+        data = {}
+        for name in self.fields:
+            array = getattr(particles, name)
+            data[name] = array.astype(self.dtype) if array.dtype.kind == "f" else array.copy()
+
+        born = ids[ids >= self._known_ids]
+        if len(born):
+            slots = np.flatnonzero(ids >= self._known_ids)
+            colors = particles.colors
+            self._births.append((born, np.full(len(born), step, dtype=np.int64)))
+            self._colors.append((born, np.fromiter(
+                (self.palette.setdefault(colors[k], len(self.palette)) for k in slots.tolist()),
+                dtype=np.uint32, count=len(slots),
+            )))
+            self._known_ids = int(born.max()) + 1
+        died = np.setdiff1d(self._previous_ids, ids, assume_unique=True)
+        if len(died):
+            self._deaths.append((died, np.full(len(died), step, dtype=np.int64)))
+        self._previous_ids = ids
+
+        self._frames.append((step, time, ids, data))
+        if len(self._frames) >= self.chunk_steps:
+            self.flush()
+
+    def _continue(self, reader: "TrajectoryReader", step: int) -> None:
+        """
+        Keep the frames of the recording already in the directory that come before ``step``.
+
+        A chunk straddling ``step`` is cut, later ones are deleted, and the known ids,
+        the ids of the last kept frame and the palette carry on into the new frames.
+
+        :param reader: Reader of the recording in the directory.
+        :param step: First step recorded by this writer.
+        """
+        kept = [dict(entry) for entry in reader.chunks if entry["first_step"] < step]
+        if kept and kept[-1]["last_step"] >= step:
+            chunk = reader.load_chunk(len(kept) - 1)
+            frames = int(np.searchsorted(chunk["steps"], step))
+            end = chunk["offsets"][frames]
+            born = chunk["born_steps"] < step
+            died = chunk["died_steps"] < step
+            colored = np.isin(chunk["color_ids"], chunk["born_ids"][born])
+            chunk.update(
+                steps=chunk["steps"][:frames], time=chunk["time"][:frames], offsets=chunk["offsets"][:frames + 1],
+                born_ids=chunk["born_ids"][born], born_steps=chunk["born_steps"][born],
+                died_ids=chunk["died_ids"][died], died_steps=chunk["died_steps"][died],
+                color_ids=chunk["color_ids"][colored], color_index=chunk["color_index"][colored],
+                **{name: chunk[name][:end] for name in ("ids", *self.fields)},
+            )
+            save = np.savez_compressed if self.compress else np.savez
+            _write_atomic(os.path.join(self.directory, kept[-1]["file"]), lambda file: save(file, **chunk))
+            kept[-1].update(last_step=int(chunk["steps"][-1]), frames=frames)
+
+        self.chunks = kept
+        self.palette = {color: k for k, color in enumerate(reader.palette)}
+        if kept:
+            born = [reader.load_chunk(k, ("born_ids",))["born_ids"] for k in range(len(kept))]
+            self._known_ids = int(np.concatenate(born).max(initial=-1)) + 1
+            last = reader.load_chunk(len(kept) - 1, ("offsets", "ids"))
+            self._previous_ids = last["ids"][last["offsets"][-2]:last["offsets"][-1]]
+        # Index first, so that it never lists a deleted file
+        self._save_index(kept, list(self.palette))
+        files = {entry["file"] for entry in kept}
+        for name in os.listdir(self.directory):
+            if name.startswith("chunk_") and name.endswith(".npz") and name not in files:
+                os.remove(os.path.join(self.directory, name))
+
+    def flush(self) -> None:
+        """Hand the current partial chunk to the writer thread."""
+        if not self._frames:
+            return
+        frames, self._frames = self._frames, []
+        chunk = {
+            "steps": np.array([frame[0] for frame in frames], dtype=np.int64),
+            "time": np.array([frame[1] for frame in frames], dtype=np.float64),
+            "offsets": np.concatenate(([0], np.cumsum([len(frame[2]) for frame in frames]))).astype(np.int64),
+            "ids": np.concatenate([frame[2] for frame in frames]),
+        }
+        for name in self.fields:
+            chunk[name] = np.concatenate([frame[3][name] for frame in frames])
+        chunk["born_ids"], chunk["born_steps"] = self._concatenate(self._births)
+        chunk["died_ids"], chunk["died_steps"] = self._concatenate(self._deaths)
+        chunk["color_ids"], chunk["color_index"] = self._concatenate(self._colors)
+        self._births, self._deaths, self._colors = [], [], []
+
+        entry = {
+            "file": f"chunk_{len(self.chunks):06d}.npz",
+            "first_step": int(chunk["steps"][0]),
+            "last_step": int(chunk["steps"][-1]),
+            "frames": len(frames),
+        }
+        self.chunks.append(entry)
+        self._queue.put((entry, chunk, list(self.palette)))
+
+    @staticmethod
+    def _concatenate(pairs: list) -> tuple[np.ndarray, np.ndarray]:
+        """Concatenate a list of (ids, values) array pairs."""
+        if not pairs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate([p[0] for p in pairs]), np.concatenate([p[1] for p in pairs])
+
+    def _work(self) -> None:
+        save = np.savez_compressed if self.compress else np.savez
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                entry, chunk, palette = item
+                if self._error is None:
+                    _write_atomic(os.path.join(self.directory, entry["file"]), lambda file: save(file, **chunk))
+                    self._write_index(entry, palette)
+            except Exception as error:
+                logger.exception("Failed to write trajectory chunk")
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _write_index(self, last_entry: dict, palette: list) -> None:
+        """Rewrite the index so that it lists every chunk written so far."""
+        self._save_index(self.chunks[:self.chunks.index(last_entry) + 1], palette)
+
+    def _save_index(self, chunks: list, palette: list) -> None:
+        index = {**self.metadata, "chunks": chunks, "palette": palette}
+        _write_atomic(os.path.join(self.directory, INDEX_FILE), lambda file: file.write(json.dumps(index).encode()))
+
+    def close(self) -> None:
+        """Write the last chunk and wait for the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("trajectory writer thread failed") from self._error
+
+
+class TrajectoryReader:
+    """
+    Lazy access to a directory written by TrajectoryWriter.
+
+    Only the index is read on creation; chunks are loaded one at a time when
+    frames from them are requested.
+    """
+    def __init__(self, directory: str):
+        """
+        :param directory: Directory of the recording.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            self.index = json.load(file)
+        if self.index.get("version", FORMAT_VERSION) > FORMAT_VERSION:
+            raise ValueError(f"{directory} has trajectory version {self.index['version']}, this version reads up to {FORMAT_VERSION}")
+        self.fields = tuple(self.index["fields"])
+        self.domain = tuple(self.index.get("domain", (SCREEN_WIDTH, SCREEN_HEIGHT)))  # Width and height
+        self.chunks = self.index["chunks"]
+        self.palette = [tuple(color) if isinstance(color, list) else color for color in self.index["palette"]]
+        self._first_steps = [chunk["first_step"] for chunk in self.chunks]
+        self._cache = (None, None)  # Last chunk read by frame()
+
+    @property
+    def first_step(self) -> Optional[int]:
+        return self.chunks[0]["first_step"] if self.chunks else None
+
+    @property
+    def last_step(self) -> Optional[int]:
+        return self.chunks[-1]["last_step"] if self.chunks else None
+
+    def __len__(self) -> int:
+        """Number of recorded frames."""
+        return sum(chunk["frames"] for chunk in self.chunks)
+
+    def load_chunk(self, k: int, keys: Optional[tuple] = None) -> dict:
+        """
+        Read the arrays of the ``k``-th chunk.
+
+        :param k: Position of the chunk in ``self.chunks``.
+        :param keys: Arrays to read, all by default.
+        """
+        with np.load(os.path.join(self.directory, self.chunks[k]["file"])) as data:
+            return {key: data[key] for key in (data.files if keys is None else keys)}
+
+    def steps(self) -> np.ndarray:
+        """Step numbers of all the frames (reads every chunk)."""
+        return np.concatenate([self.load_chunk(k, ("steps",))["steps"] for k in range(len(self.chunks))]) if self.chunks else np.empty(0, dtype=np.int64)
+
+    def frames(self, start: Optional[int] = None, stop: Optional[int] = None, stride: int = 1, fields: Optional[tuple] = None) -> Iterator[Frame]:
+        """
+        Iterate over the frames with ``start <= step < stop``, loading only the chunks in range.
+
+        :param start: First step, the beginning of the recording by default.
+        :param stop: Step after the last one, the end of the recording by default.
+        :param stride: Yield one recorded frame out of ``stride``.
+        :param fields: Fields to return, all the recorded ones by default.
+        """
+        fields = self.fields if fields is None else fields
+        count = 0
+        for k, entry in enumerate(self.chunks):
+            if start is not None and entry["last_step"] < start:
+                continue
+            if stop is not None and entry["first_step"] >= stop:
+                break
+            chunk = self.load_chunk(k, ("steps", "time", "offsets", "ids", *fields))
+            offsets = chunk["offsets"]
+            for f, step in enumerate(chunk["steps"].tolist()):
+                if (start is not None and step < start) or (stop is not None and step >= stop):
+                    continue
+                if count % stride == 0:
+                    a, b = offsets[f], offsets[f + 1]
+                    yield Frame(step, float(chunk["time"][f]), chunk["ids"][a:b], {name: chunk[name][a:b] for name in fields})
+                count += 1
+
+    def frame(self, step: int) -> Frame:
+        """
+        The frame recorded at ``step``.
+
+        :param step: Step number.
+        """
+        k = bisect.bisect_right(self._first_steps, step) - 1
+        if k < 0 or step > self.chunks[k]["last_step"]:
+            raise KeyError(f"step {step} was not recorded")
+        if self._cache[0] != k:  # Random access mostly hits the same chunk again
+            self._cache = (k, self.load_chunk(k, ("steps", "time", "offsets", "ids", *self.fields)))
+        chunk = self._cache[1]
+        f = int(np.searchsorted(chunk["steps"], step))
+        if chunk["steps"][f] != step:
+            raise KeyError(f"step {step} was not recorded")
+        a, b = chunk["offsets"][f], chunk["offsets"][f + 1]
+        return Frame(step, float(chunk["time"][f]), chunk["ids"][a:b], {name: chunk[name][a:b] for name in self.fields})
+
+    def _events(self, id_key: str, value_key: str) -> tuple[np.ndarray, np.ndarray]:
+        ids, values = [], []
+        for k in range(len(self.chunks)):
+            chunk = self.load_chunk(k, (id_key, value_key))
+            ids.append(chunk[id_key])
+            values.append(chunk[value_key])
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(ids), np.concatenate(values)
+
+    def births(self) -> tuple[np.ndarray, np.ndarray]:
+        """Ids of the particles and first step at which each was recorded."""
+        return self._events("born_ids", "born_steps")
+
+    def deaths(self) -> tuple[np.ndarray, np.ndarray]:
+        """Ids of the particles and first recorded step at which each was gone."""
+        return self._events("died_ids", "died_steps")
+
+    def colors(self) -> dict:
+        """Color of every recorded particle id."""
+        ids, index = self._events("color_ids", "color_index")
+        return {pid: self.palette[k] for pid, k in zip(ids.tolist(), index.tolist())}
+
+    def track(self, pid: int, start: Optional[int] = None, stop: Optional[int] = None) -> dict:
+        """
+        Trajectory of a single particle.
+
+        :param pid: Id of the particle.
+        :param start: First step.
+        :param stop: Step after the last one.
+        :return: Dictionary with the steps where the particle exists and each field at those steps.
+        """
+        steps, values = [], {name: [] for name in self.fields}
+        for frame in self.frames(start, stop):
+            k = np.flatnonzero(frame.ids == pid)
+            if len(k):
+                steps.append(frame.step)
+                for name in self.fields:
+                    values[name].append(frame.data[name][k[0]])
+        return {"steps": np.array(steps, dtype=np.int64), **{name: np.array(v) for name, v in values.items()}}
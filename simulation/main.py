@@ -1,160 +1,86 @@
-from random import randint
+import argparse
+import functools
+import os
 from typing import Optional
 
-from simulation.physics.particle import *
-from simulation.rendering.rendering2D import *
-from simulation.physics.forces import (
-    distance_euclidienne,
-    force_gravitationnelle,
-    is_collision,
-    resolve_collision,
-    resolve_colision_fragment,
-    collision
-)
-from simulation.utils.constants import FPS, SCREEN_WIDTH, SCREEN_HEIGHT
-
-
-def init_particle(
-    mass, position: Optional[tuple], velocity: Optional[tuple], radius: float, n: int
-):
-    """
-    Initialize a particle with its properties.
-
-    :param mass: Mass of the particle.
-    :param position: Initial position of the particle.
-    :param velocity: Initial velocity of the particle.
-    :param radius: Radius of the particle.
-    :param n: Number of particles to initialize.
-    :return: List of initialized particles.
-    """
-    particles = []
-    for _ in range(n):
-        if position is None:
-            x = randint(0, SCREEN_WIDTH)
-            y = randint(0, SCREEN_HEIGHT)
-            position_ = (x, y)
-        else:
-            position_ = position
-        if velocity is None:
-            vx = randint(-6, 6)
-            vy = randint(-6, 6)
-            velocity_ = (vx, vy)
-        else:
-            velocity_ = velocity
-        particle = Particle(
-            mass=mass,
-            position=Position2D(*position_),
-            velocity=Velocity2D(*velocity_),
-            radius=radius,
-        )
-        particles.append(particle)
-    return particles
-
-
-def init_environment():
-    """
-    Initialize the simulation environment.
+from simulation.physics.particle import Particle
+from simulation.rendering.rendering2D import main_game_loop, render_particles, render_hud, init_display
+from simulation.engine import Simulation
+from simulation.runner import SimulationRunner, RUN_MODES, close_observers
+from simulation.scenario import load_scenario, build_simulation
+from simulation.utils.constants import LOG_LEVEL, LOG_MODULES
+from simulation.utils.log import configure_logging
+from simulation.utils.profiling import format_summary
+
+DEFAULT_SCENARIO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scenarios", "default.json")
 
-    This function sets up the necessary components for the simulation,
-    including loading configurations and initializing particle systems.
-    """
-    # Initialize particle systems
-    particles = [
-        Particle(
-            mass=1000.0,
-            position=Position2D(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2),
-            velocity=Velocity2D(0, 0),
-            radius=15,
-            color=(0, 100, 255),
-        ),  # Terre (bleu)
-        Particle(
-            mass=10.0,
-            position=Position2D(SCREEN_WIDTH // 2 + 100, SCREEN_HEIGHT // 2),
-            velocity=Velocity2D(0, 6),
-            radius=8,
-            color=(220, 220, 220),
-        ),  # Lune 1 (blanc)
-        Particle(
-            mass=10.0,
-            position=Position2D(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 100),
-            velocity=Velocity2D(6, 0),
-            radius=8,
-            color=(255, 200, 0),
-        ),  # Lune 2 (jaune)
-        Particle(
-            mass=10.0,
-            position=Position2D(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2),
-            velocity=Velocity2D(0, -6),
-            radius=8,
-            color=(255, 80, 80),
-        ),  # Lune 3 (rouge)
-        Particle(
-            mass=10.0,
-            position=Position2D(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100),
-            velocity=Velocity2D(-6, 0),
-            radius=8,
-            color=(80, 255, 80),
-        ),  # Lune 4 (vert)
-    ]
-
-    particles = [
-        *init_particle(mass=400.0, position=None, velocity=None, radius=10, n=3),
-        #Particle(mass=5000.0, position=Position2D(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), velocity=Velocity2D(0, 0), radius=15)
-    ]
-
-    return particles
-
-
-particles = init_environment()
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a simulation scenario.")
+    parser.add_argument("scenario", nargs="?", default=DEFAULT_SCENARIO, help="JSON scenario file.")
+    parser.add_argument("--steps", type=int, default=None, help="Run this many steps headless, without a window.")
+    parser.add_argument("--mode", choices=RUN_MODES, default=None, help="Where the physics runs, see SimulationRunner.")
+    parser.add_argument("--seed", type=int, default=None, help="Override the seed of the scenario.")
+    parser.add_argument("--profile", default=None, metavar="PATH", help="Export the per-step profiler trace (.csv or .json) at the end of the run.")
+    return parser.parse_args(argv)
 
 
 @main_game_loop()
-def main(add_object:Optional[tuple]=None):
+def game_frame(runner: SimulationRunner, add_object:Optional[tuple]=None):
     """Objet à ajouter sous forme (mass, position, velocity, radius, color, lifetime)"""
-    dt = 1  # Time step for the simulation
-
     if not add_object is None:
-        particles.append(Particle(*add_object))
-
-    for idx, particle in enumerate(particles.copy()):
-        if particle.lifetime is not None and particle.lifetime <= 0:
-            print(f"Particle {idx} has reached its lifetime and will be removed.")
-            particles.remove(particle)
-            continue
-        force_totale_x = 0
-        force_totale_y = 0
-
-        for other_particle in particles:
-            if particle != other_particle:
-                if is_collision(particle, other_particle):
-                    continue
-                force = force_gravitationnelle(particle, other_particle)
-                distance = distance_euclidienne(particle, other_particle)
-
-                # Calculate the direction of the force
-                dx, dy = other_particle.position - particle.position
-
-                if distance > 0:
-                    force_totale_x += force * dx / distance
-                    force_totale_y += force * dy / distance
-
-        ax = force_totale_x / particle.mass
-        ay = force_totale_y / particle.mass
-
-        particle.velocity += (ax * dt, ay * dt)
-
-    for idx, particle in enumerate(particles.copy()):
-        for other_particle in particles.copy()[idx + 1 :]:
-            if not all([particle.collision, other_particle.collision]):
-                continue
-            print(f"Checking collision between particle {idx} and {particles.index(other_particle)}")
-            if is_collision(particle, other_particle):
-                new_particles = collision(particle, other_particle)
-                if new_particles is None:
-                    continue
-                particles.extend(new_particles)
-
-    for particle in particles:
-        particle.update_position(dt)
-
-    render_particles(particles)
+        runner.add_particle(Particle(*add_object))
+
+    particles = runner.frame()
+
+    with runner.profiler.phase("rendering"):
+        render_particles(particles)
+    render_hud(format_summary(*runner.profile()))
+
+
+def run_headless(scenario: dict, n_steps:int) -> Simulation:
+    """
+    Run a scenario without opening a window, as fast as the CPU allows.
+
+    :param scenario: Complete scenario, see ``load_scenario``.
+    :param n_steps: Number of steps to simulate.
+    :return: The simulation, after the run.
+    """
+    simulation = build_simulation(scenario)
+    simulation.run(n_steps)
+    close_observers(simulation)
+    return simulation
+
+
+def main(argv=None) -> Optional[SimulationRunner]:
+    """
+    Load a scenario and run it, in a window or headless.
+
+    :param argv: Command line arguments, ``sys.argv`` by default.
+    :return: The runner of a windowed run, None for a headless one.
+    """
+    configure_logging(LOG_LEVEL, LOG_MODULES)
+    args = parse_args(argv)
+    scenario = load_scenario(args.scenario)
+    if args.seed is not None:
+        scenario["seed"] = args.seed
+    if args.profile is not None:
+        scenario["output"]["profile"]["path"] = args.profile
+    run = scenario["run"]
+    steps = args.steps if args.steps is not None else run["steps"]
+    if steps is not None:
+        run_headless(scenario, steps)
+        return None
+
+    runner = SimulationRunner(
+        functools.partial(build_simulation, scenario), args.mode or run["mode"],
+        substeps=run["substeps"], steps_per_second=run["steps_per_second"],
+    )
+    init_display((scenario["domain"]["width"], scenario["domain"]["height"]))
+    with runner:  # The trajectory is closed and the worker stopped when the window is
+        game_frame(runner)
+    return runner
+
+
+if __name__ == "__main__":
+    main()
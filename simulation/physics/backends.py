@@ -0,0 +1,220 @@
+"""
+Compute backends of the simulation.
+
+A backend provides the hot kernels of a step: the direct gravity sum, the
+collision broad and narrow phases over the SpatialHash, and the kick and drift
+of the integrators. "numpy" is the reference implementation (the functions of
+``forces.py`` and ``ParticleSystem``). "numba" compiles parallel loops over the
+particles (``numba_kernels.py``); numba is optional and only imported when the
+backend is selected.
+
+Contacts are returned sorted by slots (i, j): the fragmentation draws its
+random numbers in contact order, and the order of the grid depends on its
+history, which a checkpoint does not keep.
+
+``get_backend`` validates a compiled backend against the reference on a small
+random system the first time it is selected, and falls back to "numpy" with a
+warning when numba is missing or the results disagree.
+"""
+import logging
+from typing import Optional
+
+import numpy as np
+
+from simulation.physics.particle import ParticleSystem
+from simulation.physics.broadphase import SpatialHash
+from simulation.physics.forces import gravity_accelerations, are_colliding
+from simulation.utils.constants import SCREEN_WIDTH, SCREEN_HEIGHT, DEFAULT_SOFTENING, G, BACKEND
+
+logger = logging.getLogger(__name__)
+
+
+class NumpyBackend:
+    """Reference kernels, vectorized with NumPy."""
+    name = "numpy"
+
+    def gravity(self, solver):
+        """
+        Gravity solver to use in place of ``solver``.
+
+        :param solver: Function with the signature of ``gravity_accelerations``.
+        """
+        return solver
+
+    def contacts(self, particles: ParticleSystem, grid: SpatialHash, profiler) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        Touching pairs among the particles indexed by an up to date grid.
+
+        :param particles: Particles indexed by ``grid``.
+        :param grid: Broad phase, after ``grid.update(particles)``.
+        :param profiler: StepProfiler timing the broad and narrow phases.
+        :return: Slots (i, j) of the touching pairs, sorted, and the number of candidate pairs tested.
+        """
+        with profiler.phase("broad_phase"):
+            i, j = grid.candidate_pairs()
+        with profiler.phase("narrow_phase"):
+            hit = are_colliding(particles.x, particles.y, particles.radius, i, j)
+            i, j = _canonical_order(i[hit], j[hit])
+        return i, j, len(hit)
+
+    def kick(self, particles: ParticleSystem, ax: np.ndarray, ay: np.ndarray, dt: float) -> None:
+        """Add ``a * dt`` to the velocities."""
+        particles.vx[:] += ax * dt
+        particles.vy[:] += ay * dt
+
+    def drift(self, particles: ParticleSystem, dt: float) -> None:
+        """Move the particles and bounce them on the walls, see ``ParticleSystem.drift``."""
+        particles.drift(dt)
+
+
+class NumbaBackend(NumpyBackend):
+    """Kernels compiled with numba, parallel over the particles."""
+    name = "numba"
+
+    def __init__(self):
+        from simulation.physics import numba_kernels  # ImportError without numba
+        self.kernels = numba_kernels
+
+    def _gravity_direct(self, x, y, mass, radius, softening=DEFAULT_SOFTENING, g=G, block_bytes=None, targets=None, sources=None):
+        targets = np.arange(len(x)) if targets is None else np.asarray(targets, dtype=np.int64)
+        sources = np.arange(len(x)) if sources is None else np.asarray(sources, dtype=np.int64)
+        return self.kernels.gravity_direct(x, y, mass, radius, targets, sources, float(softening), float(g))
+
+    def gravity(self, solver):
+        # Barnes-Hut and custom solvers are kept as they are
+        return self._gravity_direct if solver is gravity_accelerations else solver
+
+    def contacts(self, particles, grid, profiler):
+        with profiler.phase("broad_phase"):
+            # Les quelques corps surdimensionnés passent par le chemin NumPy
+            k, l = grid.oversized_pairs()
+        with profiler.phase("narrow_phase"):
+            hit = are_colliding(particles.x, particles.y, particles.radius, k, l)
+            k, l = k[hit], l[hit]
+            if len(grid.order) == 0:
+                return *_canonical_order(k, l), len(hit)
+            slots = grid.members[grid.order]
+            a, b, candidates = self.kernels.grid_contacts(
+                particles.x[slots], particles.y[slots], particles.radius[slots], grid.cells[grid.order],
+                grid.columns, float(DEFAULT_SOFTENING),
+            )
+            a, b = slots[a], slots[b]
+            i, j = _canonical_order(np.concatenate((np.minimum(a, b), k)), np.concatenate((np.maximum(a, b), l)))
+        return i, j, int(candidates) + len(hit)
+
+    def kick(self, particles, ax, ay, dt):
+        self.kernels.kick(particles.vx, particles.vy, np.ascontiguousarray(ax), np.ascontiguousarray(ay), float(dt))
+
+    def drift(self, particles, dt):
+        bounces, px, py, angular = self.kernels.drift(
+            particles.x, particles.y, particles.vx, particles.vy, particles.radius, particles.mass,
+            float(dt), float(particles.width), float(particles.height),
+        )
+        particles.wall_bounces += bounces
+        particles.wall_impulse += (px, py, angular)
+
+
+def _canonical_order(i: np.ndarray, j: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Sort pairs by (i, j), independently of the history of the grid."""
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+BACKENDS = {cls.name: cls for cls in (NumpyBackend, NumbaBackend)}
+_validated = {}  # Backend name -> instance that passed validate_backend
+
+
+def validate_backend(backend, n: int = 400, seed: int = 0, rtol: float = 1e-9) -> dict:
+    """
+    Compare the kernels of a backend with the reference NumPy implementation.
+
+    :param backend: Backend instance.
+    :param n: Number of particles of the random test system.
+    :param seed: Seed of the test system.
+    :param rtol: Largest relative difference accepted on the accelerations and positions.
+    :return: Relative errors of each kernel, and the number of contacts compared.
+    :raise ValueError: When a kernel disagrees with the reference.
+    """
+    from simulation.utils.profiling import StepProfiler
+    rng = np.random.default_rng(seed)
+    particles = ParticleSystem(capacity=n)
+    particles.add_batch(
+        mass=rng.uniform(50, 400, n), x=rng.uniform(0, SCREEN_WIDTH, n), y=rng.uniform(0, SCREEN_HEIGHT, n),
+        vx=rng.uniform(-20, 20, n), vy=rng.uniform(-20, 20, n), radius=rng.uniform(2, 30, n),
+    )
+    reference = NumpyBackend()
+    profiler = StepProfiler(enabled=False)
+    errors = {}
+    bounces = []
+
+    p = particles
+    ax, ay = gravity_accelerations(p.x, p.y, p.mass, p.radius)
+    bx, by = backend.gravity(gravity_accelerations)(p.x, p.y, p.mass, p.radius)
+    scale = np.abs(np.concatenate((ax, ay))).max()
+    errors["gravity"] = float(max(np.abs(bx - ax).max(), np.abs(by - ay).max()) / scale)
+    sources = np.arange(0, n, 3)  # The other particles are test particles
+    sx, sy = gravity_accelerations(p.x, p.y, p.mass, p.radius, sources=sources)
+    tx, ty = backend.gravity(gravity_accelerations)(p.x, p.y, p.mass, p.radius, sources=sources)
+    errors["gravity"] = max(errors["gravity"], float(max(np.abs(tx - sx).max(), np.abs(ty - sy).max()) / scale))
+
+    grid = SpatialHash()
+    grid.update(p)
+    i, j, candidates = reference.contacts(p, grid, profiler)
+    k, l, tested = backend.contacts(p, grid, profiler)
+    if tested != candidates or not (np.array_equal(i, k) and np.array_equal(j, l)):
+        raise ValueError(f"{backend.name} backend: contacts differ from the reference ({len(k)} found, {len(i)} expected)")
+    errors["contacts"] = len(i)
+
+    states = []
+    for kernels in (reference, backend):
+        copy = ParticleSystem.from_arrays({name: getattr(p, name).copy() for name, _ in ParticleSystem._FIELDS}, p.colors, p.next_id)
+        kernels.kick(copy, ax, ay, 0.5)
+        kernels.drift(copy, 40.0)  # Long enough for many particles to hit the walls
+        states.append(np.concatenate((copy.x, copy.y, copy.vx, copy.vy)))
+        bounces.append((copy.wall_bounces, copy.wall_impulse))
+    errors["integration"] = float(np.abs(states[1] - states[0]).max() / np.abs(states[0]).max())
+    if bounces[0][0] != bounces[1][0]:
+        raise ValueError(f"{backend.name} backend: {bounces[1][0]} wall bounces, {bounces[0][0]} expected")
+    # Momenta and angular momentum relative to the sums of their absolute values
+    momentum = np.dot(p.mass, np.abs(p.vx) + np.abs(p.vy))
+    scale = np.array([momentum, momentum, np.dot(p.mass, np.abs(p.x * p.vy) + np.abs(p.y * p.vx))])
+    errors["walls"] = float((np.abs(bounces[1][1] - bounces[0][1]) / scale).max())
+
+    for name in ("gravity", "integration", "walls"):
+        if not errors[name] <= rtol:
+            raise ValueError(f"{backend.name} backend: {name} differs from the reference by {errors[name]:.3g}")
+    return errors
+
+
+def get_backend(name: Optional[str] = BACKEND, validate: bool = True) -> NumpyBackend:
+    """
+    Create the backend registered under ``name``.
+
+    Compiled backends are validated against the reference the first time they
+    are selected (which also compiles their kernels). When numba is missing or
+    the validation fails, a warning is logged and the NumPy backend is used.
+
+    :param name: Key of BACKENDS.
+    :param validate: Run ``validate_backend`` before using a compiled backend.
+    :return: Backend instance.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {sorted(BACKENDS)}")
+    if name == "numpy":
+        return NumpyBackend()
+    if name in _validated:
+        return _validated[name]
+    try:
+        backend = BACKENDS[name]()
+    except ImportError as error:
+        logger.warning("The %s backend is not available (%s), using numpy.", name, error)
+        return NumpyBackend()
+    if validate:
+        try:
+            errors = validate_backend(backend)
+        except ValueError as error:
+            logger.warning("%s, using numpy.", error)
+            return NumpyBackend()
+        logger.info("%s backend validated: %s", name, errors)
+        _validated[name] = backend
+    return backend
@@ -0,0 +1,326 @@
+import numpy as np
+
+from simulation.utils.arrays import expand_ranges
+from simulation.utils.constants import G, DEFAULT_SOFTENING, BARNES_HUT_THETA, BARNES_HUT_LEAF_SIZE
+
+MAX_DEPTH = 16  # Levels of the quadtree, Morton keys hold 2 bits per level
+
+
+def _spread_bits(n: np.ndarray) -> np.ndarray:
+    """Insert a zero bit between each of the 16 low bits of ``n``."""
+    n = n.astype(np.uint64) & np.uint64(0x0000FFFF)
+    n = (n | (n << np.uint64(8))) & np.uint64(0x00FF00FF)
+    n = (n | (n << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    n = (n | (n << np.uint64(2))) & np.uint64(0x33333333)
+    n = (n | (n << np.uint64(1))) & np.uint64(0x55555555)
+    return n
+
+
+class QuadTree:
+    """
+    Linear quadtree over particle positions.
+
+    Particles are sorted by Morton key so that every node covers a contiguous
+    range ``[start, end)`` of the sorted arrays. Nodes are stored level by level
+    in flat arrays and the children of a node are contiguous.
+    """
+    def __init__(self, x, y, mass, radius, leaf_size: int = BARNES_HUT_LEAF_SIZE, max_depth: int = MAX_DEPTH):
+        """
+        Build the tree.
+
+        :param x: X positions.
+        :param y: Y positions.
+        :param mass: Masses.
+        :param radius: Radii, used to keep the overlap rule of the exact kernel.
+        :param leaf_size: Maximum number of particles in a leaf (unless max_depth is reached).
+        :param max_depth: Maximum depth of the tree, at most 16.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n = len(x)
+        max_depth = min(max_depth, MAX_DEPTH)
+
+        x0, y0 = x.min(), y.min()
+        self.size = max(x.max() - x0, y.max() - y0, 1e-9) * (1 + 1e-9)
+        cells = 1 << max_depth
+        ix = np.minimum(((x - x0) * (cells / self.size)).astype(np.int64), cells - 1)
+        iy = np.minimum(((y - y0) * (cells / self.size)).astype(np.int64), cells - 1)
+        keys = _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1))
+
+        self.order = np.argsort(keys, kind="stable")
+        self.rank = np.empty(n, dtype=np.int64)
+        self.rank[self.order] = np.arange(n)
+        keys = keys[self.order]
+        self.x = x[self.order]
+        self.y = y[self.order]
+        self.mass = np.asarray(mass, dtype=np.float64)[self.order]
+        self.radius = np.asarray(radius, dtype=np.float64)[self.order]
+
+        # Padded copies so that node ends (up to n) are valid reduceat indices
+        padded_mass = np.append(self.mass, 0.0)
+        padded_mx = np.append(self.mass * (self.x - x0), 0.0)
+        padded_my = np.append(self.mass * (self.y - y0), 0.0)
+        padded_x = np.append(self.x, 0.0)
+        padded_y = np.append(self.y, 0.0)
+        padded_radius = np.append(self.radius, 0.0)
+
+        starts, ends, levels, masses, com_x, com_y, max_radius = [], [], [], [], [], [], []
+        min_x, max_x, min_y, max_y = [], [], [], []
+        first_child, n_children = [], []
+        level_start, level_end = np.array([0]), np.array([n])
+        level_prefix = np.array([0], dtype=np.uint64)
+        total = 0
+        for level in range(max_depth + 1):
+            count = len(level_start)
+            bounds = np.column_stack((level_start, level_end)).ravel()
+            mass_sum = np.add.reduceat(padded_mass, bounds)[::2]
+            safe_mass = np.where(mass_sum > 0, mass_sum, 1.0)
+            starts.append(level_start)
+            ends.append(level_end)
+            levels.append(np.full(count, level))
+            masses.append(mass_sum)
+            com_x.append(x0 + np.add.reduceat(padded_mx, bounds)[::2] / safe_mass)
+            com_y.append(y0 + np.add.reduceat(padded_my, bounds)[::2] / safe_mass)
+            max_radius.append(np.maximum.reduceat(padded_radius, bounds)[::2])
+            min_x.append(np.minimum.reduceat(padded_x, bounds)[::2])
+            max_x.append(np.maximum.reduceat(padded_x, bounds)[::2])
+            min_y.append(np.minimum.reduceat(padded_y, bounds)[::2])
+            max_y.append(np.maximum.reduceat(padded_y, bounds)[::2])
+
+            children = np.zeros(count, dtype=np.int64)
+            first = np.zeros(count, dtype=np.int64)
+            split = (level_end - level_start > leaf_size) & (level < max_depth)
+            total += count
+            if split.any():
+                shift = np.uint64(2 * (max_depth - level - 1))
+                child_prefix = (level_prefix[split][:, None] << np.uint64(2)) | np.arange(4, dtype=np.uint64)
+                prefixes = keys >> shift
+                child_start = np.searchsorted(prefixes, child_prefix.ravel(), "left")
+                child_end = np.searchsorted(prefixes, child_prefix.ravel(), "right")
+                nonempty = child_end > child_start
+                children[split] = nonempty.reshape(-1, 4).sum(axis=1)
+                first[split] = total + np.cumsum(children[split]) - children[split]
+                level_start, level_end = child_start[nonempty], child_end[nonempty]
+                level_prefix = child_prefix.ravel()[nonempty]
+            first_child.append(first)
+            n_children.append(children)
+            if not split.any():
+                break
+
+        self.node_start = np.concatenate(starts)
+        self.node_end = np.concatenate(ends)
+        self.node_mass = np.concatenate(masses)
+        self.node_x = np.concatenate(com_x)
+        self.node_y = np.concatenate(com_y)
+        self.node_radius = np.concatenate(max_radius)
+        self.node_min_x = np.concatenate(min_x)
+        self.node_max_x = np.concatenate(max_x)
+        self.node_min_y = np.concatenate(min_y)
+        self.node_max_y = np.concatenate(max_y)
+        self.node_size = self.size / 2.0 ** np.concatenate(levels)
+        self.first_child = np.concatenate(first_child)
+        self.n_children = np.concatenate(n_children)
+
+    def __len__(self) -> int:
+        """Number of nodes."""
+        return len(self.node_mass)
+
+    def _walk(self, targets: np.ndarray, theta: float, softening: float):
+        """
+        Walk the tree for the leaves holding ``targets``.
+
+        The tree is walked once per leaf (group of nearby particles) rather than
+        once per particle. A node is used through its center of mass when
+        ``size / distance < theta`` for the closest point of the group and none
+        of its particles can overlap a particle of the group; otherwise it is
+        opened, and leaves are summed exactly with the same rules as the direct
+        kernel.
+
+        :return: Generator of interaction batches (i, mass, dx, dy, dist2, interacts):
+                 sorted index of the particle, mass and offset of the source
+                 (a node or a particle), squared softened distance, and the
+                 mask of the particle pairs that interact (None for nodes).
+        """
+        n = len(self.x)
+        # Groups are the leaves holding at least one target
+        wanted = np.zeros(n + 1, dtype=np.int64)
+        wanted[self.rank[targets] + 1] = 1
+        wanted = np.cumsum(wanted)
+        leaves = np.flatnonzero(self.n_children == 0)
+        leaves = leaves[wanted[self.node_end[leaves]] > wanted[self.node_start[leaves]]]
+
+        soft2 = softening**2
+        theta2 = theta**2
+
+        group = leaves
+        node = np.zeros(len(leaves), dtype=np.int64)
+        while group.size:
+            # Closest point of the group bounding box to the node center of mass
+            cx, cy = self.node_x[node], self.node_y[node]
+            gdx = np.maximum(np.maximum(self.node_min_x[group] - cx, cx - self.node_max_x[group]), 0)
+            gdy = np.maximum(np.maximum(self.node_min_y[group] - cy, cy - self.node_max_y[group]), 0)
+            # Gap between the bounding boxes of the group and of the node
+            bdx = np.maximum(np.maximum(self.node_min_x[group] - self.node_max_x[node], self.node_min_x[node] - self.node_max_x[group]), 0)
+            bdy = np.maximum(np.maximum(self.node_min_y[group] - self.node_max_y[node], self.node_min_y[node] - self.node_max_y[group]), 0)
+            reach = self.node_radius[group] + self.node_radius[node]
+
+            contains = (self.node_start[node] <= self.node_start[group]) & (self.node_end[group] <= self.node_end[node])
+            size = self.node_size[node]
+            far = (
+                ~contains
+                & (size * size < theta2 * (gdx * gdx + gdy * gdy + soft2))
+                & (bdx * bdx + bdy * bdy + soft2 > reach * reach)
+            )
+            leaf = self.n_children[node] == 0
+
+            if far.any():
+                far_node = node[far]
+                pair, i = expand_ranges(self.node_start[group[far]], self.node_end[group[far]] - self.node_start[group[far]])
+                j = far_node[pair]
+                dx = self.node_x[j] - self.x[i]
+                dy = self.node_y[j] - self.y[i]
+                yield i, self.node_mass[j], dx, dy, dx * dx + dy * dy + soft2, None
+
+            direct = ~far & leaf
+            if direct.any():
+                direct_group, direct_node = group[direct], node[direct]
+                pair, i = expand_ranges(self.node_start[direct_group], self.node_end[direct_group] - self.node_start[direct_group])
+                direct_node = direct_node[pair]
+                pair, j = expand_ranges(self.node_start[direct_node], self.node_end[direct_node] - self.node_start[direct_node])
+                i = i[pair]
+                dx = self.x[j] - self.x[i]
+                dy = self.y[j] - self.y[i]
+                dist2 = dx * dx + dy * dy + soft2
+                interacts = (j != i) & (np.sqrt(dist2) > self.radius[i] + self.radius[j]) & (dist2 > 0)
+                yield i, self.mass[j], dx, dy, dist2, interacts
+
+            opened = ~far & ~leaf
+            opened_node = node[opened]
+            pair, node = expand_ranges(self.first_child[opened_node], self.n_children[opened_node])
+            group = group[opened][pair]
+
+    def accelerations(
+        self,
+        targets: np.ndarray,
+        theta: float = BARNES_HUT_THETA,
+        softening: float = DEFAULT_SOFTENING,
+        g: float = G,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate the gravitational acceleration of some particles, see ``_walk``.
+
+        :param targets: Indices (in the original order) of the particles to compute.
+        :param theta: Opening angle, 0 gives the exact result.
+        :param softening: Small value added to the squared distance to stabilize force.
+        :param g: Gravitational constant.
+        :return: Tuple of arrays (ax, ay) aligned with ``targets``.
+        """
+        targets = np.asarray(targets, dtype=np.int64)
+        n = len(self.x)
+        ax = np.zeros(n)
+        ay = np.zeros(n)
+        if len(targets) == 0:
+            return ax[:0], ay[:0]
+
+        for i, mass, dx, dy, dist2, interacts in self._walk(targets, theta, softening):
+            if interacts is None:
+                factor = g * mass / (dist2 * np.sqrt(dist2))
+            else:
+                factor = np.zeros_like(dist2)
+                np.divide(g * mass, dist2 * np.sqrt(dist2), out=factor, where=interacts)
+            ax += np.bincount(i, factor * dx, minlength=n)
+            ay += np.bincount(i, factor * dy, minlength=n)
+
+        ranks = self.rank[targets]
+        return ax[ranks], ay[ranks]
+
+    def potentials(
+        self,
+        targets: np.ndarray,
+        theta: float = BARNES_HUT_THETA,
+        softening: float = DEFAULT_SOFTENING,
+        g: float = G,
+    ) -> np.ndarray:
+        """
+        Approximate the gravitational potential -G sum(m / d) at some particles, see ``_walk``.
+
+        :param targets: Indices (in the original order) of the particles to compute.
+        :param theta: Opening angle, 0 gives the exact result.
+        :param softening: Small value added to the squared distance.
+        :param g: Gravitational constant.
+        :return: Array of the potentials, aligned with ``targets``.
+        """
+        targets = np.asarray(targets, dtype=np.int64)
+        n = len(self.x)
+        phi = np.zeros(n)
+        if len(targets) == 0:
+            return phi[:0]
+
+        for i, mass, dx, dy, dist2, interacts in self._walk(targets, theta, softening):
+            if interacts is None:
+                term = mass / np.sqrt(dist2)
+            else:
+                term = np.zeros_like(dist2)
+                np.divide(mass, np.sqrt(dist2), out=term, where=interacts)
+            phi -= g * np.bincount(i, term, minlength=n)
+
+        return phi[self.rank[targets]]
+
+
+def barnes_hut_accelerations(
+    x: np.ndarray,
+    y: np.ndarray,
+    mass: np.ndarray,
+    radius: np.ndarray,
+    softening: float = DEFAULT_SOFTENING,
+    g: float = G,
+    theta: float = BARNES_HUT_THETA,
+    leaf_size: int = BARNES_HUT_LEAF_SIZE,
+    targets: np.ndarray = None,
+    sources: np.ndarray = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Approximate the gravitational acceleration of every particle with a Barnes–Hut quadtree.
+
+    Same signature and conventions as ``gravity_accelerations``, in O(N log N).
+
+    :param theta: Opening angle, larger is faster and less accurate.
+    :param leaf_size: Maximum number of particles in a leaf of the tree.
+    :param targets: Indices of the particles to compute, all of them by default.
+    :param sources: Indices of the particles exerting gravity, all of them by
+                    default. The others stay in the tree with no mass.
+    :return: Tuple of arrays (ax, ay).
+    """
+    n = len(x)
+    if targets is None:
+        targets = np.arange(n)
+    if n < 2:
+        return np.zeros(len(targets)), np.zeros(len(targets))
+    if sources is not None:
+        source_mass = np.zeros(n)
+        source_mass[sources] = mass[sources]
+        mass = source_mass
+    tree = QuadTree(x, y, mass, radius, leaf_size=leaf_size)
+    return tree.accelerations(targets, theta=theta, softening=softening, g=g)
+
+
+def barnes_hut_potential_energy(
+    x: np.ndarray,
+    y: np.ndarray,
+    mass: np.ndarray,
+    radius: np.ndarray,
+    softening: float = DEFAULT_SOFTENING,
+    g: float = G,
+    theta: float = BARNES_HUT_THETA,
+    leaf_size: int = BARNES_HUT_LEAF_SIZE,
+) -> float:
+    """
+    Approximate ``potential_energy`` with a Barnes–Hut quadtree, in O(N log N).
+
+    :return: Potential energy of the system, 1/2 sum(m phi).
+    """
+    n = len(x)
+    if n < 2:
+        return 0.0
+    tree = QuadTree(x, y, mass, radius, leaf_size=leaf_size)
+    return float(0.5 * np.dot(mass, tree.potentials(np.arange(n), theta=theta, softening=softening, g=g)))
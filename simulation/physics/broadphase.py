@@ -0,0 +1,188 @@
+import numpy as np
+
+from simulation.physics.particle import ParticleSystem
+from simulation.utils.arrays import expand_ranges
+from simulation.utils.constants import BROADPHASE_RADIUS_PERCENTILE
+
+# Neighbour cells (dx, dy) visited from each cell, half of the 3x3 stencil so
+# that every pair of adjacent cells is visited once
+_NEIGHBOURS = ((1, 0), (-1, 1), (0, 1), (1, 1))
+
+
+class SpatialHash:
+    """
+    Uniform grid over the simulation domain used as collision broad phase.
+
+    Only the particles that take part in collisions are indexed. Cells are
+    sized from a typical radius (the ``radius_percentile`` percentile of the
+    colliding radii): the particles whose contact distance fits in a cell are
+    indexed in the grid, so two of them touching are always in the same or in
+    adjacent cells and only those pairs are handed to the narrow phase. The few
+    oversized bodies are kept aside and tested against the cells their reach
+    overlaps, so that a single large body does not coarsen the whole grid.
+
+    The index is kept between steps: particles are stored sorted by cell and
+    each update re-sorts a nearly sorted array, appending the particles inserted
+    since the last update (fragments). It is rebuilt from scratch only when
+    particles were removed or when the radii no longer fit the cell size.
+    """
+    def __init__(
+        self,
+        cell_size: float = None,
+        width: float = None,
+        height: float = None,
+        radius_percentile: float = BROADPHASE_RADIUS_PERCENTILE,
+    ):
+        """
+        Initialize an empty grid.
+
+        :param cell_size: Fixed size of the cells. By default it is derived from
+                          the typical radius and adapted when radii change.
+        :param width: Width of the domain, the one of the indexed particles by default.
+        :param height: Height of the domain, the one of the indexed particles by default.
+        :param radius_percentile: Percentile of the colliding radii used as typical radius.
+        """
+        self.fixed_cell_size = cell_size
+        self.radius_percentile = radius_percentile
+        self.fixed_domain = None if width is None or height is None else (width, height)
+        self.width = width
+        self.height = height
+        self.cell_size = None
+        self.members = np.empty(0, dtype=np.int64)  # Slots of the indexed particles
+        self.ids = np.empty(0, dtype=np.int64)  # Ids of the indexed particles
+        self.cells = np.empty(0, dtype=np.int64)  # Cell key of each indexed particle
+        self.order = np.empty(0, dtype=np.int64)  # Indexed particles sorted by cell
+        self.oversized = np.empty(0, dtype=np.int64)  # Slots of the colliding particles too large for the cells
+        self._reach = np.empty((4, 0), dtype=np.int64)  # Cells (x0, x1, y0, y1) overlapped by each oversized body
+        self.rebuilds = 0
+
+    def _resize(self, radius: float) -> None:
+        """Choose the cell size and the grid dimensions."""
+        if self.fixed_cell_size is not None:
+            self.cell_size = self.fixed_cell_size
+        else:
+            self.cell_size = max(2.0 * radius, 1.0)
+        self.columns = max(1, int(np.ceil(self.width / self.cell_size)))
+        self.rows = max(1, int(np.ceil(self.height / self.cell_size)))
+
+    def _cell_coordinates(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Cell column and row of positions, clamped to the grid."""
+        cx = np.clip((x // self.cell_size).astype(np.int64), 0, self.columns - 1)
+        cy = np.clip((y // self.cell_size).astype(np.int64), 0, self.rows - 1)
+        return cx, cy
+
+    def update(self, particles: ParticleSystem) -> None:
+        """
+        Bring the index up to date with the particle system.
+
+        :param particles: Particle system indexed by the grid.
+        """
+        members = np.flatnonzero(particles.collides)
+        radius = particles.radius[members]
+        typical = np.percentile(radius, self.radius_percentile) if len(members) else 0.0
+
+        domain = self.fixed_domain or (particles.width, particles.height)
+        resize = self.cell_size is None or domain != (self.width, self.height) or (
+            self.fixed_cell_size is None and not typical <= self.cell_size / 2 <= max(4 * typical, 0.5)
+        )
+        if resize:
+            self.width, self.height = domain
+            self._resize(typical)
+
+        # Les corps trop grands pour les cellules sont testés à part
+        fits = radius <= self.cell_size / 2
+        oversized = members[~fits]
+        members = members[fits]
+        ids = particles.ids[members]
+        n_old = len(self.ids)
+        incremental = not resize and len(ids) >= n_old and np.array_equal(ids[:n_old], self.ids)
+
+        cx, cy = self._cell_coordinates(particles.x[members], particles.y[members])
+        cells = cy * self.columns + cx
+        if incremental:
+            order = np.concatenate((self.order, np.arange(n_old, len(ids))))
+            order = order[np.argsort(cells[order], kind="stable")]
+        else:
+            order = np.argsort(cells, kind="stable")
+            self.rebuilds += 1
+
+        self.members, self.ids, self.cells, self.order = members, ids, cells, order
+
+        # Cells within contact distance of each oversized body
+        self.oversized = oversized
+        reach = particles.radius[oversized] + (particles.radius[members].max() if len(members) else 0.0)
+        x0, y0 = self._cell_coordinates(particles.x[oversized] - reach, particles.y[oversized] - reach)
+        x1, y1 = self._cell_coordinates(particles.x[oversized] + reach, particles.y[oversized] + reach)
+        self._reach = np.stack((x0, x1, y0, y1))
+
+    def candidate_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        List the pairs of indexed particles in the same or in adjacent cells,
+        and the pairs of ``oversized_pairs``.
+
+        :return: Tuple of slot arrays (i, j) with i < j, each pair once.
+        """
+        i, j = self.grid_pairs()
+        k, l = self.oversized_pairs()
+        return np.concatenate((i, k)), np.concatenate((j, l))
+
+    def oversized_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        List the pairs of an oversized body with the indexed particles of the
+        cells within its reach, and the pairs of oversized bodies.
+
+        :return: Tuple of slot arrays (i, j) with i < j, each pair once.
+        """
+        oversized = self.oversized
+        a, b = np.triu_indices(len(oversized), 1)
+        pairs_a, pairs_b = [oversized[a]], [oversized[b]]
+        if len(self.order) and len(oversized):
+            # Each row of cells in reach is a contiguous range of the sorted cells
+            x0, x1, y0, y1 = self._reach
+            body, row = expand_ranges(y0, y1 - y0 + 1)
+            sorted_cells = self.cells[self.order]
+            starts = np.searchsorted(sorted_cells, row * self.columns + x0[body], side="left")
+            ends = np.searchsorted(sorted_cells, row * self.columns + x1[body], side="right")
+            owner, position = expand_ranges(starts, ends - starts)
+            pairs_a.append(oversized[body[owner]])
+            pairs_b.append(self.members[self.order[position]])
+        a, b = np.concatenate(pairs_a), np.concatenate(pairs_b)
+        return np.minimum(a, b), np.maximum(a, b)
+
+    def grid_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        List the pairs of indexed particles in the same or in adjacent cells.
+
+        :return: Tuple of slot arrays (i, j) with i < j, each pair once.
+        """
+        if len(self.order) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        sorted_cells = self.cells[self.order]
+        keys, starts, counts = np.unique(sorted_cells, return_index=True, return_counts=True)
+        pairs_a, pairs_b = [], []
+
+        # Pairs inside a cell: each particle with the following ones of its cell
+        position = np.arange(len(sorted_cells))
+        cell_end = np.repeat(starts + counts, counts)
+        owner, partner = expand_ranges(position + 1, cell_end - position - 1)
+        pairs_a.append(position[owner])
+        pairs_b.append(partner)
+
+        # Pairs between neighbouring cells
+        key_x = keys % self.columns
+        for dx, dy in _NEIGHBOURS:
+            neighbour = keys + dy * self.columns + dx
+            found = np.searchsorted(keys, neighbour)
+            found = np.minimum(found, len(keys) - 1)
+            valid = (keys[found] == neighbour) & (key_x + dx >= 0) & (key_x + dx < self.columns)
+            if not valid.any():
+                continue
+            cell_a, cell_b = np.flatnonzero(valid), found[valid]
+            owner, a = expand_ranges(starts[cell_a], counts[cell_a])
+            owner, b = expand_ranges(starts[cell_b[owner]], counts[cell_b[owner]])
+            pairs_a.append(a[owner])
+            pairs_b.append(b)
+
+        a = self.members[self.order[np.concatenate(pairs_a)]]
+        b = self.members[self.order[np.concatenate(pairs_b)]]
+        return np.minimum(a, b), np.maximum(a, b)
@@ -1,10 +1,15 @@
+import logging
 import math
 import numpy as np
 from typing import NamedTuple
 
-from simulation.physics.particle import Particle, ParticleFragment
+from simulation.physics.particle import Particle, ParticleFragment, ParticleSystem, FRAGMENT
+from simulation.physics.barnes_hut import barnes_hut_accelerations
 from simulation.utils.positions import Position2D, Velocity2D
-from simulation.utils.constants import G, DEFAULT_SOFTENING, FragParams, SCREEN_HEIGHT
+from simulation.utils.constants import G, DEFAULT_SOFTENING, GRAVITY_BLOCK_BYTES, CONTACT_POLICY, FragParams
+from simulation.utils.log import EventCounter
+
+logger = logging.getLogger(__name__)
 
 
 class ParticleData(NamedTuple):
@@ -43,6 +48,217 @@ def force_gravitationnelle(p1: Particle, p2: Particle) -> float:
     force = G * (p1.mass * p2.mass) / (distance**2)
     return force
 
+def gravity_accelerations(
+    x: np.ndarray,
+    y: np.ndarray,
+    mass: np.ndarray,
+    radius: np.ndarray,
+    softening: float = DEFAULT_SOFTENING,
+    g: float = G,
+    block_bytes: int = GRAVITY_BLOCK_BYTES,
+    targets: np.ndarray = None,
+    sources: np.ndarray = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the gravitational acceleration of every particle in one pass.
+
+    Vectorized equivalent of summing ``force_gravitationnelle`` over every pair:
+    overlapping pairs (see ``is_collision``) exert no force on each other. The
+    pairwise temporaries are computed by blocks of rows so that they stay within
+    ``block_bytes``. With ``sources``, the other particles are test particles:
+    they feel the gravity of the sources but exert none, and the cost drops to
+    O(N * len(sources)).
+
+    :param x: X positions.
+    :param y: Y positions.
+    :param mass: Masses.
+    :param radius: Radii.
+    :param softening: Small value added to the squared distance to stabilize force.
+    :param g: Gravitational constant.
+    :param block_bytes: Memory budget for the pairwise temporaries.
+    :param targets: Indices of the particles to compute, all of them by default.
+    :param sources: Indices of the particles exerting gravity, all of them by default.
+    :return: Tuple of arrays (ax, ay).
+    """
+    n = len(x)
+    rows = np.arange(n) if targets is None else np.asarray(targets)
+    ax = np.zeros(len(rows))
+    ay = np.zeros(len(rows))
+    if n < 2:
+        return ax, ay
+    if sources is None:
+        sx, sy, s_mass, s_radius = x, y, mass, radius
+    else:
+        sources = np.asarray(sources)
+        sx, sy, s_mass, s_radius = x[sources], y[sources], mass[sources], radius[sources]
+
+    # About 7 float64 temporaries of len(sources) values are alive per row of the block
+    block = max(1, int(block_bytes // (7 * 8 * max(len(sx), 1))))
+    gm = g * s_mass
+    for start in range(0, len(rows), block):
+        stop = min(len(rows), start + block)
+        i = rows[start:stop]
+        dx = sx[None, :] - x[i, None]
+        dy = sy[None, :] - y[i, None]
+        dist2 = dx * dx + dy * dy + softening**2
+        dist = np.sqrt(dist2)
+
+        interacts = dist > radius[i, None] + s_radius[None, :]
+        if sources is None:
+            interacts[np.arange(stop - start), i] = False
+        else:
+            interacts &= sources[None, :] != i[:, None]
+        interacts &= dist > 0
+
+        factor = np.zeros_like(dist2)
+        np.divide(gm[None, :], dist2 * dist, out=factor, where=interacts)
+        ax[start:stop] = (factor * dx).sum(axis=1)
+        ay[start:stop] = (factor * dy).sum(axis=1)
+
+    return ax, ay
+
+GRAVITY_SOLVERS = {
+    "direct": gravity_accelerations,
+    "barnes_hut": barnes_hut_accelerations,
+}
+
+def get_gravity_solver(name: str):
+    """
+    Return the gravity solver registered under ``name``.
+
+    :param name: Key of GRAVITY_SOLVERS.
+    :return: Function with the signature of ``gravity_accelerations``.
+    """
+    try:
+        return GRAVITY_SOLVERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown gravity solver {name!r}, expected one of {sorted(GRAVITY_SOLVERS)}") from None
+
+def gravity_solver_error(
+    solver,
+    x: np.ndarray,
+    y: np.ndarray,
+    mass: np.ndarray,
+    radius: np.ndarray,
+    sample: int = 1000,
+    seed: int = 0,
+    **options,
+) -> dict:
+    """
+    Measure the error of an approximate gravity solver against the exact kernel.
+
+    The exact accelerations are computed only for a random sample of particles,
+    so this stays affordable for large N.
+
+    :param solver: Solver function or name (see GRAVITY_SOLVERS).
+    :param sample: Number of particles on which the error is measured.
+    :param seed: Seed used to draw the sample.
+    :param options: Extra keyword arguments passed to the solver (e.g. theta).
+    :return: Dictionary with the median, RMS, 99th percentile and max of the
+             relative error |a - a_exact| / |a_exact|, and the sample size.
+    """
+    if isinstance(solver, str):
+        solver = get_gravity_solver(solver)
+    n = len(x)
+    targets = np.arange(n)
+    if sample < n:
+        targets = np.sort(np.random.default_rng(seed).choice(n, sample, replace=False))
+
+    ax_exact, ay_exact = gravity_accelerations(x, y, mass, radius, targets=targets)
+    ax, ay = solver(x, y, mass, radius, targets=targets, **options)
+
+    norm = np.hypot(ax_exact, ay_exact)
+    error = np.hypot(ax - ax_exact, ay - ay_exact) / np.where(norm > 0, norm, 1.0)
+    return {
+        "median": float(np.median(error)),
+        "rms": float(np.sqrt(np.mean(error**2))),
+        "p99": float(np.percentile(error, 99)),
+        "max": float(error.max()),
+        "sample": len(targets),
+    }
+
+def kinetic_energy(mass: np.ndarray, vx: np.ndarray, vy: np.ndarray) -> float:
+    """
+    Calculate the total kinetic energy.
+
+    :return: Sum of 1/2 m v² over every particle.
+    """
+    return float(0.5 * np.sum(mass * (vx * vx + vy * vy)))
+
+def potential_energy(
+    x: np.ndarray,
+    y: np.ndarray,
+    mass: np.ndarray,
+    radius: np.ndarray,
+    softening: float = DEFAULT_SOFTENING,
+    g: float = G,
+    block_bytes: int = GRAVITY_BLOCK_BYTES,
+) -> float:
+    """
+    Calculate the total gravitational potential energy, -G m1 m2 / d over every
+    interacting pair, with the same rules as ``gravity_accelerations``.
+
+    :return: Potential energy of the system.
+    """
+    n = len(x)
+    if n < 2:
+        return 0.0
+    block = max(1, int(block_bytes // (6 * 8 * n)))
+    total = 0.0
+    for start in range(0, n, block):
+        stop = min(n, start + block)
+        dx = x[None, :] - x[start:stop, None]
+        dy = y[None, :] - y[start:stop, None]
+        dist = np.sqrt(dx * dx + dy * dy + softening**2)
+
+        interacts = dist > radius[start:stop, None] + radius[None, :]
+        interacts[np.arange(stop - start), np.arange(start, stop)] = False
+        interacts &= dist > 0
+
+        inverse = np.zeros_like(dist)
+        np.divide(1.0, dist, out=inverse, where=interacts)
+        total += float(mass[start:stop] @ inverse @ mass)
+    return -0.5 * g * total  # Every pair was counted twice
+
+def gravitational_potentials(
+    x: np.ndarray,
+    y: np.ndarray,
+    mass: np.ndarray,
+    radius: np.ndarray,
+    targets: np.ndarray,
+    softening: float = DEFAULT_SOFTENING,
+    g: float = G,
+    block_bytes: int = GRAVITY_BLOCK_BYTES,
+) -> np.ndarray:
+    """
+    Calculate the gravitational potential -G sum(m / d) at some particles, with
+    the same rules as ``gravity_accelerations``. Costs O(len(targets) * N).
+
+    :param targets: Indices of the particles to compute.
+    :return: Array of the potentials, aligned with ``targets``.
+    """
+    n = len(x)
+    rows = np.asarray(targets)
+    phi = np.zeros(len(rows))
+    if n < 2:
+        return phi
+    block = max(1, int(block_bytes // (6 * 8 * n)))
+    for start in range(0, len(rows), block):
+        stop = min(len(rows), start + block)
+        i = rows[start:stop]
+        dx = x[None, :] - x[i, None]
+        dy = y[None, :] - y[i, None]
+        dist = np.sqrt(dx * dx + dy * dy + softening**2)
+
+        interacts = dist > radius[i, None] + radius[None, :]
+        interacts[np.arange(stop - start), i] = False
+        interacts &= dist > 0
+
+        inverse = np.zeros_like(dist)
+        np.divide(1.0, dist, out=inverse, where=interacts)
+        phi[start:stop] = -g * (inverse @ mass)
+    return phi
+
 def is_collision(p1: Particle, p2: Particle) -> bool:
     """
     Check if two particles collide based on their positions and radii.
@@ -54,6 +270,25 @@ def is_collision(p1: Particle, p2: Particle) -> bool:
     distance = distance_euclidienne(p1, p2)
     return distance <= (p1.radius + p2.radius)
 
+def are_colliding(
+    x: np.ndarray,
+    y: np.ndarray,
+    radius: np.ndarray,
+    i: np.ndarray,
+    j: np.ndarray,
+    softening: float = DEFAULT_SOFTENING,
+) -> np.ndarray:
+    """
+    Vectorized ``is_collision`` over pairs of particles.
+
+    :param i: Indices of the first particle of each pair.
+    :param j: Indices of the second particle of each pair.
+    :return: Boolean mask of the colliding pairs.
+    """
+    dx = x[i] - x[j]
+    dy = y[i] - y[j]
+    return np.sqrt(dx * dx + dy * dy + softening**2) <= radius[i] + radius[j]
+
 def resolve_collision(p1: Particle, p2: Particle) -> None:
     """
     Resolve the collision between two particles by inverting their velocities.
@@ -61,7 +296,9 @@ def resolve_collision(p1: Particle, p2: Particle) -> None:
     :param p1: First particle.
     :param p2: Second particle.
     """
-    print(f"Collision non explosive between particles {p1} and {p2}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Collision non explosive between particles %s and %s", p1, p2)
     dx, dy = p1.position - p2.position
     dist = distance_euclidienne(p1, p2)
     if dist != 0:
@@ -80,26 +317,109 @@ def resolve_collision(p1: Particle, p2: Particle) -> None:
     # Mise à jour des vitesses finales
     p1.velocity += (v1n_new - v1) * nx, (v1n_new - v1) * ny
     p2.velocity += (v2n_new - v2) * nx, (v2n_new - v2) * ny
-    print(f"New velocities: {p1.velocity}, {p2.velocity}")
+    if debug:
+        logger.debug("New velocities: %s, %s", p1.velocity, p2.velocity)
+
+CONTACT_POLICIES = ("max", "average", "sum")
+
+def resolve_elastic_collisions(
+    particles: ParticleSystem,
+    i: np.ndarray,
+    j: np.ndarray,
+    policy: str = CONTACT_POLICY,
+    softening: float = DEFAULT_SOFTENING,
+) -> None:
+    """
+    Batched ``resolve_collision`` over many contacts at once.
+
+    Every pair gets the same mass-weighted elastic exchange of normal velocity
+    as ``resolve_collision``, computed from the velocities at the start of the
+    call. A particle in several contacts receives the velocity changes of all
+    of them, combined according to ``policy``:
+
+    - ``"max"``: the exchange of each contact is divided by the largest
+      number of contacts of its two particles. Both sides of a contact see the
+      same impulse, so momentum is exactly conserved, and a particle squeezed
+      between many others does not gain more than one bounce worth of speed.
+    - ``"average"``: the changes are averaged over its contacts, so a particle
+      squeezed between many others never gains more than one bounce worth of
+      speed. Momentum is only exactly conserved when both particles of a
+      contact have the same number of contacts.
+    - ``"sum"``: the changes are added (Jacobi iteration), which matches the
+      sequential resolution when contacts do not share particles.
+
+    :param particles: Particle system.
+    :param i: Slots of the first particle of each contact.
+    :param j: Slots of the second particle of each contact.
+    :param policy: One of CONTACT_POLICIES.
+    :param softening: Softening used for the contact normal, as in ``distance_euclidienne``.
+    """
+    if policy not in CONTACT_POLICIES:
+        raise ValueError(f"Unknown contact policy {policy!r}, expected one of {CONTACT_POLICIES}")
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    if i.size == 0:
+        return
+    x, y, vx, vy, mass = particles.x, particles.y, particles.vx, particles.vy, particles.mass
+
+    dx = x[i] - x[j]
+    dy = y[i] - y[j]
+    dist = np.sqrt(dx * dx + dy * dy + softening**2)
+    safe_dist = np.where(dist != 0, dist, 1.0)
+    nx = np.where(dist != 0, dx / safe_dist, 1.0)  # Normalized direction vector
+    ny = np.where(dist != 0, dy / safe_dist, 0.0)
+
+    v1 = vx[i] * nx + vy[i] * ny
+    v2 = vx[j] * nx + vy[j] * ny
+
+    # Nouvelles vitesses normales (collision élastique)
+    m1, m2 = mass[i], mass[j]
+    v1n_new = (v1 * (m1 - m2) + 2 * m2 * v2) / (m1 + m2)
+    v2n_new = (v2 * (m2 - m1) + 2 * m1 * v1) / (m1 + m2)
+
+    n = len(particles)
+    index = np.concatenate((i, j))
+    dv1, dv2 = v1n_new - v1, v2n_new - v2
+    if policy == "max":
+        contacts = np.bincount(index, minlength=n)
+        share = 1.0 / np.maximum(contacts[i], contacts[j])
+        dv1, dv2 = dv1 * share, dv2 * share
+    dvx = np.bincount(index, np.concatenate((dv1 * nx, dv2 * nx)), minlength=n)
+    dvy = np.bincount(index, np.concatenate((dv1 * ny, dv2 * ny)), minlength=n)
+    if policy == "average":
+        contacts = np.maximum(np.bincount(index, minlength=n), 1)
+        dvx /= contacts
+        dvy /= contacts
+
+    # Mise à jour des vitesses finales
+    vx += dvx
+    vy += dvy
 
-def resolve_colision_fragment(p1: Particle, p2: Particle) -> None:
+def resolve_colision_fragment(p1: Particle, p2: Particle, params: FragParams = FragParams(), rng: np.random.Generator = None) -> None:
     """
     Resolve the collision between two particles by exploding them into fragments.
     :param p1: First particle.
     :param p2: Second particle.
+    :param params: Fragmentation parameters.
+    :param rng: Random generator of the simulation, a fresh unseeded one by default.
     """
+    if rng is None:
+        rng = np.random.default_rng()
+
     # Energy of the collision
     vrelative = p1.velocity - p2.velocity
     vrelative_norm = vrelative.length()
 
     relative_mass = p1.mass * p2.mass / (p1.mass + p2.mass)
     energy = 0.5 * relative_mass * vrelative_norm**2
-    print(f"Collision energy: {energy}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Collision energy: %s", energy)
 
     # Decide if the collision is explosive
     victim = p1 if p1.mass < p2.mass else p2
     impactor = p2 if p1.mass < p2.mass else p1
-    E_seuil = FragParams.Q_star * victim.mass
+    E_seuil = params.Q_star * victim.mass
 
     if not (energy > E_seuil):
         # Normal collision resolution
@@ -107,33 +427,38 @@ def resolve_colision_fragment(p1: Particle, p2: Particle) -> None:
         return
     
     # Explosive collision resolution
-    rate_break = min(0.09, FragParams.c_N * (energy / E_seuil - 1) ** FragParams.beta)
+    rate_break = min(0.09, params.c_N * (energy / E_seuil - 1) ** params.beta)
     M_frag = rate_break * victim.mass
     M_surv = victim.mass - M_frag
-    print(f"Fragment mass: {M_frag}, Surviving mass: {M_surv}")
+    if debug:
+        logger.debug("Fragment mass: %s, Surviving mass: %s", M_frag, M_surv)
 
     # Fragment Number
-    N = FragParams.N_min + math.floor(FragParams.c_N * (energy / E_seuil) ** FragParams.alpha)
-    N = min(N, FragParams.max_fragments)
-    print(f"Number of fragments: {N}")
+    N = params.N_min + math.floor(params.c_N * (energy / E_seuil) ** params.alpha)
+    N = min(N, params.max_fragments)
+    if debug:
+        logger.debug("Number of fragments: %s", N)
 
     # Repartition of mass
-    fragments = generate_fragment(N, M_frag, FragParams.s, FragParams.min_mass)
+    fragments = generate_fragment(N, M_frag, params.s, params.min_mass, params, rng)
     masses = np.array([frag.mass for frag in fragments])
 
     # Speed of the fragments
-    angles = np.random.uniform(0, 2 * np.pi, N)
-    v_eject = np.sqrt(energy / masses) * FragParams.k_ej
-    print(f"Fragment ejection speed: {v_eject}")
+    angles = rng.uniform(0, 2 * np.pi, N)
+    v_eject = np.sqrt(energy / masses) * params.k_ej
+    if debug:
+        logger.debug("Fragment ejection speed: %s", v_eject)
     vx = victim.velocity.vx + v_eject * np.cos(angles)
     vy = victim.velocity.vy + v_eject * np.sin(angles)
-    print(f"Fragments velocities: {vx}, {vy}")
+    if debug:
+        logger.debug("Fragments velocities: %s, %s", vx, vy)
 
     # Create new particles for fragments
     particles = []
 
     for i, frag in enumerate(fragments):
-        print(f"Creating fragment {i+1}/{N} with mass {frag.mass} and radius {frag.radius}")
+        if debug:
+            logger.debug("Creating fragment %d/%d with mass %s and radius %s", i + 1, N, frag.mass, frag.radius)
         new_particle = ParticleFragment(
             mass=frag.mass,
             position=Position2D(victim.position.x, victim.position.y),
@@ -141,34 +466,41 @@ def resolve_colision_fragment(p1: Particle, p2: Particle) -> None:
             radius=frag.radius,
             color=victim.color
         )
+        new_particle.lifetime = params.fragment_lifetime
         particles.append(new_particle)
 
     victim.radius = victim.radius * M_surv / victim.mass  # Update the radius based on the new mass
     victim.mass = M_surv  # Update the mass of the surviving particle
 
-    if victim.radius < FragParams.min_particle_radius:
+    if victim.radius < params.min_particle_radius:
         victim.lifetime = 0  # If the radius is too small, set lifetime to 0
 
-    print(f"Surviving particle updated: {victim.mass} kg, radius {victim.radius}")
+    if debug:
+        logger.debug("Surviving particle updated: %s kg, radius %s", victim.mass, victim.radius)
     resolve_collision(victim, impactor)  # Resolve collision for the original particles
 
-    print(f"Collision explosive between particles {p1} and {p2}, generating {len(particles)} fragments.")
+    if debug:
+        logger.debug("Collision explosive between particles %s and %s, generating %d fragments.", p1, p2, len(particles))
     return particles
 
 
-def generate_fragment(N:int, M_frag, s:float = FragParams.s, min_mass:float = FragParams.min_mass) -> ParticleData:
+def generate_fragment(N:int, M_frag, s:float = FragParams.s, min_mass:float = FragParams.min_mass, params: FragParams = FragParams(), rng: np.random.Generator = None) -> ParticleData:
     """
     Generate fraagment particles after a collision.
 
     :param N: Number of fragments to generate.
     :param M_frag: Total mass of the fragments.
     :param s: exponent for mass distribution.
+    :param params: Fragmentation parameters (density and minimum radius).
+    :param rng: Random generator of the simulation, a fresh unseeded one by default.
     :return: List of generated fragment particles.
     """
-    raw_sample = (np.random.pareto(s, N) + 1) * min_mass
+    if rng is None:
+        rng = np.random.default_rng()
+    raw_sample = (rng.pareto(s, N) + 1) * min_mass
     masses = raw_sample / raw_sample.sum() * M_frag
 
-    radius = np.sqrt(masses / (np.pi * FragParams.rho))
+    radius = np.sqrt(masses / (np.pi * params.rho))
 
     fragments = []
 
@@ -176,11 +508,113 @@ def generate_fragment(N:int, M_frag, s:float = FragParams.s, min_mass:float = Fr
         fragments.append(
             ParticleData(
                 mass=mass,
-                radius=max(rad, FragParams.min_particle_radius)  # Ensure radius is not less than minimum
+                radius=max(rad, params.min_particle_radius)  # Ensure radius is not less than minimum
             )
         )
     
     return fragments
 
-def collision(p1: Particle, p2: Particle, mode = resolve_collision):
-    return mode(p1, p2)
\ No newline at end of file
+def resolve_fragmentations(
+    particles: ParticleSystem,
+    i: np.ndarray,
+    j: np.ndarray,
+    params: FragParams = FragParams(),
+    rng: np.random.Generator = None,
+    policy: str = CONTACT_POLICY,
+    events: EventCounter = None,
+) -> np.ndarray:
+    """
+    Batched ``resolve_colision_fragment`` over every contact of a step.
+
+    The energies, victims and thresholds of all pairs are computed from the
+    state at the start of the stage, the masses, radii, angles and ejection
+    speeds of all the fragments are sampled in single array operations, and the
+    fragments are appended to the system in one bulk insert. A particle that is
+    the victim of several explosive collisions loses the fragments of each of
+    them, scaled down if they would exceed its mass, so that the total mass is
+    conserved.
+    Non-explosive contacts, and victim/impactor pairs after fragmentation, are
+    resolved elastically by ``resolve_elastic_collisions``.
+
+    :param particles: Particle system.
+    :param i: Slots of the first particle of each contact.
+    :param j: Slots of the second particle of each contact.
+    :param params: Fragmentation parameters.
+    :param rng: Random generator of the simulation, a fresh unseeded one by default.
+    :param policy: Policy for particles in several contacts, see ``resolve_elastic_collisions``.
+    :param events: Counter receiving the numbers of explosive collisions, fragments and destroyed victims.
+    :return: Ids of the new fragments.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    mass, vx, vy = particles.mass, particles.vx, particles.vy
+
+    # Energy of the collisions
+    m1, m2 = mass[i], mass[j]
+    relative_mass = m1 * m2 / (m1 + m2)
+    energy = 0.5 * relative_mass * ((vx[i] - vx[j]) ** 2 + (vy[i] - vy[j]) ** 2)
+
+    # Decide which collisions are explosive
+    victim = np.where(m1 < m2, i, j)
+    impactor = np.where(m1 < m2, j, i)
+    E_seuil = params.Q_star * mass[victim]
+    explosive = energy > E_seuil
+    new_ids = np.empty(0, dtype=np.int64)
+
+    if explosive.any():
+        victim_e, energy_e, E_seuil_e = victim[explosive], energy[explosive], E_seuil[explosive]
+        rate_break = np.minimum(0.09, params.c_N * (energy_e / E_seuil_e - 1) ** params.beta)
+        M_frag = rate_break * mass[victim_e]
+        victims, hit = np.unique(victim_e, return_inverse=True)
+        victim_mass = mass[victims]
+        lost = np.bincount(hit, M_frag)
+        scale = np.minimum(1.0, victim_mass / lost)  # Une victime ne perd jamais plus que sa masse
+        M_frag *= scale[hit]
+        lost *= scale
+
+        # Fragment numbers and repartition of mass
+        N = params.N_min + np.floor(params.c_N * (energy_e / E_seuil_e) ** params.alpha).astype(np.int64)
+        N = np.minimum(N, params.max_fragments)
+        owner = np.repeat(np.arange(len(N)), N)
+        raw_sample = (rng.pareto(params.s, owner.size) + 1) * params.min_mass
+        masses = raw_sample / np.bincount(owner, raw_sample)[owner] * M_frag[owner]
+        radius = np.maximum(np.sqrt(masses / (np.pi * params.rho)), params.min_particle_radius)
+
+        # Speed of the fragments
+        angles = rng.uniform(0, 2 * np.pi, owner.size)
+        v_eject = np.sqrt(energy_e[owner] / masses) * params.k_ej
+        source = victim_e[owner]
+        new_ids = particles.add_batch(
+            masses,
+            particles.x[source],
+            particles.y[source],
+            vx[source] + v_eject * np.cos(angles),
+            vy[source] + v_eject * np.sin(angles),
+            radius,
+            colors=[particles.colors[k] for k in source.tolist()],
+            lifetime=params.fragment_lifetime,
+            flags=FRAGMENT,
+            trail_lengths=1,
+        )
+
+        # Update the surviving particles (the arrays may have been reallocated)
+        M_surv = victim_mass - lost
+        particles.radius[victims] *= M_surv / victim_mass  # Update the radius based on the new mass
+        particles.mass[victims] = M_surv
+        too_small = victims[particles.radius[victims] < params.min_particle_radius]
+        particles.lifetime[too_small] = 0
+        if events is not None:
+            events.add("explosive_collisions", len(victim_e))
+            events.add("fragments", owner.size)
+            events.add("destroyed", len(too_small))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%d explosive collisions generated %d fragments.", len(victim_e), owner.size)
+
+    resolve_elastic_collisions(particles, np.where(explosive, victim, i), np.where(explosive, impactor, j), policy)
+
+    return new_ids
+
+def collision(p1: Particle, p2: Particle, mode = resolve_collision, **kwargs):
+    return mode(p1, p2, **kwargs)
\ No newline at end of file
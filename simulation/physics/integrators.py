@@ -0,0 +1,186 @@
+from typing import Callable
+
+import numpy as np
+
+from simulation.physics.particle import ParticleSystem
+from simulation.physics.backends import NumpyBackend
+from simulation.utils.constants import BLOCK_TIMESTEP_ETA, BLOCK_TIMESTEP_MAX_LEVEL
+
+# accelerations(x, y, targets=None) -> (ax, ay) for the current masses and radii, aligned with targets when given
+AccelerationFunction = Callable[..., tuple[np.ndarray, np.ndarray]]
+
+
+class Integrator:
+    """
+    Advances the velocities and positions of a whole ParticleSystem by one step.
+
+    ``collide`` is called once per step, at the point of the scheme where the
+    velocity changes of collisions (and new fragments) belong. Kicks and
+    drifts go through ``backend``, set by the Simulation.
+    """
+    name = None
+    backend = NumpyBackend()
+
+    def step(self, particles: ParticleSystem, dt: float, accelerations: AccelerationFunction, collide: Callable[[], None]) -> None:
+        raise NotImplementedError
+
+    def options(self) -> dict:
+        """Keyword arguments recreating this integrator with ``get_integrator``."""
+        return {}
+
+
+class Euler(Integrator):
+    """
+    Semi-implicit Euler: kick with the current acceleration, resolve the
+    collisions, then drift. First order, the historical scheme of the project.
+    """
+    name = "euler"
+
+    def step(self, particles, dt, accelerations, collide):
+        ax, ay = accelerations(particles.x, particles.y)
+        self.backend.kick(particles, ax, ay, dt)
+        collide()
+        self.backend.drift(particles, dt)
+
+
+class Leapfrog(Integrator):
+    """
+    Kick-drift-kick leapfrog (velocity Verlet). Second order and symplectic,
+    with a single acceleration evaluation per step: the acceleration at the end
+    of a step is reused at the start of the next one while the particles are
+    unchanged in between.
+    """
+    name = "leapfrog"
+
+    def __init__(self):
+        self._cache = None
+
+    def _store(self, particles: ParticleSystem, ax: np.ndarray, ay: np.ndarray) -> None:
+        self._cache = (
+            particles.ids.copy(), particles.x.copy(), particles.y.copy(),
+            particles.mass.copy(), particles.radius.copy(), ax, ay,
+        )
+
+    def initial_accelerations(self, particles: ParticleSystem, accelerations: AccelerationFunction) -> tuple[np.ndarray, np.ndarray]:
+        """Acceleration at the start of the step, from the cache when still valid."""
+        if self._cache is not None:
+            ids, x, y, mass, radius, ax, ay = self._cache
+            current = (particles.ids, particles.x, particles.y, particles.mass, particles.radius)
+            if all(np.array_equal(a, b) for a, b in zip((ids, x, y, mass, radius), current)):
+                return ax, ay
+        return accelerations(particles.x, particles.y)
+
+    def step(self, particles, dt, accelerations, collide):
+        ax, ay = self.initial_accelerations(particles, accelerations)
+        self.backend.kick(particles, ax, ay, dt / 2)
+        self.backend.drift(particles, dt)
+        ax, ay = accelerations(particles.x, particles.y)
+        self.backend.kick(particles, ax, ay, dt / 2)
+        self._store(particles, ax, ay)
+        collide()
+
+
+class RK4(Integrator):
+    """
+    Classical fourth order Runge-Kutta on (position, velocity). Four
+    acceleration evaluations per step, walls are applied once at the end.
+    """
+    name = "rk4"
+
+    def step(self, particles, dt, accelerations, collide):
+        x0, y0 = particles.x.copy(), particles.y.copy()
+        vx0, vy0 = particles.vx.copy(), particles.vy.copy()
+
+        k1x, k1y = vx0, vy0
+        k1vx, k1vy = accelerations(x0, y0)
+        k2x, k2y = vx0 + k1vx * (dt / 2), vy0 + k1vy * (dt / 2)
+        k2vx, k2vy = accelerations(x0 + k1x * (dt / 2), y0 + k1y * (dt / 2))
+        k3x, k3y = vx0 + k2vx * (dt / 2), vy0 + k2vy * (dt / 2)
+        k3vx, k3vy = accelerations(x0 + k2x * (dt / 2), y0 + k2y * (dt / 2))
+        k4x, k4y = vx0 + k3vx * dt, vy0 + k3vy * dt
+        k4vx, k4vy = accelerations(x0 + k3x * dt, y0 + k3y * dt)
+
+        particles.x[:] = x0 + (k1x + 2 * k2x + 2 * k3x + k4x) * (dt / 6)
+        particles.y[:] = y0 + (k1y + 2 * k2y + 2 * k3y + k4y) * (dt / 6)
+        particles.vx[:] = vx0 + (k1vx + 2 * k2vx + 2 * k3vx + k4vx) * (dt / 6)
+        particles.vy[:] = vy0 + (k1vy + 2 * k2vy + 2 * k3vy + k4vy) * (dt / 6)
+        particles.apply_boundaries()
+        collide()
+
+
+class BlockLeapfrog(Leapfrog):
+    """
+    Leapfrog with individual block timesteps.
+
+    Each particle gets the power-of-two fraction ``dt / 2**level`` closest below
+    ``eta * sqrt(radius / |a|)``. The step is split into ``2**max(level)``
+    substeps: every particle drifts on each of them, but is only kicked at the
+    start and the end of its own timestep. Quiet particles therefore keep the
+    full step while close encounters are resolved finely. Gravity is only
+    evaluated for the particles whose timestep ends on a substep, so a substep
+    costs in proportion to the particles it kicks.
+    """
+    name = "block"
+
+    def __init__(self, eta: float = BLOCK_TIMESTEP_ETA, max_level: int = BLOCK_TIMESTEP_MAX_LEVEL):
+        super().__init__()
+        self.eta = eta
+        self.max_level = max_level
+        self.levels = np.empty(0, dtype=np.int64)
+
+    def options(self):
+        return {"eta": self.eta, "max_level": self.max_level}
+
+    def timestep_levels(self, particles: ParticleSystem, ax: np.ndarray, ay: np.ndarray, dt: float) -> np.ndarray:
+        """
+        Level of each particle, its timestep being ``dt / 2**level``.
+        """
+        norm = np.hypot(ax, ay)
+        length = np.maximum(particles.radius, 1e-12)
+        with np.errstate(divide="ignore"):
+            ideal = self.eta * np.sqrt(length / norm)
+            levels = np.ceil(np.log2(dt / ideal))
+        return np.clip(np.nan_to_num(levels, nan=0, neginf=0), 0, self.max_level).astype(np.int64)
+
+    def step(self, particles, dt, accelerations, collide):
+        ax, ay = self.initial_accelerations(particles, accelerations)
+        ax, ay = ax.copy(), ay.copy()  # Updated in place, the cache keeps the previous step
+        self.levels = levels = self.timestep_levels(particles, ax, ay, dt)
+        top = int(levels.max()) if len(levels) else 0
+        substeps = 1 << top
+        h = dt / substeps
+        period = 1 << (top - levels)  # Substeps per particle timestep
+        half_dt = dt / (1 << levels) / 2
+
+        for sub in range(substeps):
+            starting = sub % period == 0
+            particles.vx[starting] += ax[starting] * half_dt[starting]
+            particles.vy[starting] += ay[starting] * half_dt[starting]
+            self.backend.drift(particles, h)
+            ending = np.flatnonzero((sub + 1) % period == 0)
+            if sub == substeps - 1:
+                ax, ay = accelerations(particles.x, particles.y)  # Every timestep ends with the step
+            else:
+                ax[ending], ay[ending] = accelerations(particles.x, particles.y, targets=ending)
+            particles.vx[ending] += ax[ending] * half_dt[ending]
+            particles.vy[ending] += ay[ending] * half_dt[ending]
+
+        self._store(particles, ax, ay)
+        collide()
+
+
+INTEGRATORS = {cls.name: cls for cls in (Euler, Leapfrog, RK4, BlockLeapfrog)}
+
+def get_integrator(name: str, **options) -> Integrator:
+    """
+    Create the integrator registered under ``name``.
+
+    :param name: Key of INTEGRATORS.
+    :param options: Keyword arguments of the integrator, e.g. ``eta`` for "block".
+    :return: New integrator instance.
+    """
+    try:
+        cls = INTEGRATORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown integrator {name!r}, expected one of {sorted(INTEGRATORS)}") from None
+    return cls(**options)
@@ -0,0 +1,144 @@
+"""
+Level of detail for the fragments.
+
+Fragmentation cascades add particles faster than ``fragment_lifetime``
+removes them, and most of them are fragments too small to collide. Two
+mechanisms bound their cost:
+
+- test particles: particles too small to collide feel the gravity of the
+  others but exert none, so the direct gravity costs O(N * S) for S colliding
+  particles instead of O(N²). Their own mass no longer pulls the others, which
+  the conservation diagnostics show as a momentum and energy residual.
+- merging: when the system holds more than ``max_particles`` particles, the
+  tiny fragments (fragments too small to collide) sharing a cell of a grid
+  are merged into one aggregate that keeps their total mass, momentum and
+  center of mass. The cells start at ``merge_cell`` and double until the
+  budget is met or a single cell covers the domain. The internal kinetic
+  energy and angular momentum of the merged fragments are lost.
+"""
+import logging
+from typing import Optional
+
+import numpy as np
+
+from simulation.physics.particle import ParticleSystem, FRAGMENT, COLLIDES, CONSERVED
+from simulation.utils.constants import LOD_MAX_PARTICLES, LOD_MERGE_CELL, LOD_TEST_PARTICLES, FragParams
+
+logger = logging.getLogger(__name__)
+
+
+class LevelOfDetail:
+    """
+    Settings and operations of the level of detail, used by the Simulation.
+    """
+    def __init__(
+        self,
+        max_particles: Optional[int] = LOD_MAX_PARTICLES,
+        merge_cell: float = LOD_MERGE_CELL,
+        test_particles: bool = LOD_TEST_PARTICLES,
+    ):
+        """
+        :param max_particles: Particle budget above which the tiny fragments are merged, None to never merge.
+        :param merge_cell: Size of the finest merge cells.
+        :param test_particles: Particles too small to collide exert no gravity.
+        """
+        if max_particles is not None and max_particles < 1:
+            raise ValueError("max_particles must be positive")
+        if merge_cell <= 0:
+            raise ValueError("merge_cell must be positive")
+        self.max_particles = max_particles
+        self.merge_cell = merge_cell
+        self.test_particles = test_particles
+        self._over_budget = False  # Warned that merging could not meet the budget
+
+    def options(self) -> dict:
+        """Keyword arguments recreating these settings."""
+        return {"max_particles": self.max_particles, "merge_cell": self.merge_cell, "test_particles": self.test_particles}
+
+    def sources(self, particles: ParticleSystem) -> Optional[np.ndarray]:
+        """
+        Slots of the particles exerting gravity.
+
+        :param particles: Particle system.
+        :return: Slots of the particles that collide, or None when every particle exerts gravity.
+        """
+        if not self.test_particles:
+            return None
+        collides = particles.collides
+        if collides.all():
+            return None
+        return np.flatnonzero(collides)
+
+    def merge(self, particles: ParticleSystem, params: FragParams = FragParams()) -> tuple[int, np.ndarray]:
+        """
+        Merge the tiny fragments cell by cell when the system is over budget.
+
+        Each aggregate takes the slot, id and color of the first fragment of its
+        cell, the total mass and momentum of the cell, its center of mass, the
+        radius of its mass (at least ``min_particle_radius``) and the longest
+        remaining lifetime. Aggregates are tiny fragments themselves and never
+        collide.
+
+        :param particles: Particle system.
+        :param params: Fragmentation parameters, for the density and the minimum radius.
+        :return: Number of removed particles, and the change of the totals of
+                 CONSERVED (the kinetic energy and angular momentum of the
+                 fragments relative to their aggregate).
+        """
+        change = np.zeros(len(CONSERVED))
+        if self.max_particles is None or len(particles) <= self.max_particles:
+            return 0, change
+        excess = len(particles) - self.max_particles
+        flags = particles.flags
+        slots = np.flatnonzero(((flags & FRAGMENT) != 0) & ((flags & COLLIDES) == 0))
+        if len(slots) < 2:
+            return self._short(len(particles)), change
+
+        # Coarsen the cells until enough fragments share one
+        x, y = particles.x[slots], particles.y[slots]
+        cell = self.merge_cell
+        extent = max(particles.width, particles.height)
+        while True:
+            columns = max(1, int(np.ceil(particles.width / cell)))
+            rows = max(1, int(np.ceil(particles.height / cell)))
+            cx = np.clip((x // cell).astype(np.int64), 0, columns - 1)
+            cy = np.clip((y // cell).astype(np.int64), 0, rows - 1)
+            keys, group, counts = np.unique(cy * columns + cx, return_inverse=True, return_counts=True)
+            if len(slots) - len(keys) >= excess or cell >= extent:
+                break
+            cell *= 2
+
+        merged = counts[group] > 1
+        slots, group = slots[merged], group[merged]
+        if len(slots) == 0:
+            return self._short(len(particles)), change
+        _, group = np.unique(group, return_inverse=True)
+        before = particles.conserved(slots)
+
+        mass = particles.mass[slots]
+        total = np.bincount(group, mass)
+        order = np.argsort(group, kind="stable")
+        starts = np.flatnonzero(np.r_[True, np.diff(group[order]) != 0])
+        keepers = slots[order[starts]]  # Lowest slot of each cell, slots are sorted
+        p = particles
+        p.x[keepers] = np.bincount(group, mass * p.x[slots]) / total
+        p.y[keepers] = np.bincount(group, mass * p.y[slots]) / total
+        p.vx[keepers] = np.bincount(group, mass * p.vx[slots]) / total
+        p.vy[keepers] = np.bincount(group, mass * p.vy[slots]) / total
+        p.lifetime[keepers] = np.maximum.reduceat(p.lifetime[slots][order], starts)
+        p.mass[keepers] = total
+        p.radius[keepers] = np.maximum(np.sqrt(total / (np.pi * params.rho)), params.min_particle_radius)
+        change = p.conserved(keepers) - before
+
+        removed = np.setdiff1d(slots, keepers, assume_unique=True)
+        p.remove_indices(removed)
+        if len(particles) > self.max_particles:
+            self._short(len(particles))
+        return len(removed), change
+
+    def _short(self, n: int) -> int:
+        """Warn once that merging cannot bring the system within its budget."""
+        if not self._over_budget:
+            self._over_budget = True
+            logger.warning("%d particles left after merging the tiny fragments, over the budget of %d", n, self.max_particles)
+        return 0
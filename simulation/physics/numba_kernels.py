@@ -0,0 +1,201 @@
+"""
+Numba versions of the hot loops, used by the "numba" backend.
+
+Importing this module needs numba; ``simulation.physics.backends`` only does
+it when that backend is selected. The kernels loop over the particles with
+``prange`` (all cores) and keep everything in registers, where the NumPy
+reference allocates pairwise temporaries. They are compiled on first use and
+cached on disk.
+"""
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, fastmath=False, cache=True)
+def gravity_direct(x, y, mass, radius, targets, sources, softening, g):
+    """
+    All-pairs gravity of ``gravity_accelerations`` for the particles of
+    ``targets``, exerted by the particles of ``sources``.
+    """
+    ax = np.zeros(len(targets))
+    ay = np.zeros(len(targets))
+    soft2 = softening * softening
+    for t in prange(len(targets)):
+        i = targets[t]
+        xi, yi, ri = x[i], y[i], radius[i]
+        sx = 0.0
+        sy = 0.0
+        for s in range(len(sources)):
+            j = sources[s]
+            if j == i:
+                continue
+            dx = x[j] - xi
+            dy = y[j] - yi
+            dist2 = dx * dx + dy * dy + soft2
+            dist = np.sqrt(dist2)
+            if dist > ri + radius[j] and dist > 0:
+                factor = g * mass[j] / (dist2 * dist)
+                sx += factor * dx
+                sy += factor * dy
+        ax[t] = sx
+        ay[t] = sy
+    return ax, ay
+
+
+@njit(cache=True)
+def _cell_ranges(cells):
+    """Keys, starts and counts of the runs of equal values of a sorted array."""
+    n = len(cells)
+    runs = 0
+    for k in range(n):
+        if k == 0 or cells[k] != cells[k - 1]:
+            runs += 1
+    keys = np.empty(runs, dtype=np.int64)
+    starts = np.empty(runs, dtype=np.int64)
+    counts = np.zeros(runs, dtype=np.int64)
+    run = -1
+    for k in range(n):
+        if k == 0 or cells[k] != cells[k - 1]:
+            run += 1
+            keys[run] = cells[k]
+            starts[run] = k
+        counts[run] += 1
+    return keys, starts, counts
+
+
+@njit(cache=True)
+def _find(keys, key):
+    """Position of ``key`` in the sorted ``keys``, -1 when absent."""
+    k = np.searchsorted(keys, key)
+    if k < len(keys) and keys[k] == key:
+        return k
+    return -1
+
+
+@njit(cache=True)
+def _visit_cell(p, start, count, x, y, radius, soft2, out_a, out_b, fill, position):
+    """Test ``p`` against the particles [start, start + count); returns (candidates, contacts, position)."""
+    candidates = 0
+    contacts = 0
+    for q in range(start, start + count):
+        candidates += 1
+        dx = x[p] - x[q]
+        dy = y[p] - y[q]
+        if np.sqrt(dx * dx + dy * dy + soft2) <= radius[p] + radius[q]:
+            if fill:
+                out_a[position] = p
+                out_b[position] = q
+                position += 1
+            contacts += 1
+    return candidates, contacts, position
+
+
+@njit(parallel=True, cache=True)
+def grid_contacts(x, y, radius, cells, columns, softening):
+    """
+    Broad and narrow phase over particles sorted by grid cell.
+
+    Every particle is tested against the following particles of its cell and
+    against the particles of the half stencil of neighbouring cells used by
+    ``SpatialHash.candidate_pairs``, so each pair is seen once. A first pass
+    counts the contacts of each particle, a second one writes them at offsets
+    given by the prefix sum, which keeps the output deterministic.
+
+    :param x: X positions, sorted by cell.
+    :param y: Y positions, sorted by cell.
+    :param radius: Radii, sorted by cell.
+    :param cells: Cell key of each particle, sorted.
+    :param columns: Number of columns of the grid.
+    :param softening: Softening of the distances.
+    :return: Positions (a, b) in the sorted arrays of the touching pairs, and the number of candidate pairs.
+    """
+    n = len(cells)
+    keys, starts, counts = _cell_ranges(cells)
+    soft2 = softening * softening
+    run_of = np.empty(n, dtype=np.int64)
+    for r in range(len(keys)):
+        for k in range(starts[r], starts[r] + counts[r]):
+            run_of[k] = r
+    # Neighbour runs of each run, in the order of _NEIGHBOURS: (1, 0), (-1, 1), (0, 1), (1, 1)
+    neighbours = np.full((len(keys), 4), -1, dtype=np.int64)
+    for r in prange(len(keys)):
+        column = keys[r] % columns
+        if column + 1 < columns:
+            neighbours[r, 0] = _find(keys, keys[r] + 1)
+            neighbours[r, 3] = _find(keys, keys[r] + columns + 1)
+        if column - 1 >= 0:
+            neighbours[r, 1] = _find(keys, keys[r] + columns - 1)
+        neighbours[r, 2] = _find(keys, keys[r] + columns)
+
+    dummy = np.empty(0, dtype=np.int64)
+    found = np.zeros(n, dtype=np.int64)
+    tested = np.zeros(n, dtype=np.int64)
+    for p in prange(n):
+        r = run_of[p]
+        candidates, contacts, _ = _visit_cell(p, p + 1, starts[r] + counts[r] - p - 1, x, y, radius, soft2, dummy, dummy, False, 0)
+        for d in range(4):
+            other = neighbours[r, d]
+            if other >= 0:
+                c, h, _ = _visit_cell(p, starts[other], counts[other], x, y, radius, soft2, dummy, dummy, False, 0)
+                candidates += c
+                contacts += h
+        found[p] = contacts
+        tested[p] = candidates
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(found)
+    out_a = np.empty(offsets[n], dtype=np.int64)
+    out_b = np.empty(offsets[n], dtype=np.int64)
+    for p in prange(n):
+        if found[p] == 0:
+            continue
+        r = run_of[p]
+        _, _, position = _visit_cell(p, p + 1, starts[r] + counts[r] - p - 1, x, y, radius, soft2, out_a, out_b, True, offsets[p])
+        for d in range(4):
+            other = neighbours[r, d]
+            if other >= 0:
+                _, _, position = _visit_cell(p, starts[other], counts[other], x, y, radius, soft2, out_a, out_b, True, position)
+    return out_a, out_b, tested.sum()
+
+
+@njit(parallel=True, cache=True)
+def kick(vx, vy, ax, ay, dt):
+    """vx += ax * dt, vy += ay * dt in place."""
+    for k in prange(len(vx)):
+        vx[k] += ax[k] * dt
+        vy[k] += ay[k] * dt
+
+
+@njit(parallel=True, cache=True)
+def drift(x, y, vx, vy, radius, mass, dt, width, height):
+    """
+    ``ParticleSystem.drift`` in one pass: move, then bounce on the walls.
+
+    :return: Number of bounces, and the momentum (x, y) and angular momentum they gave.
+    """
+    bounces = 0
+    px = 0.0
+    py = 0.0
+    angular = 0.0
+    for k in prange(len(x)):
+        xk = x[k] + vx[k] * dt
+        yk = y[k] + vy[k] * dt
+        touch_x = xk <= 0 or xk >= width - radius[k]
+        touch_y = yk <= 0 or yk >= height - radius[k]
+        if touch_x or touch_y:
+            before = xk * vy[k] - yk * vx[k]
+            vx0 = vx[k]
+            vy0 = vy[k]
+            if touch_x:
+                vx[k] = -vx[k]
+                xk = abs(xk) if xk < 0 else 2 * width - xk
+            if touch_y:
+                vy[k] = -vy[k]
+                yk = abs(yk) if yk < 0 else 2 * height - yk
+            bounces += 1
+            px += mass[k] * (vx[k] - vx0)
+            py += mass[k] * (vy[k] - vy0)
+            angular += mass[k] * (xk * vy[k] - yk * vx[k] - before)
+        x[k] = xk
+        y[k] = yk
+    return bounces, px, py, angular
@@ -1,22 +1,467 @@
+from collections import deque
+
+import numpy as np
+
+from simulation.physics.trails import TrailStore
 from simulation.utils.positions import Position2D, Velocity2D
 from simulation.utils.constants import PARTICLE_RADIUS, SCREEN_WIDTH, SCREEN_HEIGHT, MAX_PARTICLE_TRAIL_LENGTH, DEFAULT_PARTICLE_COLOR, FragParams
 
-class MaxSizeList(list):
+# Bit flags stored in ParticleSystem.flags
+COLLIDES = 1  # The particle takes part in collisions
+FRAGMENT = 2  # The particle was created by a fragmentation
+
+NO_LIFETIME = np.inf  # Stored lifetime of particles that never expire
+
+# Totals returned by ParticleSystem.conserved, in this order
+CONSERVED = ("mass", "px", "py", "angular_momentum", "kinetic")
+
+class MaxSizeList(deque):
     """
     A list that maintains a maximum size.
-    When the size exceeds the limit, the oldest elements are removed.
+    When the size exceeds the limit, the oldest elements are removed (in O(1)).
+    A max_size of 0 means no limit.
     """
-    def __init__(self, max_size):
-        super().__init__()
+    def __init__(self, max_size, items=()):
+        super().__init__(items, maxlen=max_size if max_size > 0 else None)
         self.max_size = max_size
 
-    def append(self, item):
-        if len(self) >= self.max_size > 0:
-            self.pop(0)  # Remove the oldest item
-        super().append(item)
+class ParticleSystem:
+    """
+    Structure-of-arrays storage for all the particles of a simulation.
+
+    Every property lives in its own contiguous NumPy array so that the physics
+    can work on whole arrays at once. Removal swaps the last particle into the
+    freed slot, so slots are not stable: particles are identified by their id.
+    """
+    _FIELDS = (
+        ("mass", np.float64),
+        ("x", np.float64),
+        ("y", np.float64),
+        ("vx", np.float64),
+        ("vy", np.float64),
+        ("radius", np.float64),
+        ("lifetime", np.float64),
+        ("flags", np.uint8),
+        ("ids", np.int64),
+        ("trail_limit", np.int32),  # Maximum number of points of the trail, <= 1 for none
+        ("trail_rows", np.int32),  # Row in self.trails, -1 until the first point is recorded
+    )
+
+    def __init__(self, capacity:int = 64, width:float = SCREEN_WIDTH, height:float = SCREEN_HEIGHT):
+        """
+        Initialize an empty particle system.
+
+        :param capacity: Number of particles that can be stored before the arrays grow.
+        :param width: Width of the domain, the particles bounce on its walls.
+        :param height: Height of the domain.
+        """
+        capacity = max(1, capacity)
+        self.width = width
+        self.height = height
+        self.wall_bounces = 0  # Bounces on the walls since the counters were reset
+        self.wall_impulse = np.zeros(3)  # Momentum (x, y) and angular momentum given by these bounces
+        self._size = 0
+        self._capacity = capacity
+        for name, dtype in self._FIELDS:
+            setattr(self, "_" + name, np.empty(capacity, dtype=dtype))
+        self.colors = []
+        self.trails = TrailStore()
+        self._next_id = 0
+        self._slot_of = np.full(capacity, -1, dtype=np.int64)  # id -> slot, -1 once removed
+
+    @classmethod
+    def from_arrays(cls, arrays:dict, colors:list, next_id:int, trails:TrailStore = None, width:float = SCREEN_WIDTH, height:float = SCREEN_HEIGHT) -> 'ParticleSystem':
+        """
+        Build a system directly on existing arrays, without copying them.
+
+        The arrays may be memory-maps: they are only copied once the system
+        grows beyond their length.
+
+        :param arrays: Field name -> array, for every name of ``_FIELDS``, all of the same length.
+        :param colors: Color of each particle.
+        :param next_id: Id given to the next particle added, at least ``max(ids) + 1``.
+        :param trails: Store of the rows referenced by ``trail_rows``, empty by default.
+        :param width: Width of the domain.
+        :param height: Height of the domain.
+        """
+        system = cls.__new__(cls)
+        system.width = width
+        system.height = height
+        system.wall_bounces = 0
+        system.wall_impulse = np.zeros(3)
+        size = len(arrays["ids"])
+        system._size = size
+        system._capacity = size
+        for name, dtype in cls._FIELDS:
+            array = arrays[name]
+            if array.dtype != dtype or len(array) != size:
+                raise ValueError(f"field {name!r} must be a {np.dtype(dtype)} array of length {size}")
+            setattr(system, "_" + name, array)
+        system.colors = list(colors)
+        system.trails = trails if trails is not None else TrailStore()
+        system._next_id = next_id
+        system._slot_of = np.full(max(next_id, 1), -1, dtype=np.int64)
+        system._slot_of[arrays["ids"]] = np.arange(size)
+        return system
+
+    # Array access ---------------------------------------------------------
+
+    mass = property(lambda self: self._mass[:self._size])
+    x = property(lambda self: self._x[:self._size])
+    y = property(lambda self: self._y[:self._size])
+    vx = property(lambda self: self._vx[:self._size])
+    vy = property(lambda self: self._vy[:self._size])
+    radius = property(lambda self: self._radius[:self._size])
+    lifetime = property(lambda self: self._lifetime[:self._size])
+    flags = property(lambda self: self._flags[:self._size])
+    ids = property(lambda self: self._ids[:self._size])
+    trail_limit = property(lambda self: self._trail_limit[:self._size])
+    trail_rows = property(lambda self: self._trail_rows[:self._size])
+
+    @property
+    def next_id(self) -> int:
+        """Id given to the next particle, i.e. the number of particles ever added."""
+        return self._next_id
+
+    @property
+    def collides(self) -> np.ndarray:
+        """Boolean mask of the particles taking part in collisions."""
+        return (self.flags & COLLIDES) != 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        for pid in self.ids.tolist():
+            yield self.view(pid)
+
+    def __getitem__(self, index:int) -> 'Particle':
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("particle index out of range")
+        return self.view(int(self._ids[index]))
+
+    def __contains__(self, particle) -> bool:
+        return isinstance(particle, Particle) and particle._system is self and self.slot(particle._id) >= 0
+
+    def slot(self, pid:int) -> int:
+        """
+        Return the current slot of a particle id, or -1 if it is not stored here.
+
+        :param pid: Id of the particle.
+        """
+        if 0 <= pid < self._next_id:
+            return int(self._slot_of[pid])
+        return -1
+
+    def view(self, pid:int) -> 'Particle':
+        """
+        Return a Particle view on the particle with the given id.
+
+        :param pid: Id of the particle.
+        """
+        slot = self.slot(pid)
+        if slot < 0:
+            raise KeyError(f"no particle with id {pid}")
+        cls = ParticleFragment if self._flags[slot] & FRAGMENT else Particle
+        particle = object.__new__(cls)
+        particle._system = self
+        particle._id = pid
+        return particle
+
+    # Insertion ------------------------------------------------------------
+
+    def _reserve(self, n:int) -> None:
+        """Grow the arrays (doubling) so that ``n`` particles fit."""
+        if n <= self._capacity:
+            return
+        capacity = max(n, 2 * self._capacity)
+        for name, _ in self._FIELDS:
+            old = getattr(self, "_" + name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, "_" + name, new)
+        self._capacity = capacity
+
+    def _reserve_ids(self, n:int) -> None:
+        """Grow the id -> slot table so that ``n`` ids fit."""
+        if n <= len(self._slot_of):
+            return
+        table = np.full(max(n, 2 * len(self._slot_of)), -1, dtype=np.int64)
+        table[:len(self._slot_of)] = self._slot_of
+        self._slot_of = table
+
+    def add(self, mass, x, y, vx, vy, radius, color=DEFAULT_PARTICLE_COLOR, lifetime=None, flags:int = COLLIDES, trail_length:int = MAX_PARTICLE_TRAIL_LENGTH) -> int:
+        """
+        Add a single particle.
+
+        :return: Id of the new particle.
+        """
+        ids = self.add_batch(
+            [mass], [x], [y], [vx], [vy], [radius],
+            colors=[color],
+            lifetime=[NO_LIFETIME if lifetime is None else lifetime],
+            flags=[flags],
+            trail_lengths=[trail_length],
+        )
+        return int(ids[0])
+
+    def add_batch(self, mass, x, y, vx, vy, radius, colors=None, lifetime=None, flags=None, trail_lengths=None) -> np.ndarray:
+        """
+        Add many particles at once from array-likes of equal length.
+
+        :param colors: Sequence of colors, or a single color shared by all particles.
+        :param lifetime: Remaining lifetimes (``NO_LIFETIME`` for none), scalar or array.
+        :param flags: Bit flags, scalar or array. Defaults to ``COLLIDES``.
+        :param trail_lengths: Maximum number of points of the trail of each particle, scalar or array.
+        :return: Ids of the new particles.
+        """
+        mass = np.asarray(mass, dtype=np.float64)
+        n = mass.shape[0]
+        start, end = self._size, self._size + n
+        self._reserve(end)
+
+        self._mass[start:end] = mass
+        self._x[start:end] = x
+        self._y[start:end] = y
+        self._vx[start:end] = vx
+        self._vy[start:end] = vy
+        self._radius[start:end] = radius
+        self._lifetime[start:end] = NO_LIFETIME if lifetime is None else lifetime
+        self._flags[start:end] = COLLIDES if flags is None else flags
+
+        ids = np.arange(self._next_id, self._next_id + n, dtype=np.int64)
+        self._ids[start:end] = ids
+        self._reserve_ids(self._next_id + n)
+        self._slot_of[ids] = np.arange(start, end)
+        self._next_id += n
+
+        if colors is None or isinstance(colors, (tuple, str)):
+            color = DEFAULT_PARTICLE_COLOR if colors is None else colors
+            self.colors.extend([color] * n)
+        else:
+            self.colors.extend(colors)
+
+        self._trail_limit[start:end] = MAX_PARTICLE_TRAIL_LENGTH if trail_lengths is None else trail_lengths
+        self._trail_rows[start:end] = -1
+
+        self._size = end
+        return ids
+
+    def append(self, particle:'Particle') -> None:
+        """
+        Copy a particle into the system and rebind it as a view on its new slot.
+
+        :param particle: Particle to add, usually a standalone one.
+        """
+        if particle._system is self:
+            return
+        source, slot = particle._system, particle._index
+        pid = self.add(
+            source._mass[slot], source._x[slot], source._y[slot],
+            source._vx[slot], source._vy[slot], source._radius[slot],
+            color=source.colors[slot],
+            lifetime=source._lifetime[slot],
+            flags=int(source._flags[slot]),
+            trail_length=int(source._trail_limit[slot]),
+        )
+        self.set_trail(self._size - 1, source.trail_points(slot))
+        particle._system = self
+        particle._id = pid
+
+    def extend(self, particles) -> None:
+        """
+        Append several particles.
+
+        :param particles: Iterable of particles.
+        """
+        for particle in particles:
+            self.append(particle)
+
+    # Removal --------------------------------------------------------------
+
+    def remove(self, particle:'Particle') -> None:
+        """
+        Remove a particle. The particle object is detached and stays usable.
+
+        :param particle: Particle to remove.
+        """
+        if particle not in self:
+            raise ValueError("particle is not in the system")
+        slot = particle._index
+        ParticleSystem(capacity=1).append(particle)  # Rebinds the particle to its own storage
+        self.remove_indices(np.array([slot]))
+
+    def remove_indices(self, indices) -> None:
+        """
+        Remove particles by slot with swap-remove compaction.
+
+        The particles at the end of the arrays are moved into the freed slots,
+        so only ``len(indices)`` particles move whatever the system size.
+
+        :param indices: Slots to remove (integer array or boolean mask).
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        indices = np.unique(indices)
+        k = len(indices)
+        if k == 0:
+            return
+        n = self._size
+        new_size = n - k
+
+        holes = indices[indices < new_size]
+        tail = np.ones(k, dtype=bool)
+        tail[indices[indices >= new_size] - new_size] = False
+        fillers = np.arange(new_size, n)[tail]
+
+        self._slot_of[self._ids[indices]] = -1
+        rows = self._trail_rows[indices]
+        self.trails.release(rows[rows >= 0])
+        for name, _ in self._FIELDS:
+            array = getattr(self, "_" + name)
+            array[holes] = array[fillers]
+        self._slot_of[self._ids[holes]] = holes
+
+        for hole, filler in zip(holes.tolist(), fillers.tolist()):
+            self.colors[hole] = self.colors[filler]
+        del self.colors[new_size:]
+        self._size = new_size
+
+    def cull_expired(self) -> int:
+        """
+        Remove the particles whose lifetime has run out.
+
+        :return: Number of removed particles.
+        """
+        expired = self.lifetime <= 0
+        count = int(expired.sum())
+        if count:
+            self.remove_indices(expired)
+        return count
+
+    # Trails ---------------------------------------------------------------
+
+    def record_trails(self) -> None:
+        """Append the current position to the trail of every particle that has one."""
+        traced = np.flatnonzero(self.trail_limit > 1)
+        if len(traced) == 0:
+            return
+        rows = self._trail_rows[traced]
+        new = traced[rows < 0]
+        if len(new):
+            self._trail_rows[new] = self.trails.allocate(self._trail_limit[new])
+            rows = self._trail_rows[traced]
+        self.trails.push(rows, self._x[traced], self._y[traced])
+
+    def trail_points(self, slot:int) -> np.ndarray:
+        """
+        Points of the trail of a particle, oldest first.
+
+        :param slot: Slot of the particle.
+        """
+        row = int(self._trail_rows[slot])
+        return self.trails.get(row) if row >= 0 else np.empty((0, 2), dtype=np.float32)
+
+    def set_trail(self, slot:int, points, limit:int = None) -> None:
+        """
+        Replace the trail of a particle.
+
+        :param slot: Slot of the particle.
+        :param points: Sequence of (x, y), oldest first.
+        :param limit: New maximum number of points, unchanged by default.
+        """
+        row = int(self._trail_rows[slot])
+        if limit is not None and limit != self._trail_limit[slot]:
+            if row >= 0:
+                self.trails.release([row])
+            row = self._trail_rows[slot] = -1
+            self._trail_limit[slot] = limit
+        if len(points) == 0 or self._trail_limit[slot] <= 1:
+            if row >= 0:
+                self.trails.count[row] = self.trails.head[row] = 0
+            return
+        if row < 0:
+            row = self._trail_rows[slot] = int(self.trails.allocate([self._trail_limit[slot]])[0])
+        self.trails.set(row, points)
+
+    # Physics --------------------------------------------------------------
+
+    def conserved(self, slots=None) -> np.ndarray:
+        """
+        Totals of the quantities conserved by an isolated system, see CONSERVED.
+
+        The angular momentum is taken about the origin of the domain.
+
+        :param slots: Slots to sum over, every particle by default.
+        :return: Array [mass, px, py, angular momentum, kinetic energy].
+        """
+        if slots is None:
+            mass, x, y, vx, vy = self.mass, self.x, self.y, self.vx, self.vy
+        else:
+            mass, x, y, vx, vy = self.mass[slots], self.x[slots], self.y[slots], self.vx[slots], self.vy[slots]
+        return np.array([
+            mass.sum(),
+            np.dot(mass, vx),
+            np.dot(mass, vy),
+            np.dot(mass, x * vy - y * vx),
+            0.5 * np.dot(mass, vx * vx + vy * vy),
+        ])
+
+    def _count_bounces(self, slots, before: np.ndarray) -> None:
+        """Add the change of momentum of ``slots`` since ``before = conserved(slots)`` to the wall counters."""
+        self.wall_bounces += len(slots)
+        self.wall_impulse += (self.conserved(slots) - before)[1:4]
+
+    def update_positions(self, dt:float) -> None:
+        """
+        Vectorized equivalent of ``Particle.update_position`` for every particle.
+        """
+        self.tick_lifetimes()
+        self.drift(dt)
+
+    def tick_lifetimes(self) -> None:
+        """Count one step off the lifetime of every particle."""
+        self.lifetime[:] -= 1
+
+    def drift(self, dt:float) -> None:
+        """
+        Move every particle along its velocity, then bounce on the walls.
+        """
+        self.x[:] += self.vx * dt
+        self.y[:] += self.vy * dt
+        self.apply_boundaries()
+
+    def apply_boundaries(self) -> None:
+        """
+        Bounce the particles touching the walls, as ``Particle.update_position`` does.
+
+        The bounces keep the kinetic energy but change the momentum, they are
+        counted in ``wall_bounces`` and ``wall_impulse``.
+        """
+        x, y, radius, width, height = self.x, self.y, self.radius, self.width, self.height
+        touch_x = (x <= 0) | (x >= width - radius)
+        touch_y = (y <= 0) | (y >= height - radius)
+        touched = np.flatnonzero(touch_x | touch_y)
+        if len(touched) == 0:
+            return
+        before = self.conserved(touched)
+        self.vx[touch_x] *= -1
+        x[touch_x] = np.where(x[touch_x] < 0, np.abs(x[touch_x]), 2 * width - x[touch_x])
+        self.vy[touch_y] *= -1
+        y[touch_y] = np.where(y[touch_y] < 0, np.abs(y[touch_y]), 2 * height - y[touch_y])
+        self._count_bounces(touched, before)
 
 class Particle:
-    """Contains information about a particle in a simulation."""
+    """
+    Contains information about a particle in a simulation.
+
+    A particle is a lightweight view on one entry of a ParticleSystem. A particle
+    created on its own lives in a private one-slot system until it is appended
+    to a shared one.
+    """
     def __init__(self, mass, position:Position2D, velocity:Velocity2D, radius:int = PARTICLE_RADIUS, color=DEFAULT_PARTICLE_COLOR, lifetime = None):
         """
         Initialize a particle with its properties.
@@ -25,55 +470,168 @@ class Particle:
         :param position: Initial position of the particle.
         :param velocity: Initial velocity of the particle.
         """
-        self.mass = mass
-        self.position = position
-        self.velocity = velocity
-        self.radius = radius
-        self.trail = MaxSizeList(MAX_PARTICLE_TRAIL_LENGTH) # To store the trail of the particle
-        self.color = color
-
-        self.collision = not radius <= FragParams.min_particle_radius  # Check if the particle can collide based on its radius
-        self.lifetime = None
-        if not self.collision:
-            self.trail = MaxSizeList(1)  # No trail for particles that cannot collide
-            self.lifetime = FragParams.fragment_lifetime  # Set lifetime for non-colliding particles
-        if lifetime is not None:
-            self.lifetime = lifetime
+        collision = not radius <= FragParams.min_particle_radius  # Check if the particle can collide based on its radius
+        trail_length = MAX_PARTICLE_TRAIL_LENGTH
+        if not collision:
+            trail_length = 1  # No trail for particles that cannot collide
+            if lifetime is None:
+                lifetime = FragParams.fragment_lifetime  # Set lifetime for non-colliding particles
+
+        self._system = ParticleSystem(capacity=1)
+        self._id = self._system.add(
+            mass, position.x, position.y, velocity.vx, velocity.vy, radius,
+            color=color,
+            lifetime=lifetime,
+            flags=COLLIDES if collision else 0,
+            trail_length=trail_length,
+        )
+
+    @property
+    def _index(self) -> int:
+        slot = self._system.slot(self._id)
+        if slot < 0:
+            raise LookupError("particle has been removed from its system")
+        return slot
+
+    @property
+    def id(self) -> int:
+        """Stable id of the particle in its system."""
+        return self._id
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Particle):
+            return NotImplemented
+        return self._system is other._system and self._id == other._id
+
+    def __hash__(self) -> int:
+        return hash((id(self._system), self._id))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(id={self._id}, mass={self.mass}, position={self.position}, radius={self.radius})"
+
+    @property
+    def mass(self) -> float:
+        return float(self._system._mass[self._index])
+
+    @mass.setter
+    def mass(self, value) -> None:
+        self._system._mass[self._index] = value
+
+    @property
+    def position(self) -> Position2D:
+        """Copy of the position. Assign to the attribute to write it back."""
+        i = self._index
+        return Position2D(float(self._system._x[i]), float(self._system._y[i]))
+
+    @position.setter
+    def position(self, value:Position2D) -> None:
+        i = self._index
+        self._system._x[i] = value.x
+        self._system._y[i] = value.y
+
+    @property
+    def velocity(self) -> Velocity2D:
+        """Copy of the velocity. Assign to the attribute (or use ``+=``) to write it back."""
+        i = self._index
+        return Velocity2D(float(self._system._vx[i]), float(self._system._vy[i]))
+
+    @velocity.setter
+    def velocity(self, value:Velocity2D) -> None:
+        i = self._index
+        self._system._vx[i] = value.vx
+        self._system._vy[i] = value.vy
+
+    @property
+    def radius(self) -> float:
+        return float(self._system._radius[self._index])
+
+    @radius.setter
+    def radius(self, value) -> None:
+        self._system._radius[self._index] = value
+
+    @property
+    def color(self):
+        return self._system.colors[self._index]
+
+    @color.setter
+    def color(self, value) -> None:
+        self._system.colors[self._index] = value
+
+    @property
+    def trail(self) -> MaxSizeList:
+        """Copy of the trail, oldest point first. Assign to the attribute to write it back."""
+        i = self._index
+        return MaxSizeList(int(self._system._trail_limit[i]), map(tuple, self._system.trail_points(i).tolist()))
+
+    @trail.setter
+    def trail(self, value) -> None:
+        """Replace the trail; a MaxSizeList also sets the maximum number of points."""
+        self._system.set_trail(self._index, list(value), getattr(value, "max_size", None))
+
+    @property
+    def lifetime(self):
+        lifetime = float(self._system._lifetime[self._index])
+        return None if lifetime == NO_LIFETIME else lifetime
+
+    @lifetime.setter
+    def lifetime(self, value) -> None:
+        self._system._lifetime[self._index] = NO_LIFETIME if value is None else value
+
+    @property
+    def collision(self) -> bool:
+        return bool(self._system._flags[self._index] & COLLIDES)
+
+    @collision.setter
+    def collision(self, value:bool) -> None:
+        i = self._index
+        if value:
+            self._system._flags[i] |= COLLIDES
+        else:
+            self._system._flags[i] &= ~np.uint8(COLLIDES)
 
     def invert_velocity(self):
         """
         Invert the particle's velocity.
         This is used to simulate a bounce or collision response.
         """
-        self.velocity.vx = -self.velocity.vx
-        self.velocity.vy = -self.velocity.vy
+        i = self._index
+        self._system._vx[i] = -self._system._vx[i]
+        self._system._vy[i] = -self._system._vy[i]
 
     def update_position(self, dt:float) -> None:
         """
         Update the particle's position based on its current velocity.
         """
-        if self.lifetime is not None:
-            self.lifetime -= 1
-        self.position += (self.velocity.vx * dt, self.velocity.vy * dt)
+        system, i = self._system, self._index
+        system._lifetime[i] -= 1
+        system._x[i] += system._vx[i] * dt
+        system._y[i] += system._vy[i] * dt
 
-        if self.touch_ground('x'):
-            self.velocity.vx = -self.velocity.vx
-            self.position.x = abs(self.position.x) if self.position.x < 0 else SCREEN_WIDTH - (self.position.x - SCREEN_WIDTH)
-        if self.touch_ground('y'):
-            self.velocity.vy = -self.velocity.vy
-            self.position.y = abs(self.position.y) if self.position.y < 0 else SCREEN_HEIGHT - (self.position.y - SCREEN_HEIGHT)
+        touch_x, touch_y = self.touch_ground('x'), self.touch_ground('y')
+        if touch_x or touch_y:
+            before = system.conserved([i])
+        if touch_x:
+            system._vx[i] = -system._vx[i]
+            x = system._x[i]
+            system._x[i] = abs(x) if x < 0 else system.width - (x - system.width)
+        if touch_y:
+            system._vy[i] = -system._vy[i]
+            y = system._y[i]
+            system._y[i] = abs(y) if y < 0 else system.height - (y - system.height)
+        if touch_x or touch_y:
+            system._count_bounces([i], before)
 
     def touch_ground(self, axis='y'):
         """
         Check if the particle is touching the ground (boundary on the specified axis).
-        
+
         :param axis: 'x' or 'y' to check the corresponding boundary.
         :return: True if the particle is touching the boundary, False otherwise.
         """
         if axis == 'y':
-            return self.position.y <= 0 or self.position.y >= SCREEN_HEIGHT - self.radius
+            return self.position.y <= 0 or self.position.y >= self._system.height - self.radius
         elif axis == 'x':
-            return self.position.x <= 0 or self.position.x >= SCREEN_WIDTH - self.radius
+            return self.position.x <= 0 or self.position.x >= self._system.width - self.radius
         else:
             raise ValueError("axis must be 'x' or 'y'")
 
@@ -86,4 +644,5 @@ class ParticleFragment(Particle):
         super().__init__(mass, position, velocity, radius, color)
         self.lifetime = FragParams.fragment_lifetime  # Set lifetime for fragments
         self.trail = MaxSizeList(1)  # No trail for fragments
-        self.collision = False
\ No newline at end of file
+        self.collision = False
+        self._system._flags[self._index] |= FRAGMENT
@@ -0,0 +1,137 @@
+import numpy as np
+
+from simulation.utils.constants import MAX_PARTICLE_TRAIL_LENGTH
+
+
+class TrailStore:
+    """
+    Ring buffers holding the trails of many particles in one preallocated array.
+
+    Each trail is a row of ``points``, an array of shape (rows, length, 2).
+    ``head`` is the position the next point is written to and ``count`` the
+    number of points stored, so appending a point is O(1) and appending to all
+    the trails is a single array assignment. A row only keeps its ``limit``
+    most recent points (at most ``length``). Rows are recycled through a free
+    list when their particle disappears.
+    """
+    def __init__(self, length:int = MAX_PARTICLE_TRAIL_LENGTH, capacity:int = 0):
+        """
+        :param length: Maximum number of points of a trail.
+        :param capacity: Number of rows allocated up front.
+        """
+        self.length = max(1, length)
+        self.points = np.zeros((capacity, self.length, 2), dtype=np.float32)
+        self.head = np.zeros(capacity, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.limit = np.zeros(capacity, dtype=np.int64)  # 0 for a free row
+        self._free = list(range(capacity - 1, -1, -1))
+
+    @classmethod
+    def from_arrays(cls, points:np.ndarray, head:np.ndarray, count:np.ndarray, limit:np.ndarray) -> 'TrailStore':
+        """
+        Build a store on existing arrays (e.g. memory-maps), rows with a zero limit being free.
+        """
+        store = cls.__new__(cls)
+        store.length = points.shape[1]
+        store.points, store.head, store.count, store.limit = points, head, count, limit
+        store._free = np.flatnonzero(limit == 0)[::-1].tolist()
+        return store
+
+    def __len__(self) -> int:
+        """Number of rows in use."""
+        return len(self.limit) - len(self._free)
+
+    def _grow(self, n:int) -> None:
+        """Add rows so that ``n`` more are free."""
+        missing = n - len(self._free)
+        if missing <= 0:
+            return
+        old = len(self.limit)
+        capacity = max(old + missing, 2 * old)
+        points = np.zeros((capacity, self.length, 2), dtype=np.float32)
+        points[:old] = self.points
+        self.points = points
+        for name in ("head", "count", "limit"):
+            array = np.zeros(capacity, dtype=np.int64)
+            array[:old] = getattr(self, name)
+            setattr(self, name, array)
+        self._free[:0] = range(capacity - 1, old - 1, -1)
+
+    def allocate(self, limits) -> np.ndarray:
+        """
+        Take empty rows.
+
+        :param limits: Number of points kept by each new trail.
+        :return: The rows.
+        """
+        limits = np.minimum(np.asarray(limits, dtype=np.int64), self.length)
+        n = len(limits)
+        self._grow(n)
+        rows = np.array(self._free[len(self._free) - n:][::-1], dtype=np.int64)
+        del self._free[len(self._free) - n:]
+        self.head[rows] = 0
+        self.count[rows] = 0
+        self.limit[rows] = limits
+        return rows
+
+    def release(self, rows) -> None:
+        """
+        Give rows back to the free list.
+
+        :param rows: Rows no longer used.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        self.limit[rows] = 0
+        self._free.extend(rows.tolist())
+
+    def push(self, rows:np.ndarray, x:np.ndarray, y:np.ndarray) -> None:
+        """
+        Append one point to each of ``rows``, dropping the oldest point of the full ones.
+
+        :param rows: Distinct rows.
+        :param x: X coordinate of the point of each row.
+        :param y: Y coordinate of the point of each row.
+        """
+        head = self.head[rows]
+        self.points[rows, head, 0] = x
+        self.points[rows, head, 1] = y
+        limit = self.limit[rows]
+        self.head[rows] = (head + 1) % limit
+        self.count[rows] = np.minimum(self.count[rows] + 1, limit)
+
+    def last(self, rows:np.ndarray) -> np.ndarray:
+        """
+        Most recent point of each row, shape (len(rows), 2). Only meaningful for rows with points.
+        """
+        return self.points[rows, (self.head[rows] - 1) % self.limit[rows]]
+
+    def ordered(self, rows:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Points of several trails, oldest first.
+
+        :param rows: Rows to read.
+        :return: Array of shape (len(rows), max count, 2), and the number of valid points of each row.
+        """
+        count = self.count[rows]
+        width = int(count.max()) if len(rows) else 0
+        limit = np.maximum(self.limit[rows], 1)
+        index = (self.head[rows, None] - count[:, None] + np.arange(width)) % limit[:, None]
+        return self.points[rows[:, None], index], count
+
+    def get(self, row:int) -> np.ndarray:
+        """Points of one trail, oldest first."""
+        points, count = self.ordered(np.array([row]))
+        return points[0, :count[0]]
+
+    def set(self, row:int, points) -> None:
+        """
+        Replace the points of one trail, keeping only the most recent ones that fit.
+
+        :param row: Row of the trail.
+        :param points: Sequence of (x, y), oldest first.
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)[-self.limit[row]:]
+        n = len(points)
+        self.points[row, :n] = points
+        self.count[row] = n
+        self.head[row] = n % self.limit[row]
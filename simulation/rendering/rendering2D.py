@@ -1,39 +1,241 @@
+import numpy as np
 import pygame
-import time
 
-from simulation.physics.particle import Particle
-from simulation.utils.constants import SCREEN_WIDTH, SCREEN_HEIGHT, DEFAULT_BACKGROUND_COLOR, DEFAULT_PARTICLE_COLOR, FPS
+from simulation.physics.particle import ParticleSystem
+from simulation.utils.constants import (
+    SCREEN_WIDTH, SCREEN_HEIGHT, DEFAULT_BACKGROUND_COLOR, FPS, PROFILER_HUD,
+    TRAIL_MODE, TRAIL_FADE, RENDER_PIXEL_RADIUS,
+)
 from simulation.utils.positions import Position2D, Velocity2D
 
-pygame.init()
-pygame.font.init()
-
-fps_text = pygame.font.SysFont('Comic Sans MS', 30)
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-clock = pygame.time.Clock()
+# The window is only opened by init_display(), so that importing this module
+# has no side effect on headless machines
+fps_text = None
+hud_text = None
+screen = None
+clock = None
 running = True
+hud_visible = PROFILER_HUD  # Toggled with F3
+
+def init_display(size:tuple = None) -> pygame.Surface:
+    """
+    Open the window (once) and return the screen surface.
+
+    :param size: Width and height of the window, the screen constants by default.
+                 Only used by the call that opens the window.
+    """
+    global fps_text, hud_text, screen, clock
+    if screen is None:
+        pygame.init()
+        pygame.font.init()
+        fps_text = pygame.font.SysFont('Comic Sans MS', 30)
+        hud_text = pygame.font.SysFont('monospace', 14)
+        screen = pygame.display.set_mode(size or (SCREEN_WIDTH, SCREEN_HEIGHT))
+        clock = pygame.time.Clock()
+    return screen
+
+def draw_particle(surface:pygame.Surface, color, x:float, y:float, radius:float, trail:list) -> None:
+    """
+    Draw a particle and its trail.
+
+    :param surface: Surface to draw on.
+    :param color: Color of the particle.
+    :param x: X position.
+    :param y: Y position.
+    :param radius: Radius of the particle.
+    :param trail: Previous positions, oldest first.
+    """
+    pygame.draw.circle(surface, color, (int(x), int(y)), radius)
+    if len(trail) > 1:
+        pygame.draw.lines(surface, color, False, trail, 1)
 
-def render_particles(particles:list[Particle]) -> None:
+class ParticleRenderer:
+    """
+    Draws a whole ParticleSystem from its arrays.
+
+    Particles outside the surface are culled, particles smaller than
+    ``pixel_radius`` are written as single pixels in one array assignment, and
+    only the others go through ``pygame.draw.circle``. Trails come from the
+    ring buffers of the system and are drawn either as polylines ("lines") or
+    accumulated on a persistent surface that fades a little every frame
+    ("fade"), which only needs one short segment per particle and frame.
+    """
+    TRAIL_MODES = ("lines", "fade", None)
+
+    def __init__(self, trails=TRAIL_MODE, fade:float = TRAIL_FADE, pixel_radius:float = RENDER_PIXEL_RADIUS, background=DEFAULT_BACKGROUND_COLOR):
+        """
+        :param trails: "lines", "fade" or None for no trails.
+        :param fade: Fraction of its brightness a faded trail keeps from one frame to the next.
+        :param pixel_radius: Particles with a smaller radius are drawn as one pixel.
+        :param background: Color the surface is cleared with.
+        """
+        if trails not in self.TRAIL_MODES:
+            raise ValueError(f"Unknown trail mode {trails!r}, expected one of {self.TRAIL_MODES}")
+        self.trails = trails
+        self.fade = fade
+        self.pixel_radius = pixel_radius
+        self.background = background
+        self._trail_surface = None
+        self._fade_overlay = None
+        self._mapped = {}  # Color -> pixel value in the format of _format
+        self._format = None
+
+    def draw(self, surface:pygame.Surface, particles:ParticleSystem, record:bool = True) -> int:
+        """
+        Clear ``surface``, draw the trails and the particles, then record the
+        current positions in the trails.
+
+        :param surface: Surface to draw on.
+        :param particles: Particles to draw.
+        :param record: Record the positions in the trails, False to redraw a frame already drawn.
+        :return: Number of particles drawn (not culled).
+        """
+        surface.fill(self.background)
+        if self.trails == "lines":
+            self._draw_trail_lines(surface, particles)
+        elif self.trails == "fade":
+            self._draw_faded_trails(surface, particles, record)
+        if self.trails is not None and record:
+            particles.record_trails()
+
+        width, height = surface.get_size()
+        x, y, radius = particles.x, particles.y, particles.radius
+        visible = (x + radius >= 0) & (x - radius < width) & (y + radius >= 0) & (y - radius < height)
+        small = radius < self.pixel_radius
+        drawn = self._draw_pixels(surface, particles, np.flatnonzero(visible & small))
+
+        colors = particles.colors
+        circle = pygame.draw.circle
+        large = np.flatnonzero(visible & ~small)
+        for k, cx, cy, r in zip(large.tolist(), x[large].astype(np.int64).tolist(), y[large].astype(np.int64).tolist(), radius[large].tolist()):
+            circle(surface, colors[k], (cx, cy), r)
+        return drawn + len(large)
+
+    def reset(self) -> None:
+        """Forget the faded trails, e.g. when the drawn frames jump backwards."""
+        self._trail_surface = None
+
+    def _map_color(self, surface:pygame.Surface, color) -> int:
+        value = self._mapped.get(color)
+        if value is None:
+            value = self._mapped[color] = surface.map_rgb(pygame.Color(color))
+        return value
+
+    def _draw_pixels(self, surface:pygame.Surface, particles:ParticleSystem, index:np.ndarray) -> int:
+        """Write one pixel per particle of ``index``."""
+        width, height = surface.get_size()
+        xi = particles.x[index].astype(np.intp)
+        yi = particles.y[index].astype(np.intp)
+        inside = (xi >= 0) & (xi < width) & (yi >= 0) & (yi < height)
+        index, xi, yi = index[inside], xi[inside], yi[inside]
+        if len(index) == 0:
+            return 0
+
+        surface_format = (surface.get_bitsize(), surface.get_masks())
+        if surface_format != self._format:
+            self._mapped.clear()
+            self._format = surface_format
+        colors = particles.colors
+        values = np.fromiter((self._map_color(surface, colors[k]) for k in index.tolist()), dtype=np.int64, count=len(index))
+        try:
+            pixels = pygame.surfarray.pixels2d(surface)
+        except ValueError:  # 24-bit surfaces have no 2D pixel view
+            for cx, cy, value in zip(xi.tolist(), yi.tolist(), values.tolist()):
+                surface.set_at((cx, cy), surface.unmap_rgb(value))
+        else:
+            pixels[xi, yi] = values.astype(pixels.dtype)
+            del pixels  # Unlocks the surface
+        return len(index)
+
+    def _draw_trail_lines(self, surface:pygame.Surface, particles:ParticleSystem) -> None:
+        slots = np.flatnonzero(particles.trail_rows >= 0)
+        points, count = particles.trails.ordered(particles.trail_rows[slots])
+        drawn = count > 1
+        colors = particles.colors
+        lines = pygame.draw.lines
+        for k, trail, n in zip(slots[drawn].tolist(), points[drawn], count[drawn].tolist()):
+            lines(surface, colors[k], False, trail[:n].tolist(), 1)
+
+    def _draw_faded_trails(self, surface:pygame.Surface, particles:ParticleSystem, record:bool = True) -> None:
+        size = surface.get_size()
+        if self._trail_surface is None or self._trail_surface.get_size() != size:
+            self._trail_surface = pygame.Surface(size)
+            self._trail_surface.fill((0, 0, 0))
+            # Blitting translucent black is much faster than a BLEND_RGB_MULT fill
+            self._fade_overlay = pygame.Surface(size)
+            self._fade_overlay.fill((0, 0, 0))
+            self._fade_overlay.set_alpha(round(255 * (1 - self.fade)))
+        trail_surface = self._trail_surface
+        if not record:
+            surface.blit(trail_surface, (0, 0), special_flags=pygame.BLEND_RGB_ADD)
+            return
+        trail_surface.blit(self._fade_overlay, (0, 0))
+
+        slots = np.flatnonzero(particles.trail_rows >= 0)
+        rows = particles.trail_rows[slots]
+        slots, rows = slots[particles.trails.count[rows] > 0], rows[particles.trails.count[rows] > 0]
+        last = particles.trails.last(rows).tolist()
+        colors = particles.colors
+        line = pygame.draw.line
+        for k, start, end in zip(slots.tolist(), last, zip(particles.x[slots].tolist(), particles.y[slots].tolist())):
+            line(trail_surface, colors[k], start, end, 1)
+        surface.blit(trail_surface, (0, 0), special_flags=pygame.BLEND_RGB_ADD)
+
+
+renderer = ParticleRenderer()
+
+def render_particles(particles:ParticleSystem) -> None:
     """
     Render particles on the screen.
 
-    :param particles: List of particles to render.
+    :param particles: ParticleSystem to render. A plain iterable of particles
+                      is also accepted, and drawn one particle at a time.
     """
+    screen = init_display()
+    if isinstance(particles, ParticleSystem):
+        renderer.draw(screen, particles)
+        return
     screen.fill(DEFAULT_BACKGROUND_COLOR)  # Clear the screen with black
     for particle in particles:
-        pygame.draw.circle(screen, particle.color, (int(particle.position.x), int(particle.position.y)), particle.radius)
-        if len(particle.trail) > 1:
-            pygame.draw.lines(screen, particle.color, False, particle.trail, 1)
-        particle.trail.append(pygame.Vector2(particle.position.x, particle.position.y))
+        position, trail = particle.position, particle.trail
+        draw_particle(screen, particle.color, position.x, position.y, particle.radius, trail)
+        trail.append((position.x, position.y))
+        particle.trail = trail
+
+def render_hud(lines:list[str]) -> None:
+    """
+    Draw lines of text below the FPS counter, when the HUD is visible.
+
+    :param lines: Lines to draw, e.g. from ``format_summary``.
+    """
+    if not hud_visible:
+        return
+    screen = init_display()
+    y = 40
+    for line in lines:
+        screen.blit(hud_text.render(line, False, (255, 255, 255)), (5, y))
+        y += hud_text.get_linesize()
+
+def render_observer(simulation) -> None:
+    """
+    Simulation observer drawing the particles after each step.
+
+    :param simulation: Simulation that has just been stepped.
+    """
+    render_particles(simulation.particles)
 
 def main_game_loop():
     def decorator(func):
         def wrapper(*args, **kwargs):
+            global hud_visible
+            init_display()
             while running:
                 new_object = None
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         return
+                    if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                        hud_visible = not hud_visible
                     if event.type == pygame.MOUSEBUTTONDOWN:
                         new_object = (1000, Position2D(event.pos[0], event.pos[1]) , Velocity2D(0, 0), 1, "black", 1)
 
@@ -45,4 +247,4 @@ def main_game_loop():
                 clock.tick(FPS)
             pygame.quit()
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
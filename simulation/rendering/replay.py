@@ -0,0 +1,217 @@
+"""
+Replay of recorded trajectories.
+
+Draws the frames of a TrajectoryWriter recording with the same circles and
+trails as the live simulation, either in a window (with pause, scrubbing and
+variable speed) or to an image sequence or a video. The simulation can thus
+run headless at full speed and be looked at afterwards.
+
+Example::
+
+    python -m simulation.rendering.replay run/ --speed 4
+    python -m simulation.rendering.replay run/ --images frames/ --stride 2
+    python -m simulation.rendering.replay run/ --video run.mp4 --fps 60
+
+Keys of the window: space pauses, left/right scrub by one second of replay,
+up/down double or halve the speed, home restarts.
+"""
+import argparse
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+import pygame
+
+from simulation.io.trajectory import Frame, TrajectoryReader
+from simulation.physics.particle import FRAGMENT
+from simulation.rendering import rendering2D
+from simulation.rendering.rendering2D import ParticleRenderer, init_display
+from simulation.runner import Snapshot, SnapshotView
+from simulation.utils.constants import DEFAULT_PARTICLE_COLOR, FPS, MAX_PARTICLE_TRAIL_LENGTH, FragParams
+
+
+class Replay:
+    """
+    Renders the frames of a recording with a ParticleRenderer, the trails
+    being kept by particle id as for the snapshots of a SimulationRunner.
+    """
+    def __init__(self, reader: TrajectoryReader, trail_length: int = MAX_PARTICLE_TRAIL_LENGTH, renderer: Optional[ParticleRenderer] = None):
+        """
+        :param reader: Recording to replay.
+        :param trail_length: Number of drawn frames kept in the trails.
+        :param renderer: Renderer of the frames, one with the settings of the live rendering by default.
+        """
+        self.reader = reader
+        self.trail_length = trail_length
+        self.renderer = renderer if renderer is not None else ParticleRenderer()
+        self.steps = reader.steps()
+        self.colors = reader.colors()
+        self.size = (int(reader.domain[0]), int(reader.domain[1]))
+        self.view = SnapshotView(trail_length)
+        self._last_index = None
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def frame_at(self, index: int) -> Frame:
+        """
+        The ``index``-th recorded frame.
+
+        :param index: Position of the frame in the recording.
+        """
+        return self.reader.frame(int(self.steps[index]))
+
+    def _snapshot(self, frame: Frame) -> Snapshot:
+        """Snapshot of the drawn values of a frame."""
+        data = frame.data
+        if "flags" in data:
+            flags = data["flags"]
+            fragment = (flags & FRAGMENT) != 0
+        else:
+            fragment = data["radius"] <= FragParams.min_particle_radius
+            flags = np.where(fragment, FRAGMENT, 0).astype(np.uint8)
+        # Fragments have no trail in the live rendering either
+        trail_limit = np.where(fragment, 1, self.trail_length).astype(np.int32)
+        colors = [self.colors.get(pid, DEFAULT_PARTICLE_COLOR) for pid in frame.ids.tolist()]
+        return Snapshot(
+            frame.step, frame.time, 0.0, frame.ids, data["x"], data["y"], data["radius"], flags, trail_limit, colors, ({}, {}),
+        )
+
+    def draw(self, surface: pygame.Surface, index: int) -> Frame:
+        """
+        Draw the ``index``-th frame. The trails only grow when the frames move
+        forward, and are reset when scrubbing backwards.
+
+        :param surface: Surface to draw on.
+        :param index: Position of the frame in the recording.
+        :return: The drawn frame.
+        """
+        advancing = self._last_index is None or index > self._last_index
+        if self._last_index is not None and index < self._last_index:
+            self.view = SnapshotView(self.trail_length)
+            self.renderer.reset()
+        self._last_index = index
+        frame = self.frame_at(index)
+        self.renderer.draw(surface, self.view.update(None, self._snapshot(frame)), record=advancing)
+        self.view.keep_trails()
+        return frame
+
+    def surfaces(self, start: int = 0, stop: Optional[int] = None, stride: int = 1) -> Iterator[tuple[Frame, pygame.Surface]]:
+        """
+        Draw frames off screen.
+
+        :param start: Index of the first frame.
+        :param stop: Index after the last frame, the end of the recording by default.
+        :param stride: Draw one frame out of ``stride``.
+        :return: Iterator of (frame, surface). The same surface is reused for every frame.
+        """
+        surface = pygame.Surface(self.size)
+        for index in range(start, len(self) if stop is None else min(stop, len(self)), stride):
+            yield self.draw(surface, index), surface
+
+    def export_images(self, directory: str, pattern: str = "frame_{step:06d}.png", **options) -> int:
+        """
+        Save frames as images.
+
+        :param directory: Output directory, created if needed.
+        :param pattern: File name pattern, with the ``step`` and ``index`` fields.
+        :param options: ``start``, ``stop`` and ``stride`` of ``surfaces``.
+        :return: Number of images written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        count = 0
+        for frame, surface in self.surfaces(**options):
+            pygame.image.save(surface, os.path.join(directory, pattern.format(step=frame.step, index=count)))
+            count += 1
+        return count
+
+    def export_video(self, path: str, fps: int = FPS, **options) -> int:
+        """
+        Encode frames into a video file.
+
+        Needs imageio with an ffmpeg backend, which is only imported here.
+
+        :param path: Output file, e.g. ``run.mp4``.
+        :param fps: Frame rate of the video.
+        :param options: ``start``, ``stop`` and ``stride`` of ``surfaces``.
+        :return: Number of frames written.
+        """
+        try:
+            import imageio.v2 as imageio
+        except ImportError:
+            raise ImportError("Video export needs imageio: pip install imageio imageio-ffmpeg") from None
+        count = 0
+        with imageio.get_writer(path, fps=fps) as writer:
+            for _, surface in self.surfaces(**options):
+                writer.append_data(np.ascontiguousarray(pygame.surfarray.array3d(surface).swapaxes(0, 1)))
+                count += 1
+        return count
+
+    def play(self, speed: float = 1.0, start: int = 0) -> None:
+        """
+        Replay in the window until it is closed.
+
+        :param speed: Recorded frames advanced per displayed frame; fractions slow down, above 1 frames are skipped.
+        :param start: Index of the first frame.
+        """
+        if not len(self):
+            return
+        screen = init_display(self.size)
+        font = rendering2D.hud_text
+        position = float(start)
+        paused = False
+        while True:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE:
+                        paused = not paused
+                    elif event.key == pygame.K_RIGHT:
+                        position += FPS * speed
+                    elif event.key == pygame.K_LEFT:
+                        position -= FPS * speed
+                    elif event.key == pygame.K_UP:
+                        speed *= 2
+                    elif event.key == pygame.K_DOWN:
+                        speed /= 2
+                    elif event.key == pygame.K_HOME:
+                        position = 0
+            position = min(max(position, 0), len(self) - 1)
+
+            frame = self.draw(screen, int(position))
+            status = f"step {frame.step}  {int(position) + 1}/{len(self)}  x{speed:g}{'  paused' if paused else ''}"
+            screen.blit(font.render(status, False, (255, 255, 255)), (5, 5))
+            pygame.display.flip()
+            rendering2D.clock.tick(FPS)
+            if not paused:
+                position += speed
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded simulation.")
+    parser.add_argument("directory", help="Directory written by TrajectoryWriter.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Recorded frames per displayed frame.")
+    parser.add_argument("--start", type=int, default=0, help="Index of the first frame.")
+    parser.add_argument("--stop", type=int, default=None, help="Index after the last exported frame.")
+    parser.add_argument("--stride", type=int, default=1, help="Export one frame out of STRIDE.")
+    parser.add_argument("--trail", type=int, default=MAX_PARTICLE_TRAIL_LENGTH, help="Trail length in drawn frames.")
+    parser.add_argument("--images", default=None, metavar="DIR", help="Save the frames as PNG images instead of showing them.")
+    parser.add_argument("--video", default=None, metavar="FILE", help="Encode the frames to a video (needs imageio).")
+    parser.add_argument("--fps", type=int, default=FPS, help="Frame rate of the video.")
+    args = parser.parse_args(argv)
+
+    replay = Replay(TrajectoryReader(args.directory), args.trail)
+    if args.images or args.video:
+        options = {"start": args.start, "stop": args.stop, "stride": args.stride}
+        if args.images:
+            replay.export_images(args.images, **options)
+        if args.video:
+            replay.export_video(args.video, args.fps, **options)
+    else:
+        replay.play(args.speed, args.start)
+        pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""
+Decoupling of the physics rate from the rendering rate.
+
+In the historical loop every displayed frame ran exactly one physics step and
+``clock.tick(FPS)`` limited both. ``SimulationRunner`` separates them:
+
+- ``"sync"``: the render loop runs ``substeps`` physics steps per frame;
+- ``"thread"``: a worker thread steps the simulation as fast as the CPU allows
+  (or at ``steps_per_second``) and publishes a snapshot every ``substeps``
+  steps. Most of the step time is spent in numpy, which releases the GIL, so
+  the window stays responsive;
+- ``"process"``: same in a separate process, which is not limited by the GIL.
+  The snapshots are sent through a multiprocessing queue.
+
+The render side keeps the last two snapshots (a double buffer) and draws the
+state interpolated between them, particles being matched by id, so the motion
+stays smooth whatever the ratio of the two rates. Interpolating means drawing
+at most one snapshot interval behind the physics.
+
+Commands such as ``add_particle`` are queued to the worker and applied between
+two batches of steps: the simulation must not be touched from the render
+thread while a worker runs.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Callable, NamedTuple, Optional, Union
+
+import numpy as np
+
+from simulation.engine import Simulation
+from simulation.physics.particle import Particle, ParticleSystem
+from simulation.physics.trails import TrailStore
+from simulation.utils.profiling import StepProfiler
+from simulation.utils.constants import (
+    RUN_MODE, PHYSICS_SUBSTEPS, PHYSICS_STEPS_PER_SECOND, RENDER_INTERPOLATION, PROFILER_ENABLED, PROFILER_WINDOW,
+    MAX_PARTICLE_TRAIL_LENGTH,
+)
+
+logger = logging.getLogger(__name__)
+
+RUN_MODES = ("sync", "thread", "process")
+SNAPSHOT_QUEUE_SIZE = 2  # Snapshots in flight from the physics process
+
+
+class Snapshot(NamedTuple):
+    """State of the particles published by the physics for the rendering."""
+    step: int
+    time: float
+    published: float  # time.perf_counter() at publication
+    ids: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    radius: np.ndarray
+    flags: np.ndarray
+    trail_limit: np.ndarray
+    colors: list
+    profile: tuple  # (StepProfiler.summary(), StepProfiler.last_counters()) of the physics
+
+
+def capture(simulation: Simulation) -> Snapshot:
+    """
+    Copy what the rendering needs from a simulation.
+
+    :param simulation: Simulation, between two steps.
+    :return: Snapshot owning its arrays.
+    """
+    p = simulation.particles
+    profiler = simulation.profiler
+    return Snapshot(
+        simulation.step_count, simulation.time, time.perf_counter(),
+        p.ids.copy(), p.x.copy(), p.y.copy(), p.radius.copy(), p.flags.copy(), p.trail_limit.copy(),
+        list(p.colors), (profiler.summary(), profiler.last_counters()),
+    )
+
+
+def interpolate(previous: Optional[Snapshot], current: Snapshot, alpha: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Positions of the particles of ``current`` moved back towards ``previous``.
+
+    :param previous: Older snapshot, or None.
+    :param current: Newer snapshot, whose particles are returned.
+    :param alpha: 0 gives the positions of ``previous``, 1 those of ``current``.
+    :return: x and y, aligned with ``current.ids``. Particles absent from
+             ``previous`` (just created) keep their current position.
+    """
+    if previous is None or alpha >= 1 or len(previous.ids) == 0 or len(current.ids) == 0:
+        return current.x, current.y
+    order = np.argsort(previous.ids)
+    sorted_ids = previous.ids[order]
+    position = np.minimum(np.searchsorted(sorted_ids, current.ids), len(sorted_ids) - 1)
+    matched = sorted_ids[position] == current.ids
+    k = order[position[matched]]
+    x, y = current.x.copy(), current.y.copy()
+    x[matched] = previous.x[k] + alpha * (current.x[matched] - previous.x[k])
+    y[matched] = previous.y[k] + alpha * (current.y[matched] - previous.y[k])
+    return x, y
+
+
+class SnapshotBuffer:
+    """
+    Double buffer of snapshots: the writer swaps in a new snapshot, the reader
+    gets the last two without ever waiting for a step.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.previous: Optional[Snapshot] = None
+        self.current: Optional[Snapshot] = None
+
+    def publish(self, snapshot: Snapshot) -> None:
+        with self._lock:
+            self.previous, self.current = self.current, snapshot
+
+    def latest(self) -> tuple[Optional[Snapshot], Optional[Snapshot]]:
+        """The previous and the current snapshot."""
+        with self._lock:
+            return self.previous, self.current
+
+
+class SnapshotView:
+    """
+    ParticleSystem rebuilt from snapshots on the render side.
+
+    The trails are recorded here, keyed by particle id, since the particles of
+    two snapshots live in different arrays.
+    """
+    def __init__(self, trail_length: int = MAX_PARTICLE_TRAIL_LENGTH):
+        """
+        :param trail_length: Maximum number of points of a trail.
+        """
+        self.trails = TrailStore(trail_length)
+        self._row_of = np.full(0, -1, dtype=np.int32)  # id -> trail row
+        self._ids = np.empty(0, dtype=np.int64)
+        self.system = ParticleSystem(capacity=0)
+
+    def update(self, previous: Optional[Snapshot], current: Snapshot, alpha: float = 1.0) -> ParticleSystem:
+        """
+        Build the system to draw.
+
+        :param previous: Older snapshot, or None.
+        :param current: Newer snapshot.
+        :param alpha: Interpolation factor between the two, see ``interpolate``.
+        :return: System with the particles of ``current``. Its ``trail_rows``
+                 must be given back with ``keep_trails`` once drawn.
+        """
+        ids = current.ids
+        gone = np.setdiff1d(self._ids, ids, assume_unique=True)
+        if len(gone):
+            rows = self._row_of[gone]
+            self.trails.release(rows[rows >= 0])
+            self._row_of[gone] = -1
+        next_id = int(ids.max()) + 1 if len(ids) else 0
+        if next_id > len(self._row_of):
+            grown = np.full(max(next_id, 2 * len(self._row_of)), -1, dtype=np.int32)
+            grown[:len(self._row_of)] = self._row_of
+            self._row_of = grown
+        self._ids = ids
+
+        x, y = interpolate(previous, current, alpha)
+        size = len(ids)
+        arrays = {name: np.zeros(size, dtype=dtype) for name, dtype in ParticleSystem._FIELDS}
+        arrays.update(
+            ids=ids, x=np.asarray(x, dtype=np.float64), y=np.asarray(y, dtype=np.float64),
+            radius=current.radius, flags=current.flags, trail_limit=current.trail_limit, trail_rows=self._row_of[ids],
+        )
+        self.system = ParticleSystem.from_arrays(arrays, current.colors, max(next_id, 1), self.trails)
+        return self.system
+
+    def keep_trails(self) -> None:
+        """Remember the trail rows allocated while drawing the last system."""
+        self._row_of[self.system.ids] = self.system.trail_rows
+
+
+def close_observers(simulation: Simulation) -> None:
+    """Close the observers having a ``close`` method (e.g. TrajectoryWriter)."""
+    for observer in simulation.observers:
+        close = getattr(observer, "close", None)
+        if close is not None:
+            close()
+
+
+def _physics_loop(simulation: Simulation, substeps: int, steps_per_second: Optional[float], publish, commands, stop) -> None:
+    """
+    Step ``simulation`` until ``stop`` is set, publishing a snapshot every ``substeps`` steps.
+
+    :param commands: Queue of (method name, args) applied to the simulation between two batches.
+    :param stop: threading or multiprocessing Event.
+    """
+    deadline = time.perf_counter()
+    while not stop.is_set():
+        while True:
+            try:
+                name, args = commands.get_nowait()
+            except queue.Empty:
+                break
+            getattr(simulation, name)(*args)
+        for _ in range(substeps):
+            simulation.step()
+        publish(capture(simulation))
+        if steps_per_second:
+            deadline = max(deadline + substeps / steps_per_second, time.perf_counter() - 1)  # No catching up after a stall
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class _ParentWatch:
+    """Stop event of the physics process, also set when the render process died without setting it."""
+    def __init__(self, stop):
+        self.stop = stop
+        self.parent = os.getppid()
+
+    def is_set(self) -> bool:
+        return self.stop.is_set() or os.getppid() != self.parent
+
+
+def _process_main(simulation, substeps, steps_per_second, snapshots, commands, stop) -> None:
+    """Entry point of the physics process."""
+    # The handlers installed by SDL in the render process turn the signals into events nobody reads here
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the render process, which stops us
+    stop = _ParentWatch(stop)
+    if not isinstance(simulation, Simulation):
+        simulation = simulation()
+    snapshots.cancel_join_thread()  # Do not hang at exit on snapshots the renderer will never read
+
+    def publish(snapshot):
+        try:
+            snapshots.put_nowait(snapshot)
+        except queue.Full:  # The renderer is behind, it only needs the latest states
+            pass
+    try:
+        _physics_loop(simulation, substeps, steps_per_second, publish, commands, stop)
+    finally:
+        close_observers(simulation)
+
+
+class SimulationRunner:
+    """
+    Runs a simulation for a render loop, in the same thread or in a worker.
+
+    Usage::
+
+        runner = SimulationRunner(simulation, mode="thread")
+        runner.start()
+        while running:
+            particles = runner.frame()
+            with runner.profiler.phase("rendering"):
+                render_particles(particles)
+        runner.stop()
+    """
+    def __init__(
+        self,
+        simulation: Union[Simulation, Callable[[], Simulation]],
+        mode: str = RUN_MODE,
+        substeps: int = PHYSICS_SUBSTEPS,
+        steps_per_second: Optional[float] = PHYSICS_STEPS_PER_SECOND,
+        interpolation: bool = RENDER_INTERPOLATION,
+    ):
+        """
+        :param simulation: Simulation, or a function building it. In process
+                           mode a function is preferable: observers owning
+                           threads or files (TrajectoryWriter) are then
+                           created in the physics process.
+        :param mode: "sync", "thread" or "process", see RUN_MODES.
+        :param substeps: Physics steps per frame in sync mode, per published snapshot otherwise.
+        :param steps_per_second: Limit of the physics rate of the workers, None for as fast as possible.
+        :param interpolation: Draw the state interpolated between the last two snapshots.
+        """
+        if mode not in RUN_MODES:
+            raise ValueError(f"Unknown run mode {mode!r}, expected one of {RUN_MODES}")
+        if substeps < 1:
+            raise ValueError("substeps must be at least 1")
+        if mode != "process" and not isinstance(simulation, Simulation):
+            simulation = simulation()
+        self._source = simulation
+        # None when the simulation is built in the physics process
+        self.simulation: Optional[Simulation] = simulation if isinstance(simulation, Simulation) else None
+        self.mode = mode
+        self.substeps = substeps
+        self.steps_per_second = steps_per_second
+        self.interpolation = interpolation
+        self.profiler = StepProfiler(PROFILER_ENABLED, PROFILER_WINDOW)  # Render side, one record per frame
+        self.buffer = SnapshotBuffer()
+        self.view = SnapshotView()
+        self.frame_count = 0
+        self._last_step = 0
+        self._worker = None
+        self._error = None
+        self._stop = None
+        self._commands = None
+        self._snapshots = None
+
+    # Lifecycle ------------------------------------------------------------
+
+    def start(self) -> None:
+        """Start the physics worker (nothing to do in sync mode)."""
+        if self.mode == "sync" or self._worker is not None:
+            return
+        if self.mode == "thread":
+            self._stop = threading.Event()
+            self._commands = queue.Queue()
+            self._worker = threading.Thread(target=self._run_thread, name="physics", daemon=True)
+        else:
+            self._stop = multiprocessing.Event()
+            self._commands = multiprocessing.Queue()
+            self._snapshots = multiprocessing.Queue(maxsize=SNAPSHOT_QUEUE_SIZE)
+            self._worker = multiprocessing.Process(
+                target=_process_main, name="physics", daemon=True,
+                args=(self._source, self.substeps, self.steps_per_second, self._snapshots, self._commands, self._stop),
+            )
+            # Registered after multiprocessing's own exit handler so that it runs
+            # first: the worker then closes its observers instead of being terminated
+            atexit.register(self.stop)
+        self._worker.start()
+
+    def _run_thread(self) -> None:
+        try:
+            _physics_loop(self.simulation, self.substeps, self.steps_per_second, self.buffer.publish, self._commands, self._stop)
+        except Exception as error:
+            logger.exception("Physics thread failed")
+            self._error = error
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop the worker and close the observers having a ``close`` method.
+
+        :param timeout: Seconds to wait for the worker before giving up (threads) or terminating it (processes).
+        """
+        if self._worker is None:
+            if self.mode == "sync":
+                close_observers(self.simulation)
+            return
+        self._stop.set()
+        if self.mode == "thread":
+            self._worker.join(timeout)
+            if self._worker.is_alive():
+                logger.warning("Physics thread still running after %g s", timeout)
+            else:
+                close_observers(self.simulation)
+        else:
+            self._receive()  # Unblocks a worker flushing its queue
+            self._worker.join(timeout)
+            if self._worker.is_alive():
+                logger.warning("Physics process still running after %g s, terminating it", timeout)
+                self._worker.terminate()
+                self._worker.join()
+            self._commands.close()
+            self._snapshots.close()
+        self._worker = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    # Interaction ----------------------------------------------------------
+
+    def call(self, name: str, *args) -> None:
+        """
+        Call a method of the simulation, in the physics thread or process
+        between two batches of steps when a worker runs.
+
+        :param name: Method of Simulation, e.g. "add_particle".
+        :param args: Its arguments, which must be picklable in process mode.
+        """
+        if self._worker is None:
+            if self.simulation is None:
+                raise RuntimeError("start() the runner before calling the simulation it builds")
+            getattr(self.simulation, name)(*args)
+        else:
+            self._commands.put((name, args))
+
+    def add_particle(self, particle: Particle) -> None:
+        """Add a particle to the simulation, see ``call``."""
+        self.call("add_particle", particle)
+
+    # Rendering ------------------------------------------------------------
+
+    def _receive(self) -> None:
+        """Move the snapshots sent by the physics process to the buffer."""
+        # At most what the queue holds: a fast worker would refill it as quickly as it is emptied
+        for _ in range(SNAPSHOT_QUEUE_SIZE):
+            try:
+                self.buffer.publish(self._snapshots.get_nowait())
+            except queue.Empty:
+                return
+
+    def _check_worker(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("The physics thread failed") from self._error
+        if self.mode == "process" and not self._worker.is_alive():
+            raise RuntimeError(f"The physics process exited with code {self._worker.exitcode}")
+
+    def frame(self) -> ParticleSystem:
+        """
+        Advance to the next displayed frame.
+
+        In sync mode this runs ``substeps`` steps and returns the particles of
+        the simulation; otherwise it returns the latest published state,
+        interpolated when enabled. Trails drawn from the returned system are
+        kept between frames either way.
+
+        :return: The particles to draw.
+        """
+        self.frame_count += 1
+        self.profiler.start_step(self.frame_count)
+        if self._worker is None:
+            if self.mode != "sync":
+                raise RuntimeError("start() the runner before drawing frames")
+            for _ in range(self.substeps):
+                self.simulation.step()
+            self.profiler.count("physics_steps", self.simulation.step_count - self._last_step)
+            self._last_step = self.simulation.step_count
+            return self.simulation.particles
+
+        self.view.keep_trails()
+        if self.mode == "process":
+            self._receive()
+        self._check_worker()
+        previous, current = self.buffer.latest()
+        if current is None:  # Nothing published yet
+            return self.view.system
+        alpha = 1.0
+        if self.interpolation and previous is not None and current.published > previous.published:
+            alpha = min(1.0, (time.perf_counter() - current.published) / (current.published - previous.published))
+        self.profiler.count("physics_steps", current.step - self._last_step)
+        self._last_step = current.step
+        return self.view.update(previous, current, alpha)
+
+    @property
+    def step_count(self) -> int:
+        """Step of the state returned by the last ``frame``."""
+        return self._last_step
+
+    def profile(self) -> tuple[dict, dict]:
+        """
+        Timings of the physics (per step) and of the rendering (per frame),
+        with their counters, for ``format_summary``.
+        """
+        if self._worker is None:
+            summary, counters = self.simulation.profiler.summary(), self.simulation.profiler.last_counters()
+        else:
+            current = self.buffer.current
+            summary, counters = current.profile if current is not None else ({}, {})
+        summary = {name: value for name, value in summary.items() if name != "total"}
+        summary.update((name, value) for name, value in self.profiler.summary().items() if name != "total")
+        if summary:
+            summary["total"] = sum(summary.values())
+        return summary, {**counters, **self.profiler.last_counters()}
@@ -0,0 +1,325 @@
+"""
+Declarative scenario files.
+
+A scenario is a JSON file describing a run: the domain, the physics settings,
+the fragmentation parameters, the initial bodies and generators of bodies, the
+outputs and how the run is driven. Every section is optional, missing values
+come from ``simulation/utils/constants.py``. Example::
+
+    {
+        "name": "disk",
+        "seed": 1,
+        "domain": {"width": 4000, "height": 4000},
+        "physics": {
+            "gravity_solver": "barnes_hut",
+            "gravity_options": {"g": 4.0, "theta": 0.7},
+            "integrator": "leapfrog",
+            "backend": "numba",
+            "fragmentation": true,
+            "lod": {"max_particles": 1200000, "test_particles": true}
+        },
+        "fragmentation": {"Q_star": 80},
+        "bodies": [
+            {"mass": 50000, "x": 2000, "y": 2000, "radius": 40, "color": [255, 200, 0]}
+        ],
+        "generators": [
+            {"n": 1000000, "distribution": "disk", "center": [2000, 2000], "r_min": 100, "r_max": 1800,
+             "orbit": 50000, "mass": {"loguniform": [1, 50]}, "radius": 2}
+        ],
+        "output": {"trajectory": {"path": "run/", "every": 10}, "diagnostics": {"every": 100, "path": "run/conservation.jsonl"},
+                   "profile": {"path": "run/profile.csv"}},
+        "run": {"steps": 5000}
+    }
+
+Bodies are single particles with explicit values. Generators create ``n``
+particles in one vectorized draw: positions follow their ``distribution``
+("uniform" in a box, "disk" or "gaussian" around a center) unless ``x``/``y``
+are given, and every per-particle value (``mass``, ``radius``, ``x``, ``y``,
+``vx``, ``vy``, ``lifetime``, ``trail_length``) is either a number or one of
+``{"uniform": [low, high]}``, ``{"loguniform": [low, high]}``,
+``{"normal": [mean, std]}``, ``{"integers": [low, high]}`` (inclusive) and
+``{"choice": [v1, v2, ...]}``. As for ``Particle``, particles whose radius is
+not above ``min_particle_radius`` do not collide, have no trail and expire
+after ``fragment_lifetime`` steps unless their ``lifetime`` is given.
+
+Run a scenario with ``python main.py scenarios/default.json``, headless with
+``--steps``.
+"""
+import copy
+import dataclasses
+import json
+
+import numpy as np
+
+from simulation.engine import Simulation
+from simulation.diagnostics import ConservationMonitor
+from simulation.physics.particle import ParticleSystem, COLLIDES, NO_LIFETIME
+from simulation.physics.integrators import get_integrator
+from simulation.physics.lod import LevelOfDetail
+from simulation.io.checkpoint import AutoCheckpoint, load_checkpoint
+from simulation.io.trajectory import TrajectoryWriter
+from simulation.utils.profiling import TraceExporter
+from simulation.utils.constants import (
+    SCREEN_WIDTH, SCREEN_HEIGHT, SEED, G, GRAVITY_SOLVER, INTEGRATOR, BACKEND, CONTACT_POLICY,
+    PARTICLE_RADIUS, DEFAULT_PARTICLE_COLOR, MAX_PARTICLE_TRAIL_LENGTH,
+    CHECKPOINT_PATH, CHECKPOINT_EVERY, RESUME_CHECKPOINT, TRAJECTORY_PATH, TRAJECTORY_EVERY, TRAJECTORY_CHUNK_STEPS,
+    DIAGNOSTICS_EVERY, DIAGNOSTICS_TOLERANCE, DIAGNOSTICS_PATH, PROFILE_PATH,
+    RUN_MODE, PHYSICS_SUBSTEPS, PHYSICS_STEPS_PER_SECOND, FragParams,
+)
+
+DISTRIBUTIONS = ("uniform", "disk", "gaussian")
+SAMPLERS = ("uniform", "loguniform", "normal", "integers", "choice")
+
+# Per-particle values of bodies and generators, with their defaults
+_PARTICLE_FIELDS = {
+    "mass": 1.0,
+    "x": None,
+    "y": None,
+    "vx": 0.0,
+    "vy": 0.0,
+    "radius": PARTICLE_RADIUS,
+    "lifetime": None,  # NO_LIFETIME, or fragment_lifetime for particles too small to collide
+    "trail_length": None,  # MAX_PARTICLE_TRAIL_LENGTH, or 1 for particles too small to collide
+}
+_GENERATOR_KEYS = {"n", "distribution", "box", "center", "r_min", "r_max", "sigma", "orbit", "color", "colors"}
+
+
+def default_scenario() -> dict:
+    """Scenario with every setting taken from the constants and no particle."""
+    return {
+        "name": "default",
+        "description": "",
+        "seed": SEED,
+        "domain": {"width": SCREEN_WIDTH, "height": SCREEN_HEIGHT},
+        "physics": {
+            "dt": 1,
+            "gravity_solver": GRAVITY_SOLVER,
+            "gravity_options": {},
+            "integrator": INTEGRATOR,
+            "integrator_options": {},
+            "backend": BACKEND,
+            "fragmentation": False,
+            "contact_policy": CONTACT_POLICY,
+            "lod": LevelOfDetail().options(),
+        },
+        "fragmentation": dataclasses.asdict(FragParams()),
+        "bodies": [],
+        "generators": [],
+        "output": {
+            "checkpoint": {"path": CHECKPOINT_PATH, "every": CHECKPOINT_EVERY},
+            "trajectory": {"path": TRAJECTORY_PATH, "every": TRAJECTORY_EVERY, "chunk_steps": TRAJECTORY_CHUNK_STEPS},
+            "diagnostics": {"every": DIAGNOSTICS_EVERY, "tolerance": DIAGNOSTICS_TOLERANCE, "path": DIAGNOSTICS_PATH},
+            "profile": {"path": PROFILE_PATH},
+            "resume": RESUME_CHECKPOINT,
+        },
+        "run": {"mode": RUN_MODE, "substeps": PHYSICS_SUBSTEPS, "steps_per_second": PHYSICS_STEPS_PER_SECOND, "steps": None},
+    }
+
+
+def _merge(defaults: dict, values: dict, where: str) -> dict:
+    """Recursively override ``defaults`` with ``values``, rejecting unknown keys."""
+    merged = copy.deepcopy(defaults)
+    for key, value in values.items():
+        if key not in defaults:
+            raise ValueError(f"{where}: unknown key {key!r}, expected one of {sorted(defaults)}")
+        # Option dictionaries are free-form, the other sections are merged key by key
+        if isinstance(defaults[key], dict) and defaults[key] and isinstance(value, dict):
+            merged[key] = _merge(defaults[key], value, f"{where}.{key}")
+        else:
+            merged[key] = value
+    return merged
+
+
+def _check_particles(entries: list, allowed: set, where: str) -> None:
+    for k, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"{where}[{k}] must be an object")
+        unknown = set(entry) - allowed
+        if unknown:
+            raise ValueError(f"{where}[{k}]: unknown keys {sorted(unknown)}, expected some of {sorted(allowed)}")
+
+
+def parse_scenario(data: dict, where: str = "scenario") -> dict:
+    """
+    Validate a scenario and fill in the defaults.
+
+    :param data: Decoded JSON of a scenario.
+    :param where: Name used in the error messages, e.g. the file name.
+    :return: Complete scenario dictionary.
+    :raise ValueError: On unknown keys or invalid values.
+    """
+    scenario = _merge(default_scenario(), data, where)
+    _check_particles(scenario["bodies"], set(_PARTICLE_FIELDS) | {"color"}, f"{where}.bodies")
+    _check_particles(scenario["generators"], set(_PARTICLE_FIELDS) | _GENERATOR_KEYS, f"{where}.generators")
+    for k, body in enumerate(scenario["bodies"]):
+        missing = {"mass", "x", "y"} - set(body)
+        if missing:
+            raise ValueError(f"{where}.bodies[{k}]: missing {sorted(missing)}")
+    for k, generator in enumerate(scenario["generators"]):
+        if not isinstance(generator.get("n"), int) or generator["n"] < 0:
+            raise ValueError(f"{where}.generators[{k}]: 'n' must be a non-negative integer")
+        if generator.get("distribution", "uniform") not in DISTRIBUTIONS:
+            raise ValueError(f"{where}.generators[{k}]: unknown distribution {generator['distribution']!r}, expected one of {DISTRIBUTIONS}")
+    return scenario
+
+
+def load_scenario(path: str) -> dict:
+    """
+    Read and validate a scenario file.
+
+    :param path: JSON scenario file.
+    :return: Complete scenario dictionary, see ``parse_scenario``.
+    """
+    with open(path) as file:
+        return parse_scenario(json.load(file), path)
+
+
+def _sample(spec, n: int, rng: np.random.Generator, where: str) -> np.ndarray:
+    """Draw ``n`` values following a value specification."""
+    if isinstance(spec, (int, float)):
+        return np.full(n, float(spec))
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise ValueError(f"{where}: expected a number or one of {{{', '.join(SAMPLERS)}: [...]}}, got {spec!r}")
+    (kind, args), = spec.items()
+    if kind == "uniform":
+        return rng.uniform(args[0], args[1], n)
+    if kind == "loguniform":
+        return np.exp(rng.uniform(np.log(args[0]), np.log(args[1]), n))
+    if kind == "normal":
+        return rng.normal(args[0], args[1], n)
+    if kind == "integers":
+        return rng.integers(args[0], args[1], n, endpoint=True).astype(np.float64)
+    if kind == "choice":
+        return rng.choice(np.asarray(args, dtype=np.float64), n)
+    raise ValueError(f"{where}: unknown sampler {kind!r}, expected one of {SAMPLERS}")
+
+
+def _positions(generator: dict, n: int, rng: np.random.Generator, width: float, height: float) -> tuple[np.ndarray, np.ndarray]:
+    """Positions drawn from the distribution of a generator."""
+    distribution = generator.get("distribution", "uniform")
+    center = generator.get("center", (width / 2, height / 2))
+    if distribution == "uniform":
+        x0, y0, x1, y1 = generator.get("box", (0, 0, width, height))
+        return rng.uniform(x0, x1, n), rng.uniform(y0, y1, n)
+    if distribution == "gaussian":
+        sigma = generator.get("sigma", min(width, height) / 6)
+        return rng.normal(center[0], sigma, n), rng.normal(center[1], sigma, n)
+    # Disk (or annulus): uniform in area
+    r_min = generator.get("r_min", 0.0)
+    r_max = generator.get("r_max", min(width, height) / 2)
+    r = np.sqrt(rng.uniform(r_min**2, r_max**2, n))
+    angle = rng.uniform(0, 2 * np.pi, n)
+    return center[0] + r * np.cos(angle), center[1] + r * np.sin(angle)
+
+
+def _colors(entry: dict, n: int, rng: np.random.Generator):
+    """Color of each particle: one shared color or a random choice in ``colors``."""
+    if "colors" in entry:
+        palette = [tuple(color) if isinstance(color, list) else color for color in entry["colors"]]
+        return [palette[k] for k in rng.integers(0, len(palette), n).tolist()]
+    color = entry.get("color", DEFAULT_PARTICLE_COLOR)
+    return tuple(color) if isinstance(color, list) else color
+
+
+def _add(particles: ParticleSystem, entry: dict, n: int, rng: np.random.Generator, params: FragParams, g: float, where: str) -> None:
+    """Draw the values of ``n`` particles described by a body or a generator and add them."""
+    values = {}
+    for name, default in _PARTICLE_FIELDS.items():
+        if name in entry:
+            values[name] = _sample(entry[name], n, rng, f"{where}.{name}")
+        elif default is not None:
+            values[name] = np.full(n, float(default))
+    if "x" not in values or "y" not in values:
+        x, y = _positions(entry, n, rng, particles.width, particles.height)
+        values.setdefault("x", x)
+        values.setdefault("y", y)
+
+    orbit = entry.get("orbit")
+    if orbit:  # Circular velocity around a central mass at the center of the distribution
+        center = entry.get("center", (particles.width / 2, particles.height / 2))
+        dx, dy = values["x"] - center[0], values["y"] - center[1]
+        r = np.maximum(np.hypot(dx, dy), 1e-12)
+        speed = np.sqrt(g * orbit / r)
+        values["vx"] = values["vx"] - speed * dy / r
+        values["vy"] = values["vy"] + speed * dx / r
+
+    # Same rule as Particle: bodies too small to collide get no trail and a limited lifetime
+    collides = values["radius"] > params.min_particle_radius
+    lifetime = values.get("lifetime")
+    if lifetime is None:
+        lifetime = np.where(collides, NO_LIFETIME, params.fragment_lifetime)
+    trail = values.get("trail_length")
+    if trail is None:
+        trail = np.where(collides, MAX_PARTICLE_TRAIL_LENGTH, 1)
+    particles.add_batch(
+        mass=values["mass"], x=values["x"], y=values["y"], vx=values["vx"], vy=values["vy"], radius=values["radius"],
+        colors=_colors(entry, n, rng), lifetime=lifetime, flags=np.where(collides, COLLIDES, 0), trail_lengths=trail,
+    )
+
+
+def generate_particles(scenario: dict, rng: np.random.Generator) -> ParticleSystem:
+    """
+    Create the initial particles of a scenario: its bodies, then its generators.
+
+    Each generator is drawn in one vectorized pass, so millions of particles
+    take seconds.
+
+    :param scenario: Complete scenario, from ``load_scenario`` or ``parse_scenario``.
+    :param rng: Random generator drawing the generated values.
+    :return: New particle system, over the domain of the scenario.
+    """
+    n = len(scenario["bodies"]) + sum(generator["n"] for generator in scenario["generators"])
+    domain = scenario["domain"]
+    particles = ParticleSystem(capacity=n, width=domain["width"], height=domain["height"])
+    params = FragParams(**scenario["fragmentation"])
+    g = scenario["physics"]["gravity_options"].get("g", G)
+    for k, body in enumerate(scenario["bodies"]):
+        _add(particles, body, 1, rng, params, g, f"bodies[{k}]")
+    for k, generator in enumerate(scenario["generators"]):
+        _add(particles, generator, generator["n"], rng, params, g, f"generators[{k}]")
+    return particles
+
+
+def build_simulation(scenario: dict, outputs: bool = True) -> Simulation:
+    """
+    Create the simulation of a scenario, resuming from its checkpoint if it has one.
+
+    Module-level and taking a dictionary, so that ``functools.partial(build_simulation, scenario)``
+    can be sent to the physics process of a SimulationRunner.
+
+    :param scenario: Complete scenario.
+    :param outputs: Attach the checkpoint, trajectory, diagnostics and profile observers of the scenario.
+    :return: The simulation, with its initial particles.
+    """
+    physics = scenario["physics"]
+    output = scenario["output"]
+    if output["resume"] is not None:
+        simulation = load_checkpoint(output["resume"])
+    else:
+        simulation = Simulation(
+            dt=physics["dt"],
+            gravity_solver=physics["gravity_solver"],
+            gravity_options=physics["gravity_options"],
+            integrator=get_integrator(physics["integrator"], **physics["integrator_options"]),
+            backend=physics["backend"],
+            fragmentation=physics["fragmentation"],
+            contact_policy=physics["contact_policy"],
+            lod=LevelOfDetail(**physics["lod"]),
+            params=FragParams(**scenario["fragmentation"]),
+            seed=scenario["seed"],
+        )
+        simulation.particles = generate_particles(scenario, simulation.rng)
+
+    if outputs:
+        checkpoint = output["checkpoint"]
+        if checkpoint["every"]:
+            simulation.add_observer(AutoCheckpoint(checkpoint["path"], checkpoint["every"]))
+        trajectory = output["trajectory"]
+        if trajectory["path"] is not None:
+            simulation.add_observer(TrajectoryWriter(trajectory["path"], trajectory["every"], trajectory["chunk_steps"]))
+        diagnostics = output["diagnostics"]
+        if diagnostics["every"]:
+            simulation.add_observer(ConservationMonitor(diagnostics["every"], diagnostics["tolerance"], diagnostics["path"]))
+        if output["profile"]["path"] is not None:
+            simulation.add_observer(TraceExporter(output["profile"]["path"]))
+    return simulation
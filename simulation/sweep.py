@@ -0,0 +1,240 @@
+"""
+Parameter sweeps over FragParams.
+
+Every combination of fragmentation parameters and seed is simulated headless
+in a process pool, and a line of summary metrics is appended to a JSON Lines
+file as soon as each run finishes.
+
+Example::
+
+    python -m simulation.sweep --steps 500 --seeds 0 1 2 \
+        --grid Q_star=25,50,100 k_ej=0.05,0.1 --output sweep.jsonl
+
+With ``--scenario``, every run is built from a scenario file by
+``build_simulation``, with its fragmentation enabled and the swept
+parameters: the initial particles, the solver, the integrator, the backend,
+the time step, the gravity options and the level of detail all come from the
+scenario, and its fragmentation section gives the parameters that are not
+swept. Its outputs (checkpoints, trajectories, diagnostics) are not attached.
+"""
+import argparse
+import copy
+import dataclasses
+import itertools
+import json
+import os
+import time
+from multiprocessing import Pool
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+from simulation.engine import Simulation
+from simulation.diagnostics import system_potential_energy
+from simulation.physics.particle import ParticleSystem, FRAGMENT
+from simulation.physics.forces import kinetic_energy
+from simulation.scenario import load_scenario, build_simulation
+from simulation.utils.constants import FragParams, SCREEN_WIDTH, SCREEN_HEIGHT
+
+
+class SweepTask(NamedTuple):
+    params: FragParams
+    seed: int
+    n_steps: int
+    setup: Callable[[np.random.Generator], ParticleSystem]
+    scenario: Optional[dict] = None  # Builds the simulation instead of setup
+
+
+def random_bodies(rng: np.random.Generator, n: int = 40) -> ParticleSystem:
+    """
+    Default initial conditions of a sweep: bodies with random masses, positions
+    and velocities, dense enough for collisions to happen.
+
+    :param rng: Random generator of the run.
+    :param n: Number of bodies.
+    """
+    particles = ParticleSystem(capacity=n)
+    particles.add_batch(
+        mass=rng.uniform(50, 400, n),
+        x=rng.uniform(0, SCREEN_WIDTH, n),
+        y=rng.uniform(0, SCREEN_HEIGHT, n),
+        vx=rng.integers(-6, 7, n),
+        vy=rng.integers(-6, 7, n),
+        radius=10,
+    )
+    return particles
+
+
+def param_grid(base: FragParams = FragParams(), **values) -> list[FragParams]:
+    """
+    Build every combination of parameter values.
+
+    :param base: Parameters used for the fields that are not swept.
+    :param values: Field name -> list of values.
+    :return: List of FragParams.
+    """
+    names = list(values)
+    return [
+        dataclasses.replace(base, **dict(zip(names, combination)))
+        for combination in itertools.product(*(values[name] for name in names))
+    ]
+
+
+def random_params(n: int, seed: int = 0, base: FragParams = FragParams(), **ranges) -> list[FragParams]:
+    """
+    Draw parameters uniformly at random.
+
+    :param n: Number of parameter sets.
+    :param seed: Seed of the draw.
+    :param base: Parameters used for the fields that are not swept.
+    :param ranges: Field name -> (low, high). Integer fields get integer values.
+    :return: List of FragParams.
+    """
+    rng = np.random.default_rng(seed)
+    types = {field.name: field.type for field in dataclasses.fields(FragParams)}
+    samples = []
+    for _ in range(n):
+        values = {}
+        for name, (low, high) in ranges.items():
+            if types[name] in (int, "int"):
+                values[name] = int(rng.integers(low, high + 1))
+            else:
+                values[name] = float(rng.uniform(low, high))
+        samples.append(dataclasses.replace(base, **values))
+    return samples
+
+
+def total_energy(simulation: Simulation) -> float:
+    """Kinetic plus potential energy of the particles, see ``system_potential_energy``."""
+    particles = simulation.particles
+    return kinetic_energy(particles.mass, particles.vx, particles.vy) + system_potential_energy(simulation)
+
+
+def mass_spectrum(mass: np.ndarray, bins: int = 20) -> dict:
+    """
+    Histogram of the masses on logarithmic bins.
+
+    :return: Dictionary with the bin edges and the counts.
+    """
+    if len(mass) == 0:
+        return {"edges": [], "counts": []}
+    low, high = mass.min(), mass.max()
+    edges = np.geomspace(low, high if high > low else low * 1.000001, bins + 1)
+    counts, edges = np.histogram(mass, bins=edges)
+    return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def run_task(task: SweepTask) -> dict:
+    """
+    Run one simulation and summarize it. Deterministic for a given seed.
+
+    :param task: Parameters, seed, number of steps and setup function or scenario.
+    :return: Dictionary of metrics.
+    """
+    if task.scenario is not None:
+        scenario = copy.deepcopy(task.scenario)
+        scenario["seed"] = task.seed
+        scenario["physics"]["fragmentation"] = True
+        scenario["fragmentation"] = dataclasses.asdict(task.params)
+        simulation = build_simulation(scenario, outputs=False)
+    else:
+        simulation = Simulation(fragmentation=True, params=task.params, seed=task.seed)
+        simulation.particles = task.setup(simulation.rng)
+    particles = simulation.particles
+    n_initial = len(particles)
+
+    start_energy = total_energy(simulation)
+    start = time.perf_counter()
+    simulation.run(task.n_steps)
+    wall_time = time.perf_counter() - start
+    particles = simulation.particles
+    end_energy = total_energy(simulation)
+
+    fragments = (particles.flags & FRAGMENT) != 0
+    return {
+        "params": dataclasses.asdict(task.params),
+        "seed": task.seed,
+        "steps": task.n_steps,
+        "fragments_created": int(particles.next_id - n_initial),
+        "fragments_alive": int(fragments.sum()),
+        "particles_alive": len(particles),
+        "mass_spectrum": mass_spectrum(particles.mass),
+        "energy_start": start_energy,
+        "energy_end": end_energy,
+        "energy_drift": (end_energy - start_energy) / abs(start_energy) if start_energy else 0.0,
+        "wall_time": wall_time,
+    }
+
+
+def run_sweep(
+    params: list[FragParams],
+    seeds: list[int],
+    n_steps: int,
+    output: str,
+    processes: int = None,
+    setup: Callable[[np.random.Generator], ParticleSystem] = random_bodies,
+    scenario: Optional[dict] = None,
+) -> list[dict]:
+    """
+    Run every (parameters, seed) combination in a process pool.
+
+    Results are appended to ``output`` (JSON Lines) in completion order, so a
+    partial file is usable if the sweep is interrupted.
+
+    :param params: Parameter sets to simulate.
+    :param seeds: Seeds to simulate for each parameter set.
+    :param n_steps: Number of steps of every run.
+    :param output: Path of the results file.
+    :param processes: Number of worker processes, all the cores by default.
+    :param setup: Picklable function building the initial particles from the random generator of the run.
+    :param scenario: Scenario building every run with ``build_simulation``, in place of ``setup``.
+    :return: List of the results.
+    """
+    tasks = [SweepTask(p, seed, n_steps, setup, scenario) for p in params for seed in seeds]
+    results = []
+    with Pool(processes or os.cpu_count()) as pool, open(output, "a") as file:
+        for result in pool.imap_unordered(run_task, tasks):
+            file.write(json.dumps(result) + "\n")
+            file.flush()
+            results.append(result)
+    return results
+
+
+def _parse_values(text: str) -> tuple[str, list]:
+    """Parse ``name=v1,v2,...`` for --grid."""
+    name, _, values = text.partition("=")
+    return name, [json.loads(value) for value in values.split(",")]
+
+
+def _parse_range(text: str) -> tuple[str, tuple]:
+    """Parse ``name=low:high`` for --random."""
+    name, _, values = text.partition("=")
+    low, high = values.split(":")
+    return name, (float(low), float(high))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Sweep FragParams over headless simulations.")
+    parser.add_argument("--steps", type=int, default=500, help="Steps per run.")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0], help="Seeds simulated for each parameter set.")
+    parser.add_argument("--grid", nargs="*", default=[], metavar="NAME=V1,V2", help="Values of a parameter grid.")
+    parser.add_argument("--random", nargs="*", default=[], metavar="NAME=LOW:HIGH", help="Ranges of random parameters.")
+    parser.add_argument("--samples", type=int, default=10, help="Number of random parameter sets.")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes, all cores by default.")
+    parser.add_argument("--output", default="sweep.jsonl", help="Results file (JSON Lines).")
+    parser.add_argument("--scenario", default=None, help="Scenario file giving the initial particles and the base parameters.")
+    args = parser.parse_args(argv)
+
+    base, scenario = FragParams(), None
+    if args.scenario is not None:
+        scenario = load_scenario(args.scenario)
+        base = FragParams(**scenario["fragmentation"])
+    if args.random:
+        params = random_params(args.samples, base=base, **dict(_parse_range(text) for text in args.random))
+    else:
+        params = param_grid(base, **dict(_parse_values(text) for text in args.grid))
+    run_sweep(params, args.seeds, args.steps, args.output, args.processes, scenario=scenario)
+
+
+if __name__ == "__main__":
+    main()
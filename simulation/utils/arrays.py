@@ -0,0 +1,15 @@
+import numpy as np
+
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Expand ranges into flat indices.
+
+    :param starts: First index of each range.
+    :param counts: Length of each range.
+    :return: Tuple (owner, index) where ``owner`` is the position of the range
+             each index comes from and ``index`` runs over ``[start, start + count)``.
+    """
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(owner.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
@@ -6,11 +6,49 @@ DEFAULT_BACKGROUND_COLOR = (0, 0, 0)  # RGB for black
 DEFAULT_PARTICLE_COLOR = (255, 255, 255)  # RGB for white
 
 FPS = 60  # Frames per second for the simulation
+SEED = None  # Seed of the random generator, None draws a fresh one for every run
+LOG_LEVEL = "WARNING"  # Level of the simulation logs, "INFO" prints a summary of the events of each step
+LOG_MODULES = {}  # Per-module levels, e.g. {"simulation.physics.forces": "DEBUG"}
+RUN_MODE = "sync"  # "sync" (physics in the render loop), "thread" or "process" (physics in a worker, see simulation/runner.py)
+PHYSICS_SUBSTEPS = 1  # Physics steps per frame in sync mode, per published snapshot with a worker
+PHYSICS_STEPS_PER_SECOND = None  # Limit of the physics rate of the workers, None for as fast as the CPU allows
+RENDER_INTERPOLATION = True  # With a worker, draw the state interpolated between the last two snapshots
+PROFILER_ENABLED = True  # Time each phase of the steps (gravity, collisions, rendering, ...)
+PROFILER_WINDOW = 120  # Number of steps averaged by the profiler statistics
+PROFILE_PATH = None  # File receiving the per-step profiler trace at the end of a run (.csv or .json), None disables the export
+PROFILER_HUD = False  # Show the profiler timings on screen at startup, toggled with F3
+CHECKPOINT_PATH = "checkpoint.psim"  # Auto-checkpoint file, may contain {step} to keep every checkpoint
+CHECKPOINT_EVERY = 0  # Steps between two auto-checkpoints, 0 disables them
+RESUME_CHECKPOINT = None  # Path of a checkpoint to resume from instead of the initial conditions
+TRAJECTORY_PATH = None  # Directory where the trajectories are recorded, None disables the recording
+TRAJECTORY_EVERY = 1  # Record one step out of TRAJECTORY_EVERY
+TRAJECTORY_CHUNK_STEPS = 256  # Recorded steps per compressed chunk file
+DIAGNOSTICS_EVERY = 0  # Steps between two samples of the conserved quantities (mass, momentum, energy), 0 disables them
+DIAGNOSTICS_TOLERANCE = 1e-3  # Relative energy change of a stage or of a sampling interval that gets flagged
+DIAGNOSTICS_PATH = None  # JSON Lines file receiving the diagnostics samples, None keeps them in memory only
+DIAGNOSTICS_HISTORY = 1000  # Number of diagnostics samples kept in memory
+DIAGNOSTICS_DIRECT_MAX = 5000  # Above this number of particles the potential energy is estimated with the Barnes-Hut tree
 MAX_PARTICLE_TRAIL_LENGTH = 100  # Maximum length of the particle trail
+TRAIL_MODE = "lines"  # "lines" (polyline of the last positions), "fade" (trails fading on a persistent surface) or None
+TRAIL_FADE = 0.9  # Brightness kept by the faded trails from one frame to the next
+RENDER_PIXEL_RADIUS = 1.5  # Particles with a smaller radius are drawn as a single pixel
 
 G = 4.0 # Gravitational constant
 DEFAULT_SOFTENING = 0  # Softening factor for distance calculations
+GRAVITY_BLOCK_BYTES = 64 * 1024**2  # Memory budget for the pairwise temporaries of the gravity kernel
+GRAVITY_SOLVER = "direct"  # "direct" (exact, O(N²)) or "barnes_hut" (approximate, O(N log N))
+BARNES_HUT_THETA = 0.5  # Opening angle of the Barnes-Hut solver
+BARNES_HUT_LEAF_SIZE = 8  # Maximum number of particles in a leaf of the quadtree
+INTEGRATOR = "euler"  # "euler", "leapfrog", "rk4" or "block" (adaptive block timesteps)
+BLOCK_TIMESTEP_ETA = 0.2  # Accuracy factor of the block timesteps, dt_i = eta * sqrt(radius / |a|)
+BLOCK_TIMESTEP_MAX_LEVEL = 6  # The smallest block timestep is dt / 2**max_level
 PARTICLE_RADIUS = 5  # Default radius for particles
+BROADPHASE_RADIUS_PERCENTILE = 99.0  # Percentile of the colliding radii sizing the broad phase cells, larger bodies are tested on their own
+BACKEND = "numpy"  # "numpy" (reference) or "numba" (optional, compiled kernels running on all cores)
+CONTACT_POLICY = "max"  # How the velocity changes of a particle in several contacts combine: "max", "average" or "sum"
+LOD_MAX_PARTICLES = None  # Particle budget: above it the tiny fragments are merged cell by cell, None disables merging
+LOD_MERGE_CELL = 8.0  # Size of the finest merge cells, doubled until the budget is met
+LOD_TEST_PARTICLES = False  # Particles too small to collide feel the gravity of the others but exert none
 
 # Collision parameters
 Q_star = 10**2 / 2 # Resistance factor for collisions (J/kg)
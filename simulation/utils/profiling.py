@@ -0,0 +1,236 @@
+import csv
+import json
+import os
+from collections import deque
+from time import perf_counter
+from typing import Optional
+
+PHASES = (
+    "gravity",
+    "broad_phase",
+    "narrow_phase",
+    "collision_response",
+    "fragmentation",
+    "integration",
+    "lifetime_culling",
+    "merging",
+    "diagnostics",
+    "rendering",
+)
+
+
+class _NullPhase:
+    """Context manager doing nothing, returned while the profiler is disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    """Times one phase, excluding the time of the phases nested inside it."""
+    __slots__ = ("profiler", "name", "start", "nested")
+
+    def __init__(self, profiler: 'StepProfiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.profiler._stack.append(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        stack = self.profiler._stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        times = self.profiler.current["times"]
+        times[self.name] = times.get(self.name, 0.0) + elapsed - self.nested
+        return False
+
+
+class StepProfiler:
+    """
+    Timers and counters for each phase of the simulation steps.
+
+    Phases are timed with ``with profiler.phase("gravity"):`` blocks; a phase
+    nested in another one is only counted in the inner phase. Each step gets a
+    record of phase times (seconds) and counters. The last ``window`` records
+    are kept for rolling statistics, and every record when ``keep_trace`` is set
+    so that the whole run can be exported to CSV or JSON.
+    """
+    def __init__(self, enabled: bool = True, window: int = 120, keep_trace: bool = False):
+        """
+        :param enabled: When False, phases and counters cost a single attribute check.
+        :param window: Number of steps of the rolling statistics.
+        :param keep_trace: Keep every step record for export.
+        """
+        self.enabled = enabled
+        self.recent = deque(maxlen=window)
+        self.trace = [] if keep_trace else None
+        self.current = self._new_record(0)
+        self._stack = []
+
+    @staticmethod
+    def _new_record(step: int) -> dict:
+        return {"step": step, "times": {}, "counters": {}}
+
+    def phase(self, name: str):
+        """
+        Context manager timing a phase of the current step.
+
+        :param name: Name of the phase, usually one of PHASES.
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Add to a counter of the current step.
+
+        :param name: Name of the counter.
+        :param value: Amount to add.
+        """
+        if self.enabled:
+            counters = self.current["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    def start_step(self, step: int) -> None:
+        """
+        Close the record of the previous step and open a new one. Work done
+        between two steps (such as rendering) belongs to the previous step.
+
+        :param step: Number of the new step.
+        """
+        if not self.enabled:
+            return
+        record = self.current
+        if record["times"] or record["counters"]:
+            self.recent.append(record)
+            if self.trace is not None:
+                self.trace.append(record)
+        self.current = self._new_record(step)
+
+    def summary(self) -> dict:
+        """
+        Mean time per step of each phase over the rolling window.
+
+        :return: Dictionary phase -> milliseconds, plus ``"total"``.
+        """
+        if not self.recent:
+            return {}
+        totals = {}
+        for record in self.recent:
+            for name, seconds in record["times"].items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        means = {name: 1000 * seconds / len(self.recent) for name, seconds in totals.items()}
+        means["total"] = sum(means.values())
+        return means
+
+    def last_counters(self) -> dict:
+        """Counters of the last completed step."""
+        return self.recent[-1]["counters"] if self.recent else {}
+
+    def records(self) -> list[dict]:
+        """Every record kept (the trace, or the rolling window without it) and the step in progress, oldest first."""
+        records = list(self.trace if self.trace is not None else self.recent)
+        if self.current["times"] or self.current["counters"]:
+            records.append(self.current)
+        return records
+
+    def to_csv(self, path: str) -> None:
+        """
+        Write one row per step with the time of each phase (seconds) and each counter.
+
+        :param path: Output file.
+        """
+        records = self.records()
+        phases = sorted({name for record in records for name in record["times"]}, key=_phase_order)
+        counters = sorted({name for record in records for name in record["counters"]})
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["step", *phases, *counters])
+            for record in records:
+                writer.writerow([
+                    record["step"],
+                    *(record["times"].get(name, 0.0) for name in phases),
+                    *(record["counters"].get(name, 0) for name in counters),
+                ])
+
+    def to_json(self, path: str) -> None:
+        """
+        Write the records and the rolling summary as JSON.
+
+        :param path: Output file.
+        """
+        with open(path, "w") as file:
+            json.dump({"summary_ms": self.summary(), "steps": self.records()}, file)
+
+    def export(self, path: str) -> None:
+        """
+        Write the trace as CSV or JSON depending on the extension of ``path``.
+
+        :param path: Output file ending with .csv or .json.
+        """
+        if path.endswith(".csv"):
+            self.to_csv(path)
+        elif path.endswith(".json"):
+            self.to_json(path)
+        else:
+            raise ValueError(f"Unknown trace format for {path!r}, expected .csv or .json")
+
+
+class TraceExporter:
+    """
+    Observer keeping the whole trace of a simulation's profiler and exporting
+    it with ``StepProfiler.export`` when it is closed (end of the run).
+    """
+    def __init__(self, path: str):
+        """
+        :param path: Output file ending with .csv or .json.
+        """
+        if not path.endswith((".csv", ".json")):
+            raise ValueError(f"Unknown trace format for {path!r}, expected .csv or .json")
+        self.path = path
+        self.profiler = None
+
+    def __call__(self, simulation) -> None:
+        if self.profiler is None:
+            self.profiler = simulation.profiler
+            if self.profiler.trace is None:
+                # The record of the current step is still open and gets into the trace
+                self.profiler.trace = []
+
+    def close(self) -> None:
+        """Write the trace."""
+        if self.profiler is not None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.profiler.export(self.path)
+
+
+def _phase_order(name: str) -> tuple:
+    """Sort key listing the known phases first, in step order."""
+    return (PHASES.index(name), "") if name in PHASES else (len(PHASES), name)
+
+
+def format_summary(summary: dict, counters: Optional[dict] = None) -> list[str]:
+    """
+    Lines of text describing a profiler summary, for the HUD or the console.
+
+    :param summary: Result of ``StepProfiler.summary``.
+    :param counters: Counters of the last step to show below the timings.
+    """
+    lines = [f"{name:<18}{summary[name]:8.2f} ms" for name in sorted(summary, key=_phase_order) if name != "total"]
+    if "total" in summary:
+        lines.append(f"{'total':<18}{summary['total']:8.2f} ms")
+    for name, value in (counters or {}).items():
+        lines.append(f"{name:<18}{value:8d}")
+    return lines
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from simulation.physics.backends import BACKENDS
+from simulation.physics.broadphase import SpatialHash
+from simulation.physics.forces import are_colliding
+from simulation.physics.particle import ParticleSystem, COLLIDES
+from simulation.utils.profiling import StepProfiler
+
+
+def add_bodies(particles: ParticleSystem, rng, n: int) -> None:
+    """Mostly small bodies, a few larger than the cells and some that never collide."""
+    radius = np.where(rng.random(n) < 0.005, rng.uniform(20, 80, n), rng.uniform(1, 6, n))
+    particles.add_batch(
+        mass=rng.uniform(1, 10, n),
+        x=rng.uniform(0, particles.width, n),
+        y=rng.uniform(0, particles.height, n),
+        vx=0.0,
+        vy=0.0,
+        radius=radius,
+        flags=np.where(rng.random(n) < 0.1, 0, COLLIDES).astype(np.uint8),
+    )
+
+
+def brute_force(particles: ParticleSystem) -> set:
+    slots = np.flatnonzero(particles.collides)
+    a, b = np.triu_indices(len(slots), 1)
+    i, j = slots[a], slots[b]
+    hit = are_colliding(particles.x, particles.y, particles.radius, i, j)
+    return set(zip(i[hit].tolist(), j[hit].tolist()))
+
+
+def assert_contacts(backend, particles: ParticleSystem, grid: SpatialHash) -> None:
+    grid.update(particles)
+    i, j, _ = backend.contacts(particles, grid, StepProfiler(enabled=False))
+    pairs = list(zip(i.tolist(), j.tolist()))
+    assert (i < j).all()  # No self pair, each pair in a single orientation
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == brute_force(particles)
+
+
+@pytest.mark.parametrize("name", ["numpy", "numba"])
+@pytest.mark.parametrize("seed", range(4))
+def test_contacts_match_brute_force(name, seed):
+    if name == "numba":
+        pytest.importorskip("numba")
+    backend = BACKENDS[name]()
+    rng = np.random.default_rng(seed)
+    particles = ParticleSystem(width=600, height=400)
+    add_bodies(particles, rng, 800)
+    grid = SpatialHash()
+    assert_contacts(backend, particles, grid)
+    assert len(grid.oversized) > 0
+
+    for _ in range(3):
+        # Insertions between updates, then moves, as fragments and the integrator do
+        add_bodies(particles, rng, 50)
+        assert_contacts(backend, particles, grid)
+        particles.x[:] = np.clip(particles.x + rng.normal(0, 15, len(particles)), 0, particles.width)
+        particles.y[:] = np.clip(particles.y + rng.normal(0, 15, len(particles)), 0, particles.height)
+        assert_contacts(backend, particles, grid)
+
+    particles.remove_indices(rng.choice(len(particles), 100, replace=False))
+    assert_contacts(backend, particles, grid)
+    particles.radius[:] *= 3  # Cells too small, the grid is resized
+    assert_contacts(backend, particles, grid)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from simulation.scenario import parse_scenario, build_simulation
+from simulation.io.checkpoint import save_checkpoint, load_checkpoint
+
+
+def colliding_simulation(backend: str = "numpy"):
+    """60 bodies in a small box, fragmenting often, with the leapfrog integrator."""
+    scenario = parse_scenario({
+        "seed": 5,
+        "domain": {"width": 600, "height": 600},
+        "physics": {"integrator": "leapfrog", "fragmentation": True, "backend": backend},
+        "fragmentation": {"min_particle_radius": 3, "fragment_lifetime": 30},
+        "generators": [{"n": 60, "mass": {"uniform": [50, 200]}, "radius": {"uniform": [4, 9]},
+                        "vx": {"normal": [0, 8]}, "vy": {"normal": [0, 8]}}],
+    })
+    return build_simulation(scenario, outputs=False)
+
+
+def assert_same_state(a, b):
+    assert a.step_count == b.step_count
+    for name, _ in type(a.particles)._FIELDS:
+        np.testing.assert_array_equal(getattr(a.particles, name), getattr(b.particles, name), err_msg=name)
+    assert a.rng.bit_generator.state == b.rng.bit_generator.state
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_resume_continues_bit_identically(tmp_path, backend):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    path = str(tmp_path / "run.psim")
+    simulation = colliding_simulation(backend)
+    simulation.run(40)
+    save_checkpoint(simulation, path)
+    resumed = load_checkpoint(path)
+    assert_same_state(simulation, resumed)
+
+    simulation.run(20)
+    resumed.run(20)
+    assert simulation.events.total.get("explosive_collisions", 0) > 0
+    assert_same_state(simulation, resumed)
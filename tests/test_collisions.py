@@ -0,0 +1,32 @@
+import numpy as np
+
+from simulation.physics.particle import ParticleSystem
+from simulation.physics.forces import resolve_elastic_collisions, are_colliding
+
+
+def cluster(seed: int) -> ParticleSystem:
+    """A body touching four others, all with random masses and velocities."""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, 4, endpoint=False) + rng.uniform(0, 0.3, 4)
+    particles = ParticleSystem(capacity=5)
+    particles.add_batch(
+        mass=rng.uniform(1, 10, 5),
+        x=np.r_[500.0, 500 + 9 * np.cos(angles)],
+        y=np.r_[500.0, 500 + 9 * np.sin(angles)],
+        vx=rng.normal(0, 5, 5),
+        vy=rng.normal(0, 5, 5),
+        radius=5,
+    )
+    return particles
+
+
+def test_default_policy_conserves_momentum_without_energy_gain():
+    for seed in range(20):
+        p = cluster(seed)
+        i, j = np.triu_indices(len(p), 1)
+        hit = are_colliding(p.x, p.y, p.radius, i, j)
+        momentum = np.array([p.mass @ p.vx, p.mass @ p.vy])
+        kinetic = 0.5 * p.mass @ (p.vx**2 + p.vy**2)
+        resolve_elastic_collisions(p, i[hit], j[hit])
+        assert np.allclose([p.mass @ p.vx, p.mass @ p.vy], momentum, rtol=0, atol=1e-9)
+        assert 0.5 * p.mass @ (p.vx**2 + p.vy**2) <= kinetic * (1 + 1e-12)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from simulation.scenario import parse_scenario, build_simulation
+from simulation.diagnostics import ConservationLedger
+from simulation.physics.forces import potential_energy
+
+
+def test_collision_stage_records_the_potential_change():
+    scenario = parse_scenario({
+        "seed": 5,
+        "domain": {"width": 600, "height": 600},
+        "physics": {"integrator": "leapfrog", "fragmentation": True},
+        "fragmentation": {"min_particle_radius": 3, "fragment_lifetime": 30},
+        "generators": [{"n": 60, "mass": {"uniform": [50, 200]}, "radius": {"uniform": [4, 9]},
+                        "vx": {"normal": [0, 8]}, "vy": {"normal": [0, 8]}}],
+    })
+    simulation = build_simulation(scenario, outputs=False)
+    ledger = simulation.ledger = ConservationLedger()
+    resolve_collisions = simulation.resolve_collisions
+    changes = []
+
+    def checked():
+        p = simulation.particles
+        before = potential_energy(p.x, p.y, p.mass, p.radius), ledger._step["collisions"][-1]
+        resolve_collisions()
+        after = potential_energy(p.x, p.y, p.mass, p.radius), ledger._step["collisions"][-1]
+        changes.append((after[0] - before[0], after[1] - before[1]))
+
+    simulation.resolve_collisions = checked
+    simulation.run(12)
+    actual, recorded = np.array(changes).T
+    assert np.abs(actual).max() > 100
+    np.testing.assert_allclose(recorded, actual, rtol=1e-9, atol=1e-6)
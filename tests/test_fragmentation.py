@@ -0,0 +1,38 @@
+import numpy as np
+
+from simulation.physics.particle import ParticleSystem
+from simulation.physics.forces import resolve_fragmentations
+from simulation.utils.constants import FragParams
+
+
+def victim_and_impactors(n_impactors: int) -> ParticleSystem:
+    """A mass-10 victim at the center of a ring of mass-100 impactors rushing at it."""
+    angles = np.linspace(0, 2 * np.pi, n_impactors, endpoint=False)
+    particles = ParticleSystem(capacity=n_impactors + 1)
+    particles.add_batch(
+        mass=np.r_[10.0, np.full(n_impactors, 100.0)],
+        x=np.r_[500.0, 500 + 8 * np.cos(angles)],
+        y=np.r_[500.0, 500 + 8 * np.sin(angles)],
+        vx=np.r_[0.0, -50 * np.cos(angles)],
+        vy=np.r_[0.0, -50 * np.sin(angles)],
+        radius=5,
+    )
+    return particles
+
+
+def test_multi_hit_fragmentation_conserves_mass():
+    particles = victim_and_impactors(2)
+    total = particles.mass.sum()
+    new_ids = resolve_fragmentations(particles, np.array([0, 0]), np.array([1, 2]), FragParams(), np.random.default_rng(0))
+    assert len(new_ids) > 0
+    assert np.isclose(particles.mass.sum(), total, rtol=1e-12)
+    assert 0 < particles.mass[0] < 10
+
+
+def test_fragments_never_exceed_the_victim_mass():
+    particles = victim_and_impactors(20)
+    total = particles.mass.sum()
+    resolve_fragmentations(particles, np.zeros(20, dtype=np.int64), np.arange(1, 21), FragParams(), np.random.default_rng(0))
+    assert np.isclose(particles.mass.sum(), total, rtol=1e-12)
+    assert (particles.mass >= 0).all()
+    assert particles.lifetime[0] == 0  # Destroyed
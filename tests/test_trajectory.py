@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+
+from simulation.io.checkpoint import save_checkpoint, load_checkpoint
+from simulation.io.trajectory import TrajectoryWriter, TrajectoryReader
+from test_checkpoint import colliding_simulation
+
+
+def record(simulation, directory: str, steps: int) -> None:
+    with TrajectoryWriter(directory, chunk_steps=16) as writer:
+        simulation.add_observer(writer)
+        simulation.run(steps)
+        simulation.remove_observer(writer)
+
+
+def assert_same_recording(a: TrajectoryReader, b: TrajectoryReader):
+    np.testing.assert_array_equal(a.steps(), b.steps())
+    for frame_a, frame_b in zip(a.frames(), b.frames()):
+        np.testing.assert_array_equal(frame_a.ids, frame_b.ids)
+        for name in a.fields:
+            np.testing.assert_array_equal(frame_a.data[name], frame_b.data[name], err_msg=name)
+    for events in ("births", "deaths"):
+        for array_a, array_b in zip(getattr(a, events)(), getattr(b, events)()):
+            np.testing.assert_array_equal(array_a, array_b, err_msg=events)
+    assert a.colors() == b.colors()
+
+
+@pytest.mark.parametrize("checkpoint_step", [48, 40])  # On a chunk boundary, inside a chunk
+def test_resumed_run_continues_the_recording(tmp_path, checkpoint_step):
+    reference = str(tmp_path / "reference")
+    record(colliding_simulation(), reference, 65)
+
+    directory = str(tmp_path / "resumed")
+    simulation = colliding_simulation()
+    record(simulation, directory, checkpoint_step)
+    save_checkpoint(simulation, str(tmp_path / "run.psim"))
+    record(simulation, directory, 50 - checkpoint_step)  # Recorded past the checkpoint, then lost
+    resumed = load_checkpoint(str(tmp_path / "run.psim"))
+    record(resumed, directory, 65 - checkpoint_step)
+
+    reader = TrajectoryReader(directory)
+    np.testing.assert_array_equal(reader.steps(), np.arange(1, 66))
+    assert_same_recording(reader, TrajectoryReader(reference))
+    listed = {entry["file"] for entry in reader.chunks}
+    assert {name for name in os.listdir(directory) if name.endswith(".npz")} == listed